@@ -0,0 +1,307 @@
+"""
+Benchmarks sem hardware: detector, CameraThread, server_pc em loopback com N
+robôs simulados e robot_server com RPi.GPIO falso. Os frames vêm de um vídeo,
+de uma pasta de JPEGs ou de uma cena sintética (--source).
+
+    python bench/bench.py all --out results.json
+    python bench/bench.py detector --imgsz 256 320 416 --backend pytorch onnx --threads 1 4
+    python bench/bench.py compare base.json results.json --threshold 0.10
+
+Cada caso reporta throughput (itens/s), latência p50/p95/p99 e memória (RSS);
+o JSON leva o commit do git para comparar execuções entre commits.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import argparse
+import resource
+import subprocess
+import threading
+import logging
+
+import cv2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.join(ROOT, "src_client-pc"))
+
+from metrics import Histogram
+from recording import ReplayCapture
+from sources import MemorySource, encode_frames, load_frames
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger("bench")
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except Exception:
+        return 0.0
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+def result(hist, count, elapsed, **extra):
+    s = hist.summary()
+    out = {"throughput": count / elapsed if elapsed > 0 else 0.0, "count": count,
+           "p50_ms": s["p50_ms"], "p95_ms": s["p95_ms"], "p99_ms": s["p99_ms"], "max_ms": s["max_ms"],
+           "rss_mb": rss_mb(), "peak_rss_mb": peak_rss_mb()}
+    out.update(extra)
+    return out
+
+def set_threads(n):
+    if not n:
+        return
+    cv2.setNumThreads(n)
+    try:
+        import torch
+        torch.set_num_threads(n)
+    except Exception:
+        pass
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def bench_detector(frames, model, imgszs, backends, threads, n_frames=100, warmup=10):
+    from perception import ObjectDetector
+    results = {}
+    for backend in backends:
+        for imgsz in imgszs:
+            for t in threads:
+                set_threads(t)
+                name = f"detector/{backend}/imgsz{imgsz}/t{t or 'def'}"
+                try:
+                    det = ObjectDetector(model_path=model, backend=backend, imgsz=imgsz, classes=(0, 2))
+                except Exception as e:
+                    log.warning("%s: backend indisponível (%s)", name, e)
+                    continue
+                for i in range(warmup):
+                    det.detect(frames[i % len(frames)], imgsz=imgsz)
+                hist = Histogram()
+                t0 = time.perf_counter()
+                for i in range(n_frames):
+                    t1 = time.perf_counter()
+                    det.detect(frames[i % len(frames)], imgsz=imgsz)
+                    hist.observe(time.perf_counter() - t1)
+                results[name] = result(hist, n_frames, time.perf_counter() - t0)
+                log.info("%s: %.1f fps, p95 %.1f ms", name, results[name]["throughput"], results[name]["p95_ms"])
+    return results
+
+def bench_camera(frames, fps=None, seconds=5.0):
+    """CameraThread alimentado por frames em memória (ReplayCapture); mede frames entregues e a idade do frame na leitura."""
+    from perception import CameraThread
+    h, w = frames[0].shape[:2]
+    cam = CameraThread(width=w, height=h, use_picamera=False, capture=ReplayCapture(MemorySource(frames, fps=fps)))
+    cam.start()
+    hist = Histogram()
+    last_id = 0
+    count = skipped = 0
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        packet = cam.read_packet(after_id=last_id, timeout=1.0)
+        if packet is None:
+            continue
+        hist.observe(max(0.0, time.time() - packet.timestamp))
+        if last_id and packet.frame_id > last_id + 1:
+            skipped += packet.frame_id - last_id - 1
+        last_id = packet.frame_id
+        count += 1
+    elapsed = time.perf_counter() - t0
+    cam.stop()
+    name = f"camera/{'max' if not fps else f'{fps:g}fps'}"
+    return {name: result(hist, count, elapsed, skipped=skipped)}
+
+def bench_server(jpegs, clients=(1, 2, 4), seconds=10.0, imgsz=320, model="yolov8n.pt", workers=0, window=2):
+    """server_pc em loopback; cada cliente simulado manda os JPEGs em loop o mais rápido que a janela deixa."""
+    import server_pc
+    from robot_client import StreamClient
+
+    results = {}
+    for n in clients:
+        port = free_port()
+        # um servidor por caso, encerrado no fim: o próximo não divide CPU/memória com o anterior
+        server_stop = threading.Event()
+        server = threading.Thread(target=server_pc.run_server, daemon=True,
+                                  kwargs=dict(host="127.0.0.1", port=port, imgsz=imgsz, model_name=model,
+                                              headless=True, workers=workers, stop_event=server_stop))
+        server.start()
+        deadline = time.perf_counter() + 600.0
+        while time.perf_counter() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+                break
+            except OSError:
+                time.sleep(0.2)
+        hist = Histogram()
+        replies = [0]
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        def stream(i):
+            sock = socket.create_connection(("127.0.0.1", port))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(3.0)
+            client = None
+
+            def on_command(seq, cmd, fields):
+                hist.observe(client.rtt)
+                with lock:
+                    replies[0] += 1
+            client = StreamClient(sock, window=window, on_command=on_command)
+            client.start()
+            k = i
+            try:
+                while not stop.is_set() and client.running:
+                    client.send_frame(jpegs[k % len(jpegs)])
+                    k += 1
+            except ConnectionError:
+                pass
+            finally:
+                client.close()
+
+        threads = [threading.Thread(target=stream, args=(i,), daemon=True) for i in range(n)]
+        t0 = time.perf_counter()
+        for t in threads:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        elapsed = time.perf_counter() - t0
+        for t in threads:
+            t.join(timeout=5.0)
+        name = f"server/clients{n}/workers{workers}/imgsz{imgsz}"
+        results[name] = result(hist, replies[0], elapsed, per_client=replies[0] / elapsed / n)
+        log.info("%s: %.1f replies/s, rtt p95 %.1f ms", name, results[name]["throughput"], results[name]["p95_ms"])
+        server_stop.set()
+        server.join(timeout=10.0)
+    return results
+
+def bench_robot(n_commands=500):
+    """robot_server com GPIO falso: latência de envio do comando até a escrita no pino."""
+    import gpio_stub
+    gpio_stub.install()
+    import robot_server
+    from command_link import CommandLink
+
+    robot_server.log.setLevel(logging.WARNING)
+    port = free_port()
+    threading.Thread(target=robot_server.run_server, kwargs=dict(host="127.0.0.1", port=port, deadman=0),
+                     daemon=True).start()
+    time.sleep(0.3)
+    link = CommandLink("127.0.0.1", port)
+    hist = Histogram()
+    cmds = ("FORWARD", "STOP", "LEFT", "STOP", "RIGHT", "STOP", "BACK", "STOP")
+    t0 = time.perf_counter()
+    done = 0
+    for i in range(n_commands):
+        before = len(gpio_stub.events)
+        t1 = time.perf_counter()
+        link.send(cmds[i % len(cmds)])
+        if gpio_stub.wait_event(before, timeout=1.0) > before:
+            hist.observe(gpio_stub.events[before][0] - t1)
+            done += 1
+    elapsed = time.perf_counter() - t0
+    link.close()
+    return {"robot/command_to_gpio": result(hist, done, elapsed, binary=link.binary)}
+
+def compare(base_path, new_path, threshold=0.10):
+    """Compara dois JSONs; devolve 1 se algum caso perdeu mais que threshold em throughput ou p95."""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"base {base['meta'].get('commit')}  ->  novo {new['meta'].get('commit')}")
+    print(f"{'caso':48s} {'throughput':>22s} {'p95 ms':>22s}")
+    regressions = 0
+    for name in sorted(set(base["results"]) & set(new["results"])):
+        b, n = base["results"][name], new["results"][name]
+        dt = (n["throughput"] - b["throughput"]) / b["throughput"] if b["throughput"] else 0.0
+        dp = (n["p95_ms"] - b["p95_ms"]) / b["p95_ms"] if b["p95_ms"] else 0.0
+        bad = dt < -threshold or dp > threshold
+        regressions += bad
+        print(f"{name:48s} {b['throughput']:8.1f} -> {n['throughput']:8.1f} ({dt:+6.1%}) "
+              f"{b['p95_ms']:7.1f} -> {n['p95_ms']:7.1f} ({dp:+6.1%}){'  REGRESSÃO' if bad else ''}")
+    for name in sorted(set(base["results"]) ^ set(new["results"])):
+        print(f"{name:48s} só em {'base' if name in base['results'] else 'novo'}")
+    return 1 if regressions else 0
+
+def meta():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        commit = None
+    return {"commit": commit, "time": time.time(), "python": platform.python_version(),
+            "machine": platform.machine(), "cpus": os.cpu_count(), "opencv": cv2.__version__}
+
+def main():
+    p = argparse.ArgumentParser()
+    sub = p.add_subparsers(dest="cmd", required=True)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--source", default=None, help="vídeo ou pasta de JPEGs (padrão: cena sintética)")
+    common.add_argument("--max-frames", type=int, default=300)
+    common.add_argument("--model", default="yolov8n.pt")
+    common.add_argument("--out", default=None, help="gravar resultados em JSON")
+
+    d = sub.add_parser("detector", parents=[common])
+    d.add_argument("--imgsz", type=int, nargs="+", default=[320])
+    d.add_argument("--backend", nargs="+", default=["pytorch"])
+    d.add_argument("--threads", type=int, nargs="+", default=[0], help="0 = padrão do runtime")
+    d.add_argument("--frames", type=int, default=100)
+
+    c = sub.add_parser("camera", parents=[common])
+    c.add_argument("--fps", type=float, default=None, help="FPS da fonte (padrão: sem limite)")
+    c.add_argument("--seconds", type=float, default=5.0)
+
+    s = sub.add_parser("server", parents=[common])
+    s.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4])
+    s.add_argument("--seconds", type=float, default=10.0)
+    s.add_argument("--imgsz", type=int, default=320)
+    s.add_argument("--workers", type=int, default=0)
+
+    r = sub.add_parser("robot", parents=[common])
+    r.add_argument("--commands", type=int, default=500)
+
+    sub.add_parser("all", parents=[common])
+
+    cmp_ = sub.add_parser("compare")
+    cmp_.add_argument("base")
+    cmp_.add_argument("new")
+    cmp_.add_argument("--threshold", type=float, default=0.10, help="variação relativa tolerada")
+
+    args = p.parse_args()
+    if args.cmd == "compare":
+        sys.exit(compare(args.base, args.new, args.threshold))
+
+    frames = load_frames(args.source, args.max_frames)
+    results = {}
+    if args.cmd in ("detector", "all"):
+        results.update(bench_detector(frames, args.model, getattr(args, "imgsz", [320]),
+                                      getattr(args, "backend", ["pytorch"]), getattr(args, "threads", [0]),
+                                      getattr(args, "frames", 100)))
+    if args.cmd in ("camera", "all"):
+        results.update(bench_camera(frames, getattr(args, "fps", None), getattr(args, "seconds", 5.0)))
+    if args.cmd in ("robot", "all"):
+        results.update(bench_robot(getattr(args, "commands", 500)))
+    if args.cmd in ("server", "all"):
+        imgsz = args.imgsz if args.cmd == "server" else 320
+        results.update(bench_server(encode_frames(frames), getattr(args, "clients", [1, 2, 4]),
+                                    getattr(args, "seconds", 10.0), imgsz=imgsz, model=args.model,
+                                    workers=getattr(args, "workers", 0)))
+
+    report = {"meta": meta(), "results": results}
+    for name, r in sorted(results.items()):
+        print(f"{name:48s} {r['throughput']:8.1f}/s  p50 {r['p50_ms']:7.1f}  p95 {r['p95_ms']:7.1f}  "
+              f"p99 {r['p99_ms']:7.1f} ms  rss {r['rss_mb']:6.0f} MB")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        log.info("Resultados em %s", args.out)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Fontes de frames para os benchmarks: vídeo, pasta de JPEGs ou cena sintética
+determinística, carregadas uma vez em memória (frames BGR + JPEGs) para que
+ler/decodificar o arquivo não entre na medida.
+"""
+import os
+import glob
+import time
+import logging
+
+import cv2
+import numpy as np
+
+log = logging.getLogger("bench.sources")
+
+def synthetic_frames(n=120, width=640, height=360, seed=0):
+    """Fundo com ruído fixo e alguns retângulos se movendo (cena reprodutível)."""
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 60, (height, width, 3), dtype=np.uint8)
+    boxes = [(rng.integers(0, width - 80), rng.integers(0, height - 80), rng.integers(-6, 7), rng.integers(-4, 5),
+              tuple(int(c) for c in rng.integers(80, 255, 3))) for _ in range(4)]
+    frames = []
+    for i in range(n):
+        img = base.copy()
+        for x, y, vx, vy, color in boxes:
+            cx = int((x + vx * i) % (width - 80))
+            cy = int((y + vy * i) % (height - 80))
+            cv2.rectangle(img, (cx, cy), (cx + 80, cy + 80), color, -1)
+        frames.append(img)
+    return frames
+
+def load_frames(path=None, max_frames=300, width=640, height=360):
+    """Lista de frames BGR de um vídeo, de uma gravação (recording.py), de uma pasta com *.jpg/*.png ou sintéticos."""
+    if not path:
+        return synthetic_frames(min(max_frames, 120), width, height)
+    frames = []
+    if os.path.exists(path + ".idx"):
+        from recording import Recording
+        rec = Recording(path)
+        frames = [np.array(rec.frame(i)) for i in range(min(max_frames, len(rec.frames)))]
+        rec.close()
+    elif os.path.isdir(path):
+        files = sorted(glob.glob(os.path.join(path, "*.jpg")) + glob.glob(os.path.join(path, "*.png")))
+        for f in files[:max_frames]:
+            img = cv2.imread(f, cv2.IMREAD_COLOR)
+            if img is not None:
+                frames.append(img)
+    else:
+        cap = cv2.VideoCapture(path)
+        while len(frames) < max_frames:
+            ret, img = cap.read()
+            if not ret:
+                break
+            frames.append(img)
+        cap.release()
+    if not frames:
+        raise RuntimeError(f"Nenhum frame lido de {path}")
+    log.info("%d frames carregados de %s", len(frames), path)
+    return frames
+
+def encode_frames(frames, quality=80):
+    return [cv2.imencode(".jpg", f, [int(cv2.IMWRITE_JPEG_QUALITY), quality])[1].tobytes() for f in frames]
+
+class MemorySource:
+    """
+    Frames em memória servidos em loop no FPS dado (None = o mais rápido possível),
+    com a interface de fonte do recording.ReplayCapture (read, isOpened, release).
+    """
+    def __init__(self, frames, fps=30.0, loop=True):
+        self.frames = frames
+        self.period = 1.0 / fps if fps else 0.0
+        self.loop = loop
+        self.index = 0
+        self.next_time = time.perf_counter()
+        self.opened = True
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        if not self.opened or (not self.loop and self.index >= len(self.frames)):
+            return None
+        if self.period:
+            delay = self.next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.next_time = max(self.next_time + self.period, time.perf_counter() - self.period)
+        frame = self.frames[self.index % len(self.frames)]
+        self.index += 1
+        return frame
+
+    def release(self):
+        self.opened = False
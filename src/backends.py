@@ -0,0 +1,153 @@
+# src/backends.py
+import os
+import ast
+import shutil
+import hashlib
+import platform
+import importlib.util
+import logging
+
+from lazy import LazyModule
+
+# ultralytics (e o torch junto) leva segundos para importar no Pi: só no primeiro uso
+ultralytics = LazyModule("ultralytics")
+
+log = logging.getLogger("backends")
+
+BACKENDS = ("pytorch", "onnx", "openvino", "ncnn")
+# formato de export do ultralytics e módulo de runtime necessário para carregar
+EXPORT_FORMATS = {"onnx": "onnx", "openvino": "openvino", "ncnn": "ncnn"}
+RUNTIME_MODULES = {"onnx": "onnxruntime", "openvino": "openvino", "ncnn": "ncnn"}
+# o ultralytics reconhece o backend pelo sufixo do arquivo/diretório exportado
+EXPORT_SUFFIXES = {"onnx": ".onnx", "openvino": "_openvino_model", "ncnn": "_ncnn_model"}
+# só o export OpenVINO quantiza (int8 no ONNX/NCNN sai igual ao float)
+INT8_BACKENDS = ("openvino",)
+# exports com batch dinâmico; o NCNN do ultralytics só lê o primeiro frame do batch
+BATCH_BACKENDS = ("onnx", "openvino")
+
+DEFAULT_CACHE_DIR = os.environ.get("ROBOT_VISION_MODEL_CACHE",
+                                   os.path.join(os.path.expanduser("~"), ".cache", "robot-vision", "models"))
+
+def is_arm():
+    return platform.machine().lower() in ("aarch64", "arm64", "armv7l", "armv8l")
+
+def available_backends():
+    found = [b for b in BACKENDS[1:] if importlib.util.find_spec(RUNTIME_MODULES[b]) is not None]
+    return found + ["pytorch"]
+
+def preferred_backends():
+    """Ordem de preferência para backend="auto": NCNN primeiro em ARM (Pi), OpenVINO em x86."""
+    order = ("ncnn", "onnx", "openvino") if is_arm() else ("openvino", "onnx", "ncnn")
+    available = available_backends()
+    return [b for b in order if b in available] + ["pytorch"]
+
+def resolve_weights(model_path):
+    """Garante o .pt local (o ultralytics baixa os pesos oficiais se faltarem)."""
+    if os.path.exists(model_path):
+        return model_path
+    model = ultralytics.YOLO(model_path)
+    return getattr(model, "ckpt_path", None) or model_path
+
+def model_hash(path, chunk=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()[:12]
+
+def cache_path(weights, backend, imgsz, int8=False, batch=1, cache_dir=DEFAULT_CACHE_DIR):
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    key = f"{stem}-{model_hash(weights)}-{imgsz}"
+    if int8:
+        key += "-int8"
+    if batch > 1:
+        key += f"-b{batch}"
+    return os.path.join(cache_dir, key + EXPORT_SUFFIXES[backend])
+
+def export_model(model_path, backend, imgsz=640, int8=False, batch=1, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Exporta o modelo uma vez para o backend pedido e guarda no cache, indexado
+    pelo hash dos pesos, imgsz, int8 e batch. int8 só vale para INT8_BACKENDS e
+    batch só para BATCH_BACKENDS (os demais saem com batch 1, ver predict).
+    Devolve o caminho exportado.
+    """
+    int8 = int8 and backend in INT8_BACKENDS
+    if backend not in BATCH_BACKENDS:
+        batch = 1
+    weights = resolve_weights(model_path)
+    target = cache_path(weights, backend, imgsz, int8=int8, batch=batch, cache_dir=cache_dir)
+    if os.path.exists(target):
+        return target
+    os.makedirs(cache_dir, exist_ok=True)
+    log.info("Exportando %s para %s (imgsz=%d, int8=%s)...", weights, backend, imgsz, int8)
+    kwargs = {"format": EXPORT_FORMATS[backend], "imgsz": imgsz, "int8": int8}
+    if batch > 1:
+        kwargs["batch"] = batch
+        kwargs["dynamic"] = True
+    exported = ultralytics.YOLO(weights).export(**kwargs)
+    shutil.move(str(exported), target)
+    return target
+
+class OnnxRuntimeModel:
+    """
+    Roda um .onnx exportado pelo ultralytics direto no ONNX Runtime: recebe o
+    blob (1,3,imgsz,imgsz) e devolve a saída bruta, sem montar Results.
+    """
+    def __init__(self, path, threads=None):
+        import onnxruntime as ort
+        opts = ort.SessionOptions()
+        if threads:
+            opts.intra_op_num_threads = int(threads)
+        self.path = path
+        self.session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        meta = self.session.get_modelmeta().custom_metadata_map
+        try:
+            self.names = ast.literal_eval(meta.get("names", "{}"))
+        except (ValueError, SyntaxError):
+            self.names = {}
+
+    def __call__(self, blob):
+        return self.session.run(None, {self.input_name: blob})[0]
+
+def load_model(model_path, backend="auto", imgsz=640, int8=False, batch=1, cache_dir=DEFAULT_CACHE_DIR, raw=False):
+    """
+    Carrega o modelo no backend pedido; "auto" tenta os runtimes disponíveis em
+    ordem de preferência e cai para PyTorch se nenhum export funcionar.
+    Com raw=True o backend ONNX volta como OnnxRuntimeModel (saída bruta) em vez
+    de um YOLO. Devolve (model, backend_usado).
+    """
+    if backend == "auto":
+        candidates = preferred_backends()
+    elif backend in BACKENDS:
+        candidates = [backend]
+    else:
+        raise ValueError(f"Backend desconhecido: {backend}")
+
+    for name in candidates:
+        if name == "pytorch":
+            return ultralytics.YOLO(model_path), "pytorch"
+        try:
+            path = export_model(model_path, name, imgsz=imgsz, int8=int8, batch=batch, cache_dir=cache_dir)
+            model = OnnxRuntimeModel(path) if raw and name == "onnx" else ultralytics.YOLO(path, task="detect")
+            log.info("Modelo carregado com backend %s: %s", name, path)
+            return model, name
+        except Exception as e:
+            if backend != "auto":
+                raise
+            log.warning("Backend %s indisponível (%s); tentando o próximo.", name, e)
+
+def predict(model, backend, frames, batch=1, **kwargs):
+    """
+    Roda frames num YOLO carregado por load_model e devolve um Results por frame.
+    batch é o tamanho com que o modelo foi carregado: PyTorch e exports dinâmicos
+    (batch > 1) recebem a lista numa chamada; exports de batch fixo 1 (e NCNN)
+    rodam um frame por chamada.
+    """
+    frames = list(frames)
+    if backend == "pytorch" or (backend in BATCH_BACKENDS and batch > 1):
+        return list(model(frames, **kwargs))
+    results = []
+    for frame in frames:
+        results.extend(model(frame, **kwargs))
+    return results
@@ -0,0 +1,93 @@
+# src/command_link.py
+"""
+Link de comandos visão -> robot_server.
+
+Texto (legado): "FORWARD\n".
+Binário (negociado): o cliente envia HELLO_BIN; se o servidor responder ACK_BIN,
+cada comando passa a ser um frame fixo de 16 bytes:
+[sync:u8][opcode:u8][left:i8][right:i8][seq:u32][send_ts:f64]
+left/right são a velocidade por roda em % (-100..100), send_ts é time.time() (o
+robot_server mede a idade contra o offset de relógio da conexão, sem exigir NTP).
+DRIVE manda as duas rodas direto (direção proporcional); em texto: "DRIVE 40 60\n".
+"""
+import socket
+import struct
+import time
+import logging
+
+log = logging.getLogger("command_link")
+
+HELLO_BIN = b"HELLO BIN1\n"
+ACK_BIN = b"OK BIN1\n"
+SYNC = 0xA5
+CMD_FRAME = struct.Struct(">BBbbId")
+
+OPCODES = {"STOP": 0, "FORWARD": 1, "BACK": 2, "LEFT": 3, "RIGHT": 4, "CLEANUP": 5, "DRIVE": 6}
+OPNAMES = {v: k for k, v in OPCODES.items()}
+
+def pack_command(cmd, seq, left=0, right=0, ts=None):
+    return CMD_FRAME.pack(SYNC, OPCODES[cmd], int(left), int(right), seq & 0xFFFFFFFF,
+                          time.time() if ts is None else ts)
+
+def unpack_commands(buf):
+    """
+    Extrai todos os frames completos de buf (bytearray, consumido in-place).
+    Devolve lista de (cmd, left, right, seq, ts); bytes fora de sincronia são descartados.
+    """
+    out = []
+    i = 0
+    n = len(buf)
+    size = CMD_FRAME.size
+    while n - i >= size:
+        if buf[i] != SYNC:
+            i += 1
+            continue
+        _, op, left, right, seq, ts = CMD_FRAME.unpack_from(buf, i)
+        i += size
+        cmd = OPNAMES.get(op)
+        if cmd is None:
+            log.warning("Opcode desconhecido: %d", op)
+            continue
+        out.append((cmd, left, right, seq, ts))
+    del buf[:i]
+    return out
+
+class CommandLink:
+    """Cliente do robot_server; tenta o protocolo binário e cai para texto se o servidor não responder."""
+    def __init__(self, host, port=8000, binary=True, timeout=2.0, hello_timeout=0.5):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        log.info("Conectando em %s:%d ...", host, port)
+        self.sock.connect((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.binary = binary and self._negotiate(hello_timeout)
+        self.sock.settimeout(timeout)
+        self.seq = 0
+        log.info("Link de comandos em modo %s", "binário" if self.binary else "texto")
+
+    def _negotiate(self, hello_timeout):
+        self.sock.sendall(HELLO_BIN)
+        self.sock.settimeout(hello_timeout)
+        reply = b""
+        try:
+            while not reply.endswith(b"\n"):
+                data = self.sock.recv(len(ACK_BIN) - len(reply))
+                if not data:
+                    break
+                reply += data
+        except socket.timeout:
+            pass
+        return reply == ACK_BIN
+
+    def send(self, cmd, left=0, right=0):
+        if self.binary:
+            self.seq += 1
+            self.sock.sendall(pack_command(cmd, self.seq, left, right))
+        else:
+            line = f"DRIVE {int(left)} {int(right)}" if cmd == "DRIVE" else cmd
+            self.sock.sendall((line + "\n").encode("utf-8"))
+
+    def close(self):
+        try:
+            self.sock.close()
+        except Exception:
+            pass
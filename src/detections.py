@@ -0,0 +1,200 @@
+# src/detections.py
+import numpy as np
+import cv2
+
+class Detections:
+    """
+    Resultado enxuto de detecção: arrays NumPy contíguos com as caixas xyxy (N,4),
+    confianças (N,) e ids de classe (N,). Desenhar é opcional (draw_detections).
+    """
+    __slots__ = ("boxes", "confs", "classes")
+
+    def __init__(self, boxes, confs, classes):
+        self.boxes = np.ascontiguousarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.confs = np.ascontiguousarray(confs, dtype=np.float32).reshape(-1)
+        self.classes = np.ascontiguousarray(classes, dtype=np.int32).reshape(-1)
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty((0, 4), np.float32), np.empty(0, np.float32), np.empty(0, np.int32))
+
+    @classmethod
+    def from_ultralytics(cls, r):
+        """Converte um Results do ultralytics com uma única cópia para CPU (boxes.data = x1,y1,x2,y2,conf,cls)."""
+        boxes = getattr(r, "boxes", None)
+        if boxes is None or len(boxes) == 0:
+            return cls.empty()
+        data = boxes.data
+        if hasattr(data, "cpu"):
+            data = data.cpu().numpy()
+        data = np.asarray(data, dtype=np.float32)
+        return cls(data[:, :4], data[:, 4], data[:, 5])
+
+    @classmethod
+    def concat(cls, dets):
+        dets = [d for d in dets if len(d)]
+        if not dets:
+            return cls.empty()
+        return cls(np.concatenate([d.boxes for d in dets]), np.concatenate([d.confs for d in dets]),
+                   np.concatenate([d.classes for d in dets]))
+
+    def __len__(self):
+        return len(self.classes)
+
+    def shifted(self, dx, dy):
+        """Mesmas detecções deslocadas (coordenadas de um recorte -> frame inteiro)."""
+        return Detections(self.boxes + np.array([dx, dy, dx, dy], np.float32), self.confs, self.classes)
+
+    def class_set(self):
+        return frozenset(self.classes.tolist())
+
+    def select(self, mask):
+        return Detections(self.boxes[mask], self.confs[mask], self.classes[mask])
+
+    def filter(self, classes=None, min_conf=None):
+        mask = np.ones(len(self), dtype=bool)
+        if classes is not None:
+            mask &= np.isin(self.classes, np.asarray(list(classes), dtype=np.int32))
+        if min_conf is not None:
+            mask &= self.confs >= min_conf
+        return self if mask.all() else self.select(mask)
+
+def box_iou(a, b):
+    """IoU entre todas as caixas de a (N,4) e b (M,4) -> (N,M)."""
+    area_a = (a[:, 2] - a[:, 0]).clip(0) * (a[:, 3] - a[:, 1]).clip(0)
+    area_b = (b[:, 2] - b[:, 0]).clip(0) * (b[:, 3] - b[:, 1]).clip(0)
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    wh = (rb - lt).clip(0)
+    inter = wh[..., 0] * wh[..., 1]
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+def box_ios(a, b):
+    """Interseção sobre a menor área (N,M): pega a metade de um objeto cortado na borda de um tile."""
+    area_a = (a[:, 2] - a[:, 0]).clip(0) * (a[:, 3] - a[:, 1]).clip(0)
+    area_b = (b[:, 2] - b[:, 0]).clip(0) * (b[:, 3] - b[:, 1]).clip(0)
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    wh = (rb - lt).clip(0)
+    inter = wh[..., 0] * wh[..., 1]
+    return inter / (np.minimum(area_a[:, None], area_b[None, :]) + 1e-9)
+
+def nms(boxes, scores, iou_thresh=0.45, classes=None, max_det=300, ios_thresh=None):
+    """
+    NMS guloso vetorizado; com `classes` as caixas de classes diferentes não se
+    suprimem (deslocamento por classe). Com ios_thresh, também suprime caixas
+    quase contidas numa de score maior (fusão entre tiles). Devolve os índices mantidos.
+    """
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+    if classes is not None:
+        offset = classes.astype(np.float32)[:, None] * (boxes.max() + 1.0)
+        boxes = boxes + offset
+    order = np.argsort(-scores)
+    keep = []
+    while order.size and len(keep) < max_det:
+        i = order[0]
+        keep.append(i)
+        if order.size == 1:
+            break
+        rest = boxes[order[1:]]
+        suppress = box_iou(boxes[i:i + 1], rest)[0] > iou_thresh
+        if ios_thresh is not None:
+            suppress |= box_ios(boxes[i:i + 1], rest)[0] > ios_thresh
+        order = order[1:][~suppress]
+    return np.asarray(keep, dtype=np.int64)
+
+def merge_detections(dets, iou=0.45, ios=0.7, max_det=300):
+    """Junta detecções de vários tiles/recortes (já no espaço do frame) com NMS entre tiles."""
+    det = Detections.concat(dets)
+    if len(det) < 2:
+        return det
+    keep = nms(det.boxes, det.confs, iou, classes=det.classes, max_det=max_det, ios_thresh=ios)
+    return det.select(keep)
+
+def tile_grid(width, height, rows, cols, overlap=0.2):
+    """Janelas (x1, y1, x2, y2) de uma grade rows x cols cobrindo o frame, com sobreposição relativa."""
+    tw = int(np.ceil(width / (cols - (cols - 1) * overlap)))
+    th = int(np.ceil(height / (rows - (rows - 1) * overlap)))
+    xs = np.linspace(0, width - tw, cols).astype(int) if cols > 1 else [0]
+    ys = np.linspace(0, height - th, rows).astype(int) if rows > 1 else [0]
+    return [(int(x), int(y), int(x) + tw, int(y) + th) for y in ys for x in xs]
+
+def roi_windows(det, width, height, size, pad=0.5, max_rois=4):
+    """
+    Janelas em volta das detecções candidatas: cada caixa cresce `pad` e vira um
+    quadrado de pelo menos `size` px (resolução nativa). Janelas que se
+    sobrepõem viram uma só; ficam as max_rois de maior confiança.
+    """
+    if not len(det):
+        return []
+    order = np.argsort(-det.confs)
+    wins = []
+    for x1, y1, x2, y2 in det.boxes[order]:
+        cx, cy = (x1 + x2) / 2.0, (y1 + y2) / 2.0
+        side = max(size, (x2 - x1) * (1 + pad), (y2 - y1) * (1 + pad))
+        side = min(side, width, height)
+        wx = int(np.clip(cx - side / 2, 0, width - side))
+        wy = int(np.clip(cy - side / 2, 0, height - side))
+        win = np.array([wx, wy, wx + int(side), wy + int(side)], np.float32)
+        merged = False
+        for i, other in enumerate(wins):
+            if box_ios(win[None], other[None])[0, 0] > 0.5:
+                wins[i] = np.concatenate([np.minimum(win[:2], other[:2]), np.maximum(win[2:], other[2:])])
+                merged = True
+                break
+        if not merged:
+            wins.append(win)
+        if len(wins) >= max_rois:
+            break
+    return [tuple(int(v) for v in w) for w in wins]
+
+def letterbox(frame, imgsz, color=114):
+    """Redimensiona mantendo o aspecto e completa com borda até imgsz x imgsz. Devolve (img, escala, (pad_x, pad_y))."""
+    h, w = frame.shape[:2]
+    scale = min(imgsz / h, imgsz / w)
+    nw, nh = int(round(w * scale)), int(round(h * scale))
+    if (nw, nh) != (w, h):
+        frame = cv2.resize(frame, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (imgsz - nw) // 2, (imgsz - nh) // 2
+    img = cv2.copyMakeBorder(frame, pad_y, imgsz - nh - pad_y, pad_x, imgsz - nw - pad_x,
+                             cv2.BORDER_CONSTANT, value=(color, color, color))
+    return img, scale, (pad_x, pad_y)
+
+def decode_yolov8(output, conf=0.25, iou=0.45, classes=None, scale=1.0, pad=(0, 0), max_det=300):
+    """
+    Decodifica a saída bruta do YOLOv8 (1, 4+nc, N) em Detections no espaço do
+    frame original. Filtro de confiança e de classes vem antes do NMS.
+    """
+    pred = np.asarray(output, dtype=np.float32)
+    if pred.ndim == 3:
+        pred = pred[0]
+    pred = pred.T  # (N, 4+nc)
+    scores_all = pred[:, 4:]
+    if classes is not None:
+        keep_cls = np.zeros(scores_all.shape[1], dtype=bool)
+        keep_cls[[c for c in classes if c < scores_all.shape[1]]] = True
+        scores_all = np.where(keep_cls[None, :], scores_all, 0.0)
+    cls_ids = scores_all.argmax(axis=1)
+    scores = scores_all[np.arange(len(cls_ids)), cls_ids]
+    mask = scores >= conf
+    if not mask.any():
+        return Detections.empty()
+    pred, scores, cls_ids = pred[mask], scores[mask], cls_ids[mask]
+
+    cx, cy, bw, bh = pred[:, 0], pred[:, 1], pred[:, 2], pred[:, 3]
+    boxes = np.stack([cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2], axis=1)
+    boxes -= np.array([pad[0], pad[1], pad[0], pad[1]], dtype=np.float32)
+    boxes /= scale
+
+    keep = nms(boxes, scores, iou, classes=cls_ids, max_det=max_det)
+    return Detections(boxes[keep], scores[keep], cls_ids[keep])
+
+def draw_detections(img, det, names=None):
+    """Desenha as caixas em img (in-place) e devolve img."""
+    for (x1, y1, x2, y2), conf, cls in zip(det.boxes.astype(int), det.confs, det.classes):
+        label = names.get(int(cls), str(cls)) if names else str(cls)
+        cv2.rectangle(img, (x1, y1), (x2, y2), (0, 128, 255), 2)
+        cv2.putText(img, f"{label} {conf:.2f}", (x1, max(y1 - 5, 12)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 128, 255), 1)
+    return img
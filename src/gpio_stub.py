@@ -0,0 +1,75 @@
+# src/gpio_stub.py
+"""
+Substituto do RPi.GPIO para rodar robot_server/motion_control fora do Pi
+(benchmarks, desenvolvimento no PC). Não mexe em hardware: só registra cada
+escrita em `events` como (instante perf_counter, tipo, pino, valor).
+
+    import gpio_stub; gpio_stub.install()   # antes de importar motion_control
+    MotorController(gpio=gpio_stub)         # ou injetado direto
+"""
+import sys
+import time
+import types
+import threading
+from collections import deque
+
+BCM, BOARD = 11, 10
+OUT, IN = 0, 1
+HIGH, LOW = 1, 0
+
+events = deque(maxlen=100000)
+_lock = threading.Lock()
+_changed = threading.Condition(_lock)
+
+def _record(kind, pin, value):
+    with _changed:
+        events.append((time.perf_counter(), kind, pin, value))
+        _changed.notify_all()
+
+def wait_event(after, timeout=1.0):
+    """Espera até haver mais de `after` eventos; devolve o total atual."""
+    with _changed:
+        _changed.wait_for(lambda: len(events) > after, timeout)
+        return len(events)
+
+def setmode(mode):
+    pass
+
+def setwarnings(flag):
+    pass
+
+def setup(pin, mode, initial=LOW):
+    _record("setup", pin, mode)
+
+def output(pin, value):
+    _record("out", pin, bool(value))
+
+def cleanup(*pins):
+    _record("cleanup", None, None)
+
+class PWM:
+    def __init__(self, pin, freq):
+        self.pin = pin
+        self.freq = freq
+
+    def start(self, duty):
+        _record("duty", self.pin, duty)
+
+    def ChangeDutyCycle(self, duty):
+        _record("duty", self.pin, duty)
+
+    def ChangeFrequency(self, freq):
+        self.freq = freq
+
+    def stop(self):
+        _record("duty", self.pin, 0)
+
+def install():
+    """Registra este módulo como RPi.GPIO em sys.modules (não faz nada se o real já foi importado)."""
+    if "RPi.GPIO" in sys.modules:
+        return sys.modules["RPi.GPIO"]
+    pkg = types.ModuleType("RPi")
+    pkg.GPIO = sys.modules[__name__]
+    sys.modules["RPi"] = pkg
+    sys.modules["RPi.GPIO"] = sys.modules[__name__]
+    return sys.modules[__name__]
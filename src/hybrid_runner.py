@@ -0,0 +1,377 @@
+# src/hybrid_runner.py
+"""
+Execução híbrida no robô: manda os frames ao server_pc quando o link está bom e
+o rtt ganha da inferência local; cai para o ObjectDetector local (com imgsz
+reduzido se preciso) quando a latência dispara ou a conexão cai. Com o imgsz
+reduzido, um frame a cada restore_interval roda no imgsz cheio e, se couber no
+orçamento com folga, o imgsz cheio volta.
+
+A troca é decidida pelo ModeSelector com medidas ao vivo:
+  - offload -> local: conexão perdida, frame em voo sem resposta há mais de
+    stall_ms, ou rtt médio acima de local * (1 / margin);
+  - local -> offload: o servidor continua sendo sondado com um frame a cada
+    probe_interval; volta quando `switch_replies` respostas seguidas têm rtt
+    abaixo de local * margin.
+Os comandos do servidor (DRIVE com left=/right= ou o rótulo discreto) e os da
+política local vão pelo mesmo CommandLink ao robot_server. Use a mesma --policy
+aqui e no server_pc para o comportamento não mudar na troca.
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import logging
+
+import cv2
+
+from perception import CameraThread, ObjectDetector, lores_size_for
+from backends import BACKENDS
+from tracking import IouTracker, CommandHysteresis
+from command_link import CommandLink
+from policy import Policy, add_arguments as add_policy_arguments
+from recording import ReplaySource
+import metrics
+from metrics import REGISTRY
+from lazy import preload
+from startup import StartupTimer, parallel_start
+
+# cliente de streaming (src_client-pc/)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src_client-pc"))
+from robot_client import StreamClient, UdpStreamClient, connect
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger("hybrid_runner")
+
+LOCAL, OFFLOAD = "local", "offload"
+
+class ModeSelector:
+    """
+    Escolhe local/offload a partir de EMAs da inferência local e do rtt do
+    servidor. Thread-safe: on_rtt vem da thread de leitura do StreamClient.
+    """
+    def __init__(self, margin=0.8, stall_s=0.5, switch_replies=5, alpha=0.3):
+        self.margin = margin
+        self.stall_s = stall_s
+        self.switch_replies = max(1, int(switch_replies))
+        self.alpha = alpha
+        self.lock = threading.Lock()
+        self.mode = LOCAL
+        self.local_s = 0.0
+        self.rtt_s = 0.0
+        self.good = 0
+        self.switches = 0
+
+    def _ema(self, old, value):
+        return value if old == 0.0 else (1 - self.alpha) * old + self.alpha * value
+
+    def _switch(self, mode, reason):
+        if mode != self.mode:
+            log.warning("Modo %s -> %s (%s; rtt %.0f ms, local %.0f ms)", self.mode, mode, reason,
+                        self.rtt_s * 1000.0, self.local_s * 1000.0)
+            self.mode = mode
+            self.good = 0
+            self.switches += 1
+            REGISTRY.inc("mode_switches", to=mode)
+
+    def on_local(self, seconds):
+        with self.lock:
+            self.local_s = self._ema(self.local_s, seconds)
+
+    def on_rtt(self, seconds):
+        with self.lock:
+            self.rtt_s = self._ema(self.rtt_s, seconds)
+            if not self.local_s:
+                return
+            if self.mode == OFFLOAD:
+                if self.rtt_s * self.margin > self.local_s:
+                    self._switch(LOCAL, "rtt acima da inferência local")
+            elif seconds < self.local_s * self.margin:
+                # cada resposta rápida conta; uma lenta zera a sequência
+                self.good += 1
+                if self.good >= self.switch_replies:
+                    self._switch(OFFLOAD, "rtt abaixo da inferência local")
+            else:
+                self.good = 0
+
+    def on_stall(self, age):
+        with self.lock:
+            if age > self.stall_s:
+                self._switch(LOCAL, f"sem resposta há {age * 1000.0:.0f} ms")
+                return True
+        return False
+
+    def on_disconnect(self):
+        with self.lock:
+            self.rtt_s = 0.0
+            self._switch(LOCAL, "conexão perdida")
+
+    def summary(self):
+        with self.lock:
+            return (f"modo {self.mode}, rtt {self.rtt_s * 1000.0:.0f} ms, local {self.local_s * 1000.0:.0f} ms, "
+                    f"{self.switches} trocas")
+
+class OffloadLink:
+    """Mantém a conexão com o server_pc (reconecta em segundo plano) e repassa rtt/comandos ao runner."""
+    def __init__(self, server_ip, port, transport, selector, on_command, window=2, reconnect_s=2.0):
+        self.server_ip = server_ip
+        self.port = port
+        self.transport = transport
+        self.selector = selector
+        self.on_command = on_command
+        self.window = window
+        self.reconnect_s = reconnect_s
+        self.client = None
+        self.last_seq = 0
+        self.rtt_samples = 0
+        self.last_sent = 0.0
+        self.running = True
+        self.thread = threading.Thread(target=self._connect_loop, daemon=True)
+        self.thread.start()
+
+    def _connect_loop(self):
+        while self.running:
+            client = self.client
+            if client is None or not client.running:
+                if client is not None:
+                    self.client = None
+                    self.selector.on_disconnect()
+                try:
+                    sock = connect(self.server_ip, self.port, self.transport)
+                except OSError as e:
+                    log.debug("Servidor indisponível: %s", e)
+                else:
+                    cls = UdpStreamClient if self.transport == "udp" else StreamClient
+                    client = cls(sock, window=self.window, on_command=self._reply)
+                    client.start()
+                    self.last_seq = self.rtt_samples = 0
+                    self.client = client
+                    log.info("Conectado ao servidor %s:%d (%s)", self.server_ip, self.port, self.transport)
+            time.sleep(self.reconnect_s)
+
+    def _reply(self, seq, cmd, fields):
+        client = self.client
+        # só amostra nova: resposta atrasada/reordenada repetiria o rtt anterior na média
+        if client is not None and client.rtt_samples != self.rtt_samples:
+            self.rtt_samples = client.rtt_samples
+            self.selector.on_rtt(client.rtt)
+        # UDP pode reordenar: resposta de um frame mais velho que a última não vira comando
+        if seq > self.last_seq:
+            self.last_seq = seq
+            self.on_command(seq, cmd, fields)
+
+    def try_send(self, jpg, capture_ts):
+        """Envia sem bloquear; False se desconectado, janela cheia, acima do rate= do servidor ou servidor travado."""
+        client = self.client
+        if client is None or not client.running:
+            self.selector.on_disconnect()
+            return False
+        n, age = client.pending()
+        if n and self.selector.on_stall(age):
+            return False
+        if n >= client.window:
+            return False
+        now = time.perf_counter()
+        if client.server_rate and now - self.last_sent < 1.0 / client.server_rate:
+            return False
+        self.last_sent = now
+        try:
+            client.send_frame(jpg, capture_ts)
+        except (ConnectionError, OSError) as e:
+            log.info("Falha enviando frame: %s", e)
+            client.close()
+            return False
+        return True
+
+    def close(self):
+        self.running = False
+        if self.client is not None:
+            self.client.close()
+
+def run_hybrid(server_ip, server_port=8000, robot_ip="127.0.0.1", robot_port=8000, transport="tcp",
+               use_picamera=True, capture_format="bgr", width=640, height=360, quality=80, window=2,
+               backend="auto", int8=False, imgsz=320, fallback_imgsz=224, local_budget_ms=150.0, margin=0.8,
+               stall_ms=500.0, switch_replies=5, probe_interval=0.5, track=True, switch_frames=2,
+               policy_file=None, replay=None, replay_speed=1.0, replay_loop=False, metrics_port=None,
+               metrics_log=None, metrics_file=None, warmup=1, restore_interval=5.0):
+    stop_metrics = metrics.start_exporters(metrics_port, metrics_log, metrics_file)
+    timer = StartupTimer()
+    policy = Policy.from_file(policy_file)
+    selector = ModeSelector(margin=margin, stall_s=stall_ms / 1000.0, switch_replies=switch_replies)
+    source = ReplaySource(replay, speed=replay_speed, loop=replay_loop) if replay else None
+
+    def start_camera():
+        cam = source
+        if cam is None:
+            cam = CameraThread(width=width, height=height, use_picamera=use_picamera, capture_format=capture_format,
+                               lores_size=lores_size_for(imgsz, width, height))
+        cam.start()
+        return cam
+
+    def load_detector():
+        # o detector local fica sempre carregado: o failover não pode esperar o modelo
+        detector = ObjectDetector(conf=0.25, iou=0.45, backend=backend, imgsz=imgsz, int8=int8,
+                                  classes=policy.classes)
+        if warmup:
+            timer.record("warmup", detector.warmup((height, width, 3), (imgsz, fallback_imgsz), runs=warmup))
+            # já aquecido, uma medida da inferência local permite decidir o offload desde o primeiro rtt
+            t0 = time.perf_counter()
+            detector.warmup((height, width, 3), (imgsz,))
+            selector.on_local(time.perf_counter() - t0)
+        return detector
+
+    try:
+        parts = parallel_start(timer, camera=start_camera, detector=load_detector,
+                               link=lambda: CommandLink(robot_ip, robot_port),
+                               cleanup={"camera": lambda cam: cam.stop(), "link": lambda link: link.close()})
+    except Exception:
+        # o que subiu já foi desfeito pelo parallel_start; falta só o exporter de métricas
+        stop_metrics()
+        raise
+    cam, detector, link = parts["camera"], parts["detector"], parts["link"]
+    tracker = IouTracker() if track else None
+    hysteresis = CommandHysteresis(switch_frames=switch_frames) if track and not policy.proportional else None
+    link_lock = threading.Lock()
+    REGISTRY.gauge("offload_active", lambda: 1.0 if selector.mode == OFFLOAD else 0.0)
+
+    def send_command(cmd, left=0, right=0):
+        with link_lock:
+            if cmd == "DRIVE":
+                link.send("DRIVE", left, right)
+            else:
+                link.send(cmd)
+
+    def on_server_command(seq, cmd, fields):
+        # em modo local as respostas são só sondagem de rtt
+        if selector.mode != OFFLOAD:
+            return
+        if "left" in fields and "right" in fields:
+            send_command("DRIVE", int(fields["left"]), int(fields["right"]))
+        else:
+            send_command(cmd)
+
+    offload = OffloadLink(server_ip, server_port, transport, selector, on_server_command, window=window)
+    timer.report()
+    local_imgsz = imgsz
+    last_probe = 0.0
+    last_restore = time.perf_counter()
+    last_log = time.perf_counter()
+    last_id = 0
+    try:
+        while True:
+            packet = cam.read_packet(after_id=last_id, timeout=2.0)
+            if packet is None:
+                if source is not None and source.exhausted:
+                    log.info("Fim da gravação.")
+                    break
+                log.warning("Nenhum frame recebido (timeout).")
+                continue
+            frame, last_id = packet.frame, packet.frame_id
+            now = time.perf_counter()
+
+            probe = selector.mode == LOCAL and now - last_probe >= probe_interval
+            if selector.mode == OFFLOAD or probe:
+                ok, buf = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+                sent = ok and offload.try_send(buf.tobytes(), packet.timestamp)
+                if probe:
+                    last_probe = now
+                if sent and selector.mode == OFFLOAD:
+                    # o comando vem na resposta do servidor (on_server_command)
+                    continue
+                if selector.mode == OFFLOAD:
+                    # janela cheia e servidor ainda dentro do prazo: este frame fica sem comando
+                    REGISTRY.inc("frames_skipped")
+                    continue
+
+            run_imgsz = local_imgsz
+            if local_imgsz != imgsz and now - last_restore >= restore_interval:
+                # no imgsz reduzido: de tempos em tempos um frame de verdade no imgsz cheio
+                run_imgsz = imgsz
+                last_restore = now
+            t0 = time.perf_counter()
+            det = detector.detect(frame, imgsz=run_imgsz)
+            dt = time.perf_counter() - t0
+            REGISTRY.observe("infer", dt)
+            # o seletor compara o rtt com a inferência local que está de fato rodando
+            selector.on_local(dt)
+            if run_imgsz == local_imgsz == imgsz != fallback_imgsz and dt * 1000.0 > local_budget_ms:
+                log.warning("Inferência local em %.0f ms (> %.0f ms), reduzindo imgsz %d -> %d",
+                            dt * 1000.0, local_budget_ms, local_imgsz, fallback_imgsz)
+                local_imgsz = fallback_imgsz
+                last_restore = now
+            elif run_imgsz != local_imgsz and dt * 1000.0 <= 0.8 * local_budget_ms:
+                log.info("Inferência local em %.0f ms no imgsz %d: voltando de %d", dt * 1000.0, imgsz, local_imgsz)
+                local_imgsz = imgsz
+            if tracker is not None:
+                det = tracker.update(det, t0).as_detections()
+            drive = policy.decide(det, frame.shape[1], frame.shape[0])
+            try:
+                if policy.proportional:
+                    send_command("DRIVE", drive.left, drive.right)
+                else:
+                    send_command(drive.name if hysteresis is None else hysteresis.update(drive.name))
+            except Exception as e:
+                log.exception("Erro enviando comando: %s", e)
+                break
+            REGISTRY.observe("end_to_end", max(0.0, time.time() - packet.timestamp))
+
+            if now - last_log >= 5.0:
+                last_log = now
+                log.info("Híbrido: %s, imgsz local %d", selector.summary(), local_imgsz)
+    except KeyboardInterrupt:
+        log.info("Encerrando por KeyboardInterrupt")
+    finally:
+        log.info("Híbrido: %s", selector.summary())
+        offload.close()
+        cam.stop()
+        try:
+            send_command("STOP")
+        except Exception:
+            pass
+        link.close()
+        stop_metrics()
+
+if __name__ == "__main__":
+    preload("ultralytics")
+    p = argparse.ArgumentParser()
+    p.add_argument("--server", required=True, help="IP do PC servidor (server_pc.py)")
+    p.add_argument("--port", type=int, default=8000, help="porta do server_pc")
+    p.add_argument("--robot", default="127.0.0.1", help="IP do robot_server")
+    p.add_argument("--robot-port", type=int, default=8000)
+    p.add_argument("--transport", choices=("tcp", "udp"), default="tcp")
+    p.add_argument("--no-picam", dest="use_picamera", action="store_false", help="Forçar uso OpenCV/V4L2 (legacy)")
+    p.add_argument("--capture-format", choices=("bgr", "lores"), default="bgr")
+    p.add_argument("--width", type=int, default=640)
+    p.add_argument("--height", type=int, default=360)
+    p.add_argument("--quality", type=int, default=80, help="JPEG quality 1-100")
+    p.add_argument("--window", type=int, default=2, help="máximo de frames em voo aguardando comando")
+    p.add_argument("--backend", choices=("auto",) + BACKENDS, default="auto")
+    p.add_argument("--int8", action="store_true", help="exportar o modelo quantizado INT8 (só backend OpenVINO)")
+    p.add_argument("--imgsz", type=int, default=320, help="imgsz da inferência local")
+    p.add_argument("--fallback-imgsz", type=int, default=224, help="imgsz local quando a inferência estoura o orçamento")
+    p.add_argument("--local-budget-ms", type=float, default=150.0, help="orçamento da inferência local por frame")
+    p.add_argument("--margin", type=float, default=0.8,
+                   help="offload só quando rtt < local * margin (e volta a local quando rtt * margin > local)")
+    p.add_argument("--stall-ms", type=float, default=500.0, help="frame sem resposta por mais que isso = link ruim")
+    p.add_argument("--switch-replies", type=int, default=5, help="respostas rápidas seguidas para voltar ao offload")
+    p.add_argument("--probe-interval", type=float, default=0.5, help="segundos entre sondagens do servidor em modo local")
+    p.add_argument("--restore-interval", type=float, default=5.0,
+                   help="segundos entre tentativas de voltar ao imgsz cheio depois do fallback")
+    p.add_argument("--no-track", dest="track", action="store_false", help="decidir só pelo frame atual, sem tracker")
+    p.add_argument("--switch-frames", type=int, default=2, help="frames seguidos para trocar de comando")
+    p.add_argument("--replay", default=None, help="usar uma gravação no lugar da câmera")
+    p.add_argument("--replay-speed", type=float, default=1.0, help="velocidade do replay (0 = máxima)")
+    p.add_argument("--replay-loop", action="store_true", help="repetir a gravação")
+    p.add_argument("--warmup", type=int, default=1, help="inferências de aquecimento por imgsz antes de começar")
+    add_policy_arguments(p)
+    metrics.add_arguments(p)
+    args = p.parse_args()
+    run_hybrid(args.server, args.port, robot_ip=args.robot, robot_port=args.robot_port, transport=args.transport,
+               use_picamera=args.use_picamera, capture_format=args.capture_format, width=args.width,
+               height=args.height, quality=args.quality, window=args.window, backend=args.backend, int8=args.int8,
+               imgsz=args.imgsz, fallback_imgsz=args.fallback_imgsz, local_budget_ms=args.local_budget_ms,
+               margin=args.margin, stall_ms=args.stall_ms, switch_replies=args.switch_replies,
+               probe_interval=args.probe_interval, track=args.track, switch_frames=args.switch_frames,
+               policy_file=args.policy, replay=args.replay, replay_speed=args.replay_speed,
+               replay_loop=args.replay_loop, metrics_port=args.metrics_port, metrics_log=args.metrics_log,
+               metrics_file=args.metrics_file, warmup=args.warmup, restore_interval=args.restore_interval)
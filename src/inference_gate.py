@@ -0,0 +1,77 @@
+# src/inference_gate.py
+import time
+import logging
+
+import cv2
+
+log = logging.getLogger("inference_gate")
+
+REUSE, REDUCED, FULL = "reuse", "reduced", "full"
+
+class InferenceGate:
+    """
+    Decide por frame se vale rodar o detector. Um score de movimento barato
+    (diferença média entre miniaturas em cinza, 0-255) contra o frame da última
+    inferência escolhe entre reaproveitar as detecções anteriores, inferir em
+    imgsz reduzido ou inferir no imgsz cheio.
+
+    max_staleness: segundos máximos sem inferência (força FULL).
+    target_fps: se definido, um controlador multiplicativo ajusta os limiares
+    para manter o loop perto dessa taxa (mais reuso quando atrasado).
+    """
+    def __init__(self, imgsz=320, reduced_imgsz=224, still_thresh=2.0, motion_thresh=8.0,
+                 max_staleness=0.5, target_fps=None, probe_size=(64, 36)):
+        self.imgsz = imgsz
+        self.reduced_imgsz = reduced_imgsz
+        self.still_thresh = still_thresh
+        self.motion_thresh = motion_thresh
+        self.max_staleness = max_staleness
+        self.target_fps = target_fps
+        self.probe_size = probe_size
+        self.gain = 1.0
+        self.ref = None
+        self.last_infer = 0.0
+        self.last_tick = None
+        self.fps = 0.0
+        self.score = 0.0
+        self.counts = {REUSE: 0, REDUCED: 0, FULL: 0}
+
+    def _probe(self, frame):
+        small = cv2.resize(frame, self.probe_size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+    def _tick(self, now):
+        if self.last_tick is not None:
+            dt = now - self.last_tick
+            if dt > 0:
+                self.fps = 1.0 / dt if self.fps == 0.0 else 0.9 * self.fps + 0.1 / dt
+        self.last_tick = now
+        if self.target_fps and self.fps > 0:
+            if self.fps < self.target_fps * 0.95:
+                self.gain = min(self.gain * 1.05, 8.0)
+            elif self.fps > self.target_fps * 1.05:
+                self.gain = max(self.gain / 1.05, 0.25)
+
+    def decide(self, frame, now=None):
+        """Devolve (ação, imgsz); imgsz é None para REUSE."""
+        now = time.perf_counter() if now is None else now
+        self._tick(now)
+        probe = self._probe(frame)
+        if self.ref is None or now - self.last_infer >= self.max_staleness:
+            action = FULL
+        else:
+            self.score = float(cv2.absdiff(probe, self.ref).mean())
+            if self.score < self.still_thresh * self.gain:
+                action = REUSE
+            elif self.score < self.motion_thresh * self.gain:
+                action = REDUCED
+            else:
+                action = FULL
+        if action != REUSE:
+            self.ref = probe
+            self.last_infer = now
+        self.counts[action] += 1
+        return action, (None if action == REUSE else self.imgsz if action == FULL else self.reduced_imgsz)
+
+    def stats(self):
+        return dict(self.counts, score=self.score, gain=self.gain, fps=self.fps)
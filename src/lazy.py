@@ -0,0 +1,61 @@
+# src/lazy.py
+"""
+Imports adiados para a partida rápida no Pi: módulos pesados (ultralytics/torch,
+picamera2, cv2) só são importados no primeiro acesso a um atributo, e
+preload() pode começar a importá-los numa thread enquanto a câmera sobe.
+
+    ultralytics = LazyModule("ultralytics")
+    ...
+    model = ultralytics.YOLO(path)   # o import acontece aqui
+"""
+import importlib
+import importlib.util
+import threading
+import time
+import logging
+
+log = logging.getLogger("lazy")
+
+class LazyModule:
+    """Proxy de um módulo importado no primeiro acesso (thread-safe: o import lock do Python serializa)."""
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            t0 = time.perf_counter()
+            module = importlib.import_module(self.__dict__["_name"])
+            self.__dict__["_module"] = module
+            log.debug("import %s: %.2f s", self.__dict__["_name"], time.perf_counter() - t0)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    @property
+    def loaded(self):
+        return self.__dict__["_module"] is not None
+
+def available(name):
+    """Se o módulo existe, sem importá-lo."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+def preload(*names):
+    """Importa os módulos numa thread daemon; quem usar antes do fim só espera o import em andamento."""
+    def run():
+        for name in names:
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                log.debug("preload de %s falhou: %s", name, e)
+    thread = threading.Thread(target=run, name="preload", daemon=True)
+    thread.start()
+    return thread
@@ -1,10 +1,20 @@
-import socket
 import time
 import argparse
-import cv2
 import logging
 
-from perception import CameraThread, ObjectDetector
+from perception import CameraThread, ObjectDetector, lores_size_for
+from preview import PreviewSink, draw_overlay
+from detections import draw_detections
+from backends import BACKENDS
+from inference_gate import InferenceGate, REUSE
+from tracking import IouTracker, CommandHysteresis
+from command_link import CommandLink
+from recording import Recorder, ReplaySource
+from policy import Policy, add_arguments as add_policy_arguments
+import metrics
+from metrics import REGISTRY
+from lazy import preload
+from startup import StartupTimer, parallel_start
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("main")
@@ -14,42 +24,113 @@ CAP_WIDTH, CAP_HEIGHT = 640, 360
 IMG_SZ = 320
 MODEL_NAME = "yolov8n.pt"
 CONF_THRESH, IOU_THRESH = 0.25, 0.45
+PREVIEW_NAME = "YOLOv8 - annotated"
+def parse_grid(text):
+    rows, _, cols = text.lower().partition("x")
+    try:
+        return max(1, int(rows)), max(1, int(cols))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"grade inválida: {text} (use LINHASxCOLUNAS)")
+
+def make_preview(headless=False, preview_fps=10.0, mjpeg_port=None):
+    """Sem --headless: janela OpenCV; com --mjpeg-port: stream HTTP; headless puro: nenhum preview."""
+    if mjpeg_port:
+        return PreviewSink(max_fps=preview_fps, mode="mjpeg", host="0.0.0.0", port=mjpeg_port)
+    if headless:
+        return None
+    return PreviewSink(max_fps=preview_fps, mode="window")
+
+def run_client(server_ip, server_port=8000, use_picamera=True, headless=False, preview_fps=10.0, mjpeg_port=None,
+               capture_format="bgr", backend="auto", int8=False, gate=False, max_staleness=0.5,
+               target_fps=None, reduced_imgsz=224, track=True, switch_frames=2,
+               binary_protocol=True, metrics_port=None, metrics_log=None, metrics_file=None, record=None,
+               record_format="jpeg", replay=None, replay_speed=1.0, replay_loop=False, tiling="off",
+               tile_grid=(2, 2), tile_imgsz=IMG_SZ, coarse_imgsz=320, tile_overlap=0.2, policy_file=None, warmup=1):
+    stop_metrics = metrics.start_exporters(metrics_port, metrics_log, metrics_file)
+    timer = StartupTimer()
+    # classes que geram comando vêm da política; as demais são descartadas antes do NMS
+    policy = Policy.from_file(policy_file)
+    # --replay troca a câmera pela gravação (mesma interface read_packet, frame a frame)
+    source = ReplaySource(replay, speed=replay_speed, loop=replay_loop) if replay else None
+
+    def start_camera():
+        cam = source
+        if cam is None:
+            cam = CameraThread(src=CAM_INDEX, width=CAP_WIDTH, height=CAP_HEIGHT, use_picamera=use_picamera,
+                               capture_format=capture_format,
+                               lores_size=lores_size_for(IMG_SZ, CAP_WIDTH, CAP_HEIGHT))
+        cam.start()
+        return cam
+
+    def load_detector():
+        detector = ObjectDetector(model_path=MODEL_NAME, conf=CONF_THRESH, iou=IOU_THRESH, device="cpu",
+                                  backend=backend, imgsz=IMG_SZ, int8=int8, classes=policy.classes)
+        if warmup:
+            # todos os imgsz que o loop pode usar, para nenhum export/inicialização cair no primeiro frame
+            imgszs = [IMG_SZ] + ([reduced_imgsz] if gate else [])
+            if tiling != "off":
+                imgszs += [coarse_imgsz, tile_imgsz]
+            timer.record("warmup", detector.warmup((CAP_HEIGHT, CAP_WIDTH, 3), imgszs, runs=warmup))
+        return detector
+
+    # câmera, modelo e conexão com o robot_server (protocolo binário primeiro) sobem em paralelo
+    try:
+        parts = parallel_start(timer, camera=start_camera, detector=load_detector,
+                               link=lambda: CommandLink(server_ip, server_port, binary=binary_protocol),
+                               cleanup={"camera": lambda cam: cam.stop(), "link": lambda link: link.close()})
+    except Exception:
+        # o que subiu já foi desfeito pelo parallel_start; falta só o exporter de métricas
+        stop_metrics()
+        raise
+    cam, detector, link = parts["camera"], parts["detector"], parts["link"]
+    recorder = Recorder(record, fmt=record_format) if record else None
 
-def map_classes_to_command(detected_classes):
-    """
-    Mapeamento de exemplo — ajuste para os classes IDs do teu modelo/dataset.
-    """
-    if not detected_classes:
-        return "STOP"
-    if 0 in detected_classes:
-        return "FORWARD"
-    if 2 in detected_classes:
-        return "LEFT"
-    return "STOP"
-
-def run_client(server_ip, server_port=8000, use_picamera=True):
-    cam = CameraThread(src=CAM_INDEX, width=CAP_WIDTH, height=CAP_HEIGHT, use_picamera=use_picamera)
-    cam.start()
-    detector = ObjectDetector(model_path=MODEL_NAME, conf=CONF_THRESH, iou=IOU_THRESH, device="cpu")
-
-    # Conecta ao servidor de controle (robot)
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    log.info("Conectando em %s:%d ...", server_ip, server_port)
-    sock.connect((server_ip, server_port))
-    sock.settimeout(2.0)
+    preview = make_preview(headless, preview_fps, mjpeg_port)
+    if preview is not None:
+        preview.start()
+
+    # reaproveita detecções quando a cena não mudou (ver inference_gate.py)
+    inference_gate = None
+    if gate:
+        inference_gate = InferenceGate(imgsz=IMG_SZ, reduced_imgsz=reduced_imgsz,
+                                       max_staleness=max_staleness, target_fps=target_fps)
+    def run_detector(imgsz=None):
+        # tiling só no passe completo; o imgsz reduzido do gate continua sendo um passe simples
+        if tiling != "off" and imgsz in (None, IMG_SZ):
+            return detector.detect_tiled(frame, coarse_imgsz=coarse_imgsz, tile_imgsz=tile_imgsz, mode=tiling,
+                                         grid=tile_grid, overlap=tile_overlap)
+        return detector.detect(frame, imgsz=imgsz or IMG_SZ)
+
+    det = None
+    # tracks seguem entre execuções do detector; a histerese evita comandos piscando
+    tracker = IouTracker() if track else None
+    # no modo proporcional a suavização é da política (e a rampa, do robô); histerese só no discreto
+    hysteresis = CommandHysteresis(switch_frames=switch_frames) if track and not policy.proportional else None
 
     # FPS vars
     prev_time = time.perf_counter()
     fps = 0.0
     alpha = 0.9 
+    last_id = 0
+    ready = False
 
     try:
         while True:
-            frame = cam.read(timeout=2.0)
-            if frame is None:
+            # só acorda quando chega um frame novo; o frame é uma view somente-leitura do anel
+            packet = cam.read_packet(after_id=last_id, timeout=2.0)
+            if packet is None:
+                if source is not None and source.exhausted:
+                    log.info("Fim da gravação.")
+                    break
                 log.warning("Nenhum frame recebido (timeout).")
                 time.sleep(0.1)
                 continue
+            if last_id and packet.frame_id > last_id + 1:
+                # frames capturados que o loop não chegou a ver
+                REGISTRY.inc("frames_dropped", packet.frame_id - last_id - 1)
+            frame, last_id = packet.frame, packet.frame_id
+            REGISTRY.inc("frames")
+            REGISTRY.observe("frame_age", max(0.0, time.time() - packet.timestamp))
 
             # calcular FPS
             now = time.perf_counter()
@@ -62,32 +143,115 @@ def run_client(server_ip, server_port=8000, use_picamera=True):
                 else:
                     fps = alpha * fps + (1.0 - alpha) * inst_fps
 
-            annotated, classes = detector.infer(frame, imgsz=IMG_SZ)
-            cmd = map_classes_to_command(classes)
+            fresh = True
+            if inference_gate is None:
+                with REGISTRY.timer("infer"):
+                    det = run_detector()
+            else:
+                action, imgsz = inference_gate.decide(frame, now)
+                fresh = action != REUSE or det is None
+                if fresh:
+                    with REGISTRY.timer("infer"):
+                        det = run_detector(imgsz)
+                else:
+                    REGISTRY.inc("frames_skipped")
+            t_post = time.perf_counter()
+            if tracker is not None:
+                tracks = tracker.update(det, now) if fresh else tracker.predict(now)
+                shown = tracks.as_detections()
+            else:
+                shown = det
+            drive = policy.decide(shown, frame.shape[1], frame.shape[0])
+            if policy.proportional:
+                cmd = f"DRIVE {drive.left} {drive.right}"
+            else:
+                cmd = drive.name if hysteresis is None else hysteresis.update(drive.name)
+            t_send = time.perf_counter()
+            REGISTRY.observe("postprocess", t_send - t_post)
             try:
-                sock.sendall((cmd + "\n").encode("utf-8"))
+                if policy.proportional:
+                    link.send("DRIVE", drive.left, drive.right)
+                else:
+                    link.send(cmd)
             except Exception as e:
                 log.exception("Erro enviando comando: %s", e)
                 break
+            REGISTRY.observe("command_send", time.perf_counter() - t_send)
+            if not ready:
+                ready = True
+                timer.report()
+            if recorder is not None:
+                recorder.write_frame(frame, ts=packet.timestamp, frame_id=packet.frame_id)
+                recorder.write_command(cmd, frame_id=packet.frame_id)
+            REGISTRY.observe("end_to_end", max(0.0, time.time() - packet.timestamp))
 
-            # desenhar texto de comando e FPS
-            cv2.putText(annotated, f"CMD: {cmd}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
-            cv2.putText(annotated, f"FPS: {fps:.1f}", (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 255), 2)
-
-            cv2.imshow("YOLOv8 - annotated", annotated)
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
+            # anotação só acontece na thread de preview, e só para frames exibidos
+            if preview is not None:
+                if preview.quit_requested.is_set():
+                    break
+                if preview.wants(PREVIEW_NAME):
+                    # cópia só nos frames exibidos: o slot do anel pode ser reescrito antes do render
+                    preview.submit(PREVIEW_NAME, lambda det=shown, frame=frame.copy(), cmd=cmd, fps=fps:
+                                   draw_overlay(draw_detections(frame, det, detector.names), cmd, fps))
 
     finally:
         log.info("Encerrando cliente.")
+        if inference_gate is not None:
+            log.info("Gate de inferência: %s", inference_gate.stats())
         cam.stop()
-        sock.close()
-        cv2.destroyAllWindows()
+        link.close()
+        if recorder is not None:
+            recorder.close()
+        if preview is not None:
+            preview.stop()
+        stop_metrics()
 
 if __name__ == "__main__":
+    # o import do ultralytics/torch (segundos no Pi) começa já, enquanto os argumentos são lidos
+    preload("ultralytics")
     p = argparse.ArgumentParser()
     p.add_argument("--server", required=True, help="IP do servidor/robot que receberá comandos")
     p.add_argument("--port", type=int, default=8000)
     p.add_argument("--no-picam", dest="use_picamera", action="store_false", help="Forçar uso OpenCV/V4L2 (legacy)")
+    p.add_argument("--headless", action="store_true", help="Sem janela e sem anotação de frames")
+    p.add_argument("--preview-fps", type=float, default=10.0, help="Taxa máxima do preview")
+    p.add_argument("--mjpeg-port", type=int, default=None, help="Servir preview MJPEG nesta porta HTTP")
+    p.add_argument("--capture-format", choices=("bgr", "lores"), default="bgr",
+                   help="bgr: frame cheio sem conversão; lores: stream do ISP já no tamanho IMG_SZ")
+    p.add_argument("--backend", choices=("auto",) + BACKENDS, default="auto",
+                   help="runtime de inferência (auto = mais rápido disponível, exportado e cacheado)")
+    p.add_argument("--int8", action="store_true", help="exportar o modelo quantizado INT8 (só backend OpenVINO)")
+    p.add_argument("--gate", action="store_true", help="pular inferência quando a cena não muda")
+    p.add_argument("--max-staleness", type=float, default=0.5, help="segundos máximos reaproveitando detecções")
+    p.add_argument("--target-fps", type=float, default=None, help="FPS alvo do loop (ajusta o gate)")
+    p.add_argument("--reduced-imgsz", type=int, default=224, help="imgsz usado quando a mudança é pequena")
+    p.add_argument("--no-track", dest="track", action="store_false", help="decidir só pelo frame atual, sem tracker")
+    p.add_argument("--switch-frames", type=int, default=2, help="frames seguidos para trocar de comando")
+    p.add_argument("--text-protocol", dest="binary_protocol", action="store_false",
+                   help="não negociar o protocolo binário de comandos")
+    p.add_argument("--record", default=None, help="gravar frames e comandos neste arquivo")
+    p.add_argument("--record-format", choices=("jpeg", "raw"), default="jpeg")
+    p.add_argument("--replay", default=None, help="usar uma gravação no lugar da câmera")
+    p.add_argument("--replay-speed", type=float, default=1.0, help="velocidade do replay (0 = máxima)")
+    p.add_argument("--replay-loop", action="store_true", help="repetir a gravação")
+    p.add_argument("--tiling", choices=("off", "roi", "grid"), default="off",
+                   help="passe grosso + re-inferência em recortes (roi) ou numa grade de tiles (grid)")
+    p.add_argument("--tile-grid", type=parse_grid, default=(2, 2), help="grade de tiles LINHASxCOLUNAS (ex.: 2x3)")
+    p.add_argument("--tile-imgsz", type=int, default=IMG_SZ, help="imgsz da re-inferência nos recortes")
+    p.add_argument("--coarse-imgsz", type=int, default=320, help="imgsz do passe grosso")
+    p.add_argument("--tile-overlap", type=float, default=0.2, help="sobreposição relativa entre tiles da grade")
+    p.add_argument("--warmup", type=int, default=1, help="inferências de aquecimento por imgsz antes do primeiro frame")
+    add_policy_arguments(p)
+    metrics.add_arguments(p)
     args = p.parse_args()
-    run_client(args.server, args.port, use_picamera=args.use_picamera)
+    run_client(args.server, args.port, use_picamera=args.use_picamera, headless=args.headless,
+               preview_fps=args.preview_fps, mjpeg_port=args.mjpeg_port, capture_format=args.capture_format,
+               backend=args.backend, int8=args.int8, gate=args.gate, max_staleness=args.max_staleness,
+               target_fps=args.target_fps, reduced_imgsz=args.reduced_imgsz, track=args.track,
+               switch_frames=args.switch_frames, binary_protocol=args.binary_protocol,
+               metrics_port=args.metrics_port, metrics_log=args.metrics_log, metrics_file=args.metrics_file,
+               record=args.record, record_format=args.record_format, replay=args.replay,
+               replay_speed=args.replay_speed, replay_loop=args.replay_loop, tiling=args.tiling,
+               tile_grid=args.tile_grid, tile_imgsz=args.tile_imgsz, coarse_imgsz=args.coarse_imgsz,
+               tile_overlap=args.tile_overlap, policy_file=args.policy,
+               warmup=args.warmup)
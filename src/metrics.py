@@ -0,0 +1,259 @@
+# src/metrics.py
+"""
+Métricas por estágio do pipeline: histogramas de latência (p50/p95/p99) e
+contadores (frames descartados, pulados, ...), exportados em texto no formato
+Prometheus (GET /metrics) e/ou num log JSON periódico.
+
+Uso: REGISTRY.observe("infer", dt); REGISTRY.inc("frames_dropped");
+with REGISTRY.timer("decode"): ...
+Tempos são em segundos; o nome exportado vira robot_<nome>_seconds.
+"""
+import bisect
+import json
+import math
+import threading
+import time
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger("metrics")
+
+PREFIX = "robot_"
+# buckets log-espaçados de 100 us a ~20 s (fator 1.25)
+BUCKETS = tuple(1e-4 * 1.25 ** i for i in range(56))
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def _fmt_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+class Histogram:
+    """Histograma de buckets fixos; percentis interpolados dentro do bucket."""
+    __slots__ = ("counts", "count", "sum", "max", "lock")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(BUCKETS, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, q):
+        with self.lock:
+            counts, count, vmax = list(self.counts), self.count, self.max
+        if count == 0:
+            return 0.0
+        rank = q * count
+        acc = 0
+        for i, c in enumerate(counts):
+            if c and acc + c >= rank:
+                lo = BUCKETS[i - 1] if i > 0 else 0.0
+                hi = BUCKETS[i] if i < len(BUCKETS) else vmax
+                return min(vmax, lo + (hi - lo) * (rank - acc) / c)
+            acc += c
+        return vmax
+
+    def summary(self):
+        return {"count": self.count, "mean_ms": self.sum / self.count * 1000.0 if self.count else 0.0,
+                "p50_ms": self.percentile(0.50) * 1000.0, "p95_ms": self.percentile(0.95) * 1000.0,
+                "p99_ms": self.percentile(0.99) * 1000.0, "max_ms": self.max * 1000.0}
+
+class Timer:
+    """Context manager: with REGISTRY.timer('infer'): ..."""
+    __slots__ = ("hist", "t0")
+
+    def __init__(self, hist):
+        self.hist = hist
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.t0)
+        return False
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def histogram(self, name, **labels):
+        key = _key(name, labels)
+        h = self.histograms.get(key)
+        if h is None:
+            with self.lock:
+                h = self.histograms.setdefault(key, Histogram())
+        return h
+
+    def observe(self, name, seconds, **labels):
+        self.histogram(name, **labels).observe(seconds)
+
+    def timer(self, name, **labels):
+        return Timer(self.histogram(name, **labels))
+
+    def inc(self, name, n=1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def gauge(self, name, fn, **labels):
+        """Valor lido na hora da exportação (ex.: tamanho de fila)."""
+        with self.lock:
+            self.gauges[_key(name, labels)] = fn
+
+    def remove(self, **labels):
+        """Apaga as métricas com esses labels (ex.: cliente desconectado)."""
+        match = set(labels.items())
+        with self.lock:
+            for d in (self.histograms, self.counters, self.gauges):
+                for key in [k for k in d if match <= set(k[1])]:
+                    del d[key]
+
+    def snapshot(self):
+        with self.lock:
+            hists = list(self.histograms.items())
+            counters = dict(self.counters)
+            gauges = list(self.gauges.items())
+        out = {"stages": {}, "counters": {}, "gauges": {}}
+        for (name, labels), h in hists:
+            out["stages"][name + _fmt_labels(labels)] = h.summary()
+        for (name, labels), v in counters.items():
+            out["counters"][name + _fmt_labels(labels)] = v
+        for (name, labels), fn in gauges:
+            try:
+                out["gauges"][name + _fmt_labels(labels)] = fn()
+            except Exception:
+                pass
+        return out
+
+    def prometheus(self):
+        with self.lock:
+            hists = sorted(self.histograms.items(), key=lambda kv: kv[0])
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items(), key=lambda kv: kv[0])
+        lines = []
+        typed = set()
+        for (name, labels), h in hists:
+            metric = f"{PREFIX}{name}_seconds"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            with h.lock:
+                counts, count, total = list(h.counts), h.count, h.sum
+            acc = 0
+            for le, c in zip(BUCKETS, counts):
+                acc += c
+                lines.append(f"{metric}_bucket{_fmt_labels(labels, ('le', f'{le:.6g}'))} {acc}")
+            lines.append(f"{metric}_bucket{_fmt_labels(labels, ('le', '+Inf'))} {count}")
+            lines.append(f"{metric}_sum{_fmt_labels(labels)} {total:.6f}")
+            lines.append(f"{metric}_count{_fmt_labels(labels)} {count}")
+        for (name, labels), v in counters:
+            metric = f"{PREFIX}{name}_total"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_fmt_labels(labels)} {v}")
+        for (name, labels), fn in gauges:
+            try:
+                v = float(fn())
+            except Exception:
+                continue
+            if math.isnan(v):
+                continue
+            metric = f"{PREFIX}{name}"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric}{_fmt_labels(labels)} {v:g}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def _make_handler(registry):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            log.debug("metrics: " + fmt, *args)
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, ctype = registry.prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, ctype = json.dumps(registry.snapshot()).encode("utf-8"), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+    return MetricsHandler
+
+class JsonLogger(threading.Thread):
+    """Escreve o snapshot das métricas em JSON a cada `interval` s (no log ou numa linha por snapshot em `path`)."""
+    def __init__(self, registry, interval=10.0, path=None):
+        super().__init__(daemon=True)
+        self.registry = registry
+        self.interval = interval
+        self.path = path
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        snap = self.registry.snapshot()
+        snap["ts"] = time.time()
+        line = json.dumps(snap)
+        if self.path:
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+        else:
+            log.info("metrics %s", line)
+
+    def stop(self):
+        self.stopped.set()
+
+def start_exporters(port=None, log_interval=None, log_path=None, host="0.0.0.0", registry=REGISTRY):
+    """Sobe o endpoint HTTP (/metrics, /metrics.json) e/ou o log JSON periódico; devolve função de parada."""
+    server = logger = None
+    if port:
+        server = ThreadingHTTPServer((host, port), _make_handler(registry))
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        log.info("Métricas em http://%s:%d/metrics", host, port)
+    if log_interval:
+        logger = JsonLogger(registry, log_interval, log_path)
+        logger.start()
+
+    def stop():
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        if logger is not None:
+            logger.stop()
+            logger.flush()
+    return stop
+
+def add_arguments(p):
+    """Flags comuns de métricas para os argparse dos scripts."""
+    p.add_argument("--metrics-port", type=int, default=None, help="servir métricas Prometheus nesta porta HTTP")
+    p.add_argument("--metrics-log", type=float, default=None, help="logar métricas em JSON a cada N segundos")
+    p.add_argument("--metrics-file", default=None, help="com --metrics-log, anexar o JSON neste arquivo")
@@ -1,7 +1,18 @@
-import RPi.GPIO as GPIO
 import logging
+import threading
 import time
 
+from metrics import REGISTRY
+
+GPIO_AVAILABLE = False
+GPIO_ERROR = None
+try:
+    import RPi.GPIO as GPIO
+    GPIO_AVAILABLE = True
+except Exception as e:
+    GPIO = None
+    GPIO_ERROR = e
+
 log = logging.getLogger("motion_control")
 log.setLevel(logging.INFO)
 
@@ -10,47 +21,142 @@ IN3, IN4, ENB = 22, 23, 24
 
 PWM_FREQ = 1000
 DEFAULT_SPEED = 60
+RATE_HZ = 50          # ticks do laço de atuação
+ACCEL = 200.0         # %/s subindo a velocidade
+DECEL = 400.0         # %/s freando (parar é mais urgente que arrancar)
+
+def _step(current, target, up, down):
+    """Aproxima current de target em no máximo `up` (ganhando módulo) ou `down` (perdendo); inversões passam pelo zero."""
+    if current == target:
+        return current
+    if current != 0 and (target * current <= 0 or abs(target) < abs(current)):
+        goal = target if target * current > 0 else 0.0
+        nxt = current - down if current > 0 else current + down
+        return goal if (nxt - goal) * (current - goal) <= 0 else nxt
+    nxt = current + up if target > current else current - up
+    return target if (nxt - target) * (current - target) <= 0 else nxt
 
 class MotorController:
-    def __init__(self):
-        GPIO.setmode(GPIO.BCM)
+    """
+    Ponte H de duas rodas com um laço de atuação próprio: set_velocity() só
+    troca o alvo (não bloqueia no GPIO) e a thread, a RATE_HZ, rampa a
+    velocidade de cada roda até o alvo com limite de aceleração, evitando os
+    picos de corrente (e o brownout do Pi) em arrancadas e inversões. Só os
+    pinos/duty que mudaram são escritos.
+
+    Velocidades por roda em % (-100..100, negativo = ré). gpio: módulo com a
+    API do RPi.GPIO (padrão: o real; fora do Pi, passar gpio_stub explicitamente).
+    """
+    def __init__(self, gpio=None, rate_hz=RATE_HZ, accel=ACCEL, decel=DECEL):
+        if gpio is None:
+            # sem fallback silencioso: no robô, um servidor que aceita comandos sem mover os motores é pior que falhar
+            if not GPIO_AVAILABLE:
+                raise RuntimeError(f"RPi.GPIO indisponível ({GPIO_ERROR}); use --gpio-stub para rodar sem hardware")
+            gpio = GPIO
+        self.gpio = gpio
+        self.period = 1.0 / rate_hz
+        self.accel = accel
+        self.decel = decel
+        gpio.setmode(gpio.BCM)
         for p in (IN1, IN2, IN3, IN4, ENA, ENB):
-            GPIO.setup(p, GPIO.OUT)
-        self.pwmA = GPIO.PWM(ENA, PWM_FREQ)
-        self.pwmB = GPIO.PWM(ENB, PWM_FREQ)
+            gpio.setup(p, gpio.OUT)
+        self.pwmA = gpio.PWM(ENA, PWM_FREQ)
+        self.pwmB = gpio.PWM(ENB, PWM_FREQ)
         self.pwmA.start(0)
         self.pwmB.start(0)
+        # último valor escrito em cada pino/PWM (None = desconhecido)
+        self.pins = {p: None for p in (IN1, IN2, IN3, IN4)}
+        self.duty = {ENA: 0.0, ENB: 0.0}
+        self.current = [0.0, 0.0]
+        self.target = [0.0, 0.0]
+        self.cond = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, name="actuator", daemon=True)
+        self.thread.start()
+
+    def set_velocity(self, left, right, immediate=False):
+        """Novo alvo por roda (%); immediate=True pula a rampa (parada de emergência)."""
+        left = max(-100.0, min(100.0, float(left)))
+        right = max(-100.0, min(100.0, float(right)))
+        with self.cond:
+            self.target = [left, right]
+            if immediate:
+                self.current = [left, right]
+                self._write()
+            self.cond.notify()
 
-    def stop(self):
-        self.pwmA.ChangeDutyCycle(0)
-        self.pwmB.ChangeDutyCycle(0)
-        log.info("Motors stopped.")
+    def velocity(self):
+        with self.cond:
+            return tuple(self.current)
+
+    def stop(self, immediate=False):
+        self.set_velocity(0, 0, immediate)
+        log.debug("Motors stopped.")
 
     def forward(self, speed=DEFAULT_SPEED):
-        GPIO.output(IN1, True); GPIO.output(IN2, False)
-        GPIO.output(IN3, True); GPIO.output(IN4, False)
-        self.pwmA.ChangeDutyCycle(speed); self.pwmB.ChangeDutyCycle(speed)
-        log.info("Forward at %d%%", speed)
+        self.set_velocity(speed, speed)
+        log.debug("Forward at %d%%", speed)
 
     def backward(self, speed=DEFAULT_SPEED):
-        GPIO.output(IN1, False); GPIO.output(IN2, True)
-        GPIO.output(IN3, False); GPIO.output(IN4, True)
-        self.pwmA.ChangeDutyCycle(speed); self.pwmB.ChangeDutyCycle(speed)
-        log.info("Backward at %d%%", speed)
+        self.set_velocity(-speed, -speed)
+        log.debug("Backward at %d%%", speed)
 
     def left(self, speed=DEFAULT_SPEED):
-        GPIO.output(IN1, False); GPIO.output(IN2, True)
-        GPIO.output(IN3, True); GPIO.output(IN4, False)
-        self.pwmA.ChangeDutyCycle(speed); self.pwmB.ChangeDutyCycle(speed)
-        log.info("Left at %d%%", speed)
+        self.set_velocity(-speed, speed)
+        log.debug("Left at %d%%", speed)
 
     def right(self, speed=DEFAULT_SPEED):
-        GPIO.output(IN1, True); GPIO.output(IN2, False)
-        GPIO.output(IN3, False); GPIO.output(IN4, True)
-        self.pwmA.ChangeDutyCycle(speed); self.pwmB.ChangeDutyCycle(speed)
-        log.info("Right at %d%%", speed)
+        self.set_velocity(speed, -speed)
+        log.debug("Right at %d%%", speed)
+
+    def _set_pin(self, pin, value):
+        if self.pins[pin] != value:
+            self.gpio.output(pin, value)
+            self.pins[pin] = value
+
+    def _set_duty(self, pwm, pin, duty):
+        if self.duty[pin] != duty:
+            pwm.ChangeDutyCycle(duty)
+            self.duty[pin] = duty
+
+    def _write(self):
+        """Escreve self.current no hardware (com self.cond travado)."""
+        left, right = self.current
+        # roda parada mantém a direção anterior: nada a escrever além do duty
+        if left:
+            self._set_pin(IN1, left > 0)
+            self._set_pin(IN2, left < 0)
+        if right:
+            self._set_pin(IN3, right > 0)
+            self._set_pin(IN4, right < 0)
+        self._set_duty(self.pwmA, ENA, round(abs(left), 1))
+        self._set_duty(self.pwmB, ENB, round(abs(right), 1))
+
+    def _loop(self):
+        last = time.monotonic()
+        with self.cond:
+            while self.running:
+                if self.current == self.target:
+                    # parado no alvo: dorme até um novo set_velocity, sem ticks à toa
+                    self.cond.wait()
+                    last = time.monotonic() - self.period
+                    continue
+                # o passo é proporcional ao tempo desde o último tick: um alvo novo
+                # acorda o laço na hora sem furar o limite de aceleração
+                now = time.monotonic()
+                dt = min(now - last, 2 * self.period)
+                last = now
+                self.current = [_step(c, t, self.accel * dt, self.decel * dt)
+                                for c, t in zip(self.current, self.target)]
+                with REGISTRY.timer("motor_write"):
+                    self._write()
+                self.cond.wait(max(0.0, last + self.period - time.monotonic()))
 
     def cleanup(self):
-        self.stop()
-        GPIO.cleanup()
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.thread.join(timeout=1.0)
+        self.stop(immediate=True)
+        self.gpio.cleanup()
         log.info("GPIO cleaned up.")
@@ -1,38 +1,148 @@
 # src/perception.py
 import time
 import threading
-from collections import deque
+from collections import namedtuple
 import logging
 
 import cv2
 import numpy as np
-from ultralytics import YOLO
 
-PICAMERA2_AVAILABLE = False
-try:
-    from picamera2 import Picamera2
-    PICAMERA2_AVAILABLE = True
-except Exception as e:
-    PICAMERA2_AVAILABLE = False
+from backends import DEFAULT_CACHE_DIR, OnnxRuntimeModel, load_model, predict
+from detections import Detections, decode_yolov8, draw_detections, letterbox, merge_detections, roi_windows, tile_grid
+from metrics import REGISTRY
+from lazy import LazyModule, available
+
+# picamera2 (libcamera) só é importado quando a câmera sobe
+picamera2 = LazyModule("picamera2")
+PICAMERA2_AVAILABLE = available("picamera2")
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("perception")
 
+def picamera2_usable():
+    """
+    Importa o picamera2 de verdade: find_spec só diz que o pacote está instalado,
+    e bindings da libcamera quebrados só falham no import (aí cai no V4L2).
+    """
+    global PICAMERA2_AVAILABLE
+    if not PICAMERA2_AVAILABLE:
+        return False
+    try:
+        picamera2.Picamera2
+    except Exception as e:
+        log.warning("Picamera2 instalado mas não importa (%s); usando V4L2", e)
+        PICAMERA2_AVAILABLE = False
+    return PICAMERA2_AVAILABLE
+
+FramePacket = namedtuple("FramePacket", ["frame", "frame_id", "timestamp"])
+
+class FrameRing:
+    """
+    Anel de buffers pré-alocados entre a thread de captura e os consumidores.
+    O produtor escreve direto num slot livre (acquire/publish) e os leitores
+    recebem views somente-leitura, sem cópia. Um frame devolvido continua válido
+    até a próxima leitura do mesmo consumidor (o slot lido e o mais recente nunca
+    são reescritos).
+    """
+    def __init__(self, size=4):
+        self.size = max(3, int(size))
+        self.buffers = None
+        self.views = None
+        self.ids = [0] * self.size
+        self.stamps = [0.0] * self.size
+        self.latest = -1
+        self.reader_slot = -1
+        self.next_slot = 0
+        self.frame_id = 0
+        self.cond = threading.Condition()
+
+    def allocate(self, shape, dtype=np.uint8):
+        if self.buffers is not None and self.buffers[0].shape == tuple(shape):
+            return
+        with self.cond:
+            self.buffers = [np.empty(shape, dtype=dtype) for _ in range(self.size)]
+            self.views = []
+            for b in self.buffers:
+                v = b.view()
+                v.flags.writeable = False
+                self.views.append(v)
+            self.latest = -1
+            self.reader_slot = -1
+
+    def acquire(self):
+        """Devolve (slot, buffer) gravável que não está sendo lido."""
+        with self.cond:
+            slot = self.next_slot
+            while slot == self.latest or slot == self.reader_slot:
+                slot = (slot + 1) % self.size
+            self.next_slot = (slot + 1) % self.size
+            return slot, self.buffers[slot]
+
+    def publish(self, slot, timestamp=None):
+        with self.cond:
+            self.frame_id += 1
+            self.ids[slot] = self.frame_id
+            self.stamps[slot] = time.time() if timestamp is None else timestamp
+            self.latest = slot
+            self.cond.notify_all()
+            return self.frame_id
+
+    def wait_newer(self, after_id=0, timeout=1.0):
+        """Espera um frame com id > after_id; devolve FramePacket ou None em timeout."""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.latest >= 0 and self.ids[self.latest] > after_id, timeout):
+                return None
+            slot = self.latest
+            self.reader_slot = slot
+            return FramePacket(self.views[slot], self.ids[slot], self.stamps[slot])
+
+CAPTURE_FORMATS = ("bgr", "lores")
+
+def lores_size_for(imgsz, width, height):
+    """Tamanho do stream lores com o lado maior = imgsz, mantendo o aspecto (largura múltipla de 64)."""
+    scale = imgsz / float(max(width, height))
+    w = max(64, int(round(width * scale / 64.0)) * 64)
+    h = int(round(height * w / float(width))) & ~1
+    return w, h
+
 class CameraThread(threading.Thread):
-    def __init__(self, src=0, width=640, height=360, queue_size=2, use_picamera=True):
+    """
+    capture_format="bgr": o formato 'RGB888' da libcamera já é B,G,R em memória,
+    então o frame vai direto para o anel, sem cvtColor.
+    capture_format="lores": usa o stream lores do ISP (YUV420) já no tamanho de
+    inferência (lores_size), evitando o resize do frame cheio; só a conversão
+    YUV->BGR pequena sobra no caminho.
+
+    capture: objeto com a interface do cv2.VideoCapture (read(image), release())
+    usado no lugar da câmera, ex.: replay de vídeo/gravação em benchmarks.
+    """
+    def __init__(self, src=0, width=640, height=360, queue_size=4, use_picamera=True,
+                 capture_format="bgr", lores_size=None, capture=None):
         super().__init__(daemon=True)
+        if capture_format not in CAPTURE_FORMATS:
+            raise ValueError(f"capture_format inválido: {capture_format}")
         self.width = width
         self.height = height
-        self.queue = deque(maxlen=queue_size)
+        self.capture_format = capture_format
+        self.lores_size = lores_size or lores_size_for(320, width, height)
+        self.ring = FrameRing(size=queue_size)
         self.running = False
-        self.use_picamera = use_picamera and PICAMERA2_AVAILABLE
+        self.use_picamera = use_picamera and capture is None and picamera2_usable()
         self.src = src
 
-        if self.use_picamera:
-            log.info("Usando Picamera2 para captura.")
-            self.picam2 = Picamera2()
-            config = self.picam2.create_preview_configuration({'size': (self.width, self.height)})
-            config['main']['format'] = 'RGB888'
+        if capture is not None:
+            log.info("Usando fonte de captura injetada: %s", type(capture).__name__)
+            self.cap = capture
+        elif self.use_picamera:
+            log.info("Usando Picamera2 para captura (%s).", capture_format)
+            self.picam2 = picamera2.Picamera2()
+            if capture_format == "lores":
+                config = self.picam2.create_preview_configuration(
+                    main={'size': (self.width, self.height), 'format': 'RGB888'},
+                    lores={'size': self.lores_size, 'format': 'YUV420'})
+            else:
+                config = self.picam2.create_preview_configuration({'size': (self.width, self.height)})
+                config['main']['format'] = 'RGB888'
             self.picam2.configure(config)
         else:
             log.info("Usando OpenCV VideoCapture para captura (fallback).")
@@ -40,8 +150,24 @@ class CameraThread(threading.Thread):
             if not self.cap.isOpened():
                 raise RuntimeError("Não foi possível abrir VideoCapture (V4L2). Verifique libcamera/legacy driver.")
 
-            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
-            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+            # sem ISP: no modo lores pedimos direto ao driver o tamanho de inferência
+            w, h = self.lores_size if capture_format == "lores" else (self.width, self.height)
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, w)
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, h)
+
+    def _store_picamera(self, request):
+        if self.capture_format == "lores":
+            w, h = self.lores_size
+            with picamera2.MappedArray(request, "lores") as m:
+                self.ring.allocate((h, w, 3))
+                slot, buf = self.ring.acquire()
+                cv2.cvtColor(m.array[:h * 3 // 2, :w], cv2.COLOR_YUV2BGR_I420, dst=buf)
+        else:
+            with picamera2.MappedArray(request, "main") as m:
+                self.ring.allocate(m.array.shape)
+                slot, buf = self.ring.acquire()
+                np.copyto(buf, m.array)
+        return slot
 
     def run(self):
         self.running = True
@@ -49,32 +175,42 @@ class CameraThread(threading.Thread):
             self.picam2.start()
             while self.running:
                 try:
-                    arr = self.picam2.capture_array()
-                    if arr is None:
-                        log.warning("Picamera2 retornou None frame")
-                        time.sleep(0.01)
-                        continue
-                    frame = cv2.cvtColor(arr, cv2.COLOR_RGB2BGR)
-                    self.queue.append(frame)
+                    request = self.picam2.capture_request()
+                    try:
+                        ts = time.time()
+                        # copia direto do buffer mapeado para o slot do anel
+                        slot = self._store_picamera(request)
+                    finally:
+                        request.release()
+                    self.ring.publish(slot, ts)
+                    REGISTRY.inc("frames_captured")
+                    REGISTRY.observe("capture_copy", time.time() - ts)
                 except Exception as e:
                     log.exception("Erro lendo Picamera2: %s", e)
                     time.sleep(0.1)
         else:
             while self.running:
-                ret, frame = self.cap.read()
+                slot, buf = self.ring.acquire() if self.ring.buffers is not None else (None, None)
+                ret, frame = self.cap.read(buf)
                 if not ret or frame is None:
                     log.debug("VideoCapture read falhou; tentando novamente")
                     time.sleep(0.02)
                     continue
-                self.queue.append(frame)
+                if frame is not buf:
+                    # primeiro frame, tamanho mudou ou o backend ignorou o buffer: (re)aloca o anel
+                    self.ring.allocate(frame.shape, frame.dtype)
+                    slot, buf = self.ring.acquire()
+                    np.copyto(buf, frame)
+                self.ring.publish(slot)
+                REGISTRY.inc("frames_captured")
+
+    def read_packet(self, after_id=0, timeout=1.0):
+        """Frame mais novo que after_id como FramePacket(frame, frame_id, timestamp) somente-leitura."""
+        return self.ring.wait_newer(after_id, timeout)
 
     def read(self, timeout=1.0):
-        start = time.time()
-        while time.time() - start < timeout:
-            if len(self.queue) > 0:
-                return self.queue[-1].copy()
-            time.sleep(0.005)
-        return None
+        packet = self.ring.wait_newer(0, timeout)
+        return None if packet is None else packet.frame
 
     def stop(self):
         self.running = False
@@ -90,31 +226,104 @@ class CameraThread(threading.Thread):
                 pass
 
 class ObjectDetector:
-    def __init__(self, model_path="yolov8n.pt", device="cpu", conf=0.25, iou=0.45):
-        self.model = YOLO(model_path)
+    """
+    backend: "pytorch", "onnx", "openvino", "ncnn" ou "auto" (runtime mais rápido
+    disponível). Backends exportados têm imgsz fixo, então cada imgsz usado é
+    exportado/carregado uma vez (cache em disco, ver backends.py). No backend ONNX
+    a saída bruta vai direto para decode_yolov8 (NMS vetorizado em NumPy).
+
+    classes: ids a manter; o filtro é aplicado antes do NMS.
+    """
+    def __init__(self, model_path="yolov8n.pt", device="cpu", conf=0.25, iou=0.45,
+                 backend="pytorch", imgsz=640, int8=False, cache_dir=DEFAULT_CACHE_DIR, classes=None):
+        self.model_path = model_path
         self.device = device
         self.conf = conf
         self.iou = iou
+        self.int8 = int8
+        self.cache_dir = cache_dir
+        self.classes = sorted(classes) if classes is not None else None
+        self.model, self.backend = load_model(model_path, backend, imgsz=imgsz, int8=int8,
+                                              cache_dir=cache_dir, raw=True)
+        self.raw = isinstance(self.model, OnnxRuntimeModel)
+        self.names = dict(getattr(self.model, "names", {}) or {})
+        self.models = {imgsz: self.model}
+        log.info("ObjectDetector usando backend %s", self.backend)
+
+    def model_for(self, imgsz):
+        if self.backend == "pytorch":
+            return self.model
+        model = self.models.get(imgsz)
+        if model is None:
+            model, _ = load_model(self.model_path, self.backend, imgsz=imgsz, int8=self.int8,
+                                  cache_dir=self.cache_dir, raw=self.raw)
+            self.models[imgsz] = model
+        return model
+
+    def detect(self, frame, imgsz=640, conf=None):
+        """Roda o modelo sem desenhar nada; devolve Detections."""
+        return self.detect_batch([frame], imgsz, conf)[0]
+
+    def detect_batch(self, frames, imgsz=640, conf=None):
+        """
+        Vários frames/recortes: uma chamada só no PyTorch; nos exports (batch 1,
+        incluindo o NCNN padrão no Pi) e no ONNX cru, um por chamada.
+        """
+        conf = self.conf if conf is None else conf
+        model = self.model_for(imgsz)
+        if self.raw:
+            out = []
+            for frame in frames:
+                img, scale, pad = letterbox(frame, imgsz)
+                blob = cv2.dnn.blobFromImage(img, 1.0 / 255.0, swapRB=True)
+                out.append(decode_yolov8(model(blob), conf, self.iou, self.classes, scale, pad))
+            return out
+        results = predict(model, self.backend, frames, imgsz=imgsz, conf=conf, iou=self.iou, device=self.device,
+                          classes=self.classes, verbose=False)
+        return [Detections.from_ultralytics(r) for r in results]
+
+    def detect_tiled(self, frame, coarse_imgsz=320, tile_imgsz=640, mode="roi", grid=(2, 2), overlap=0.2,
+                     candidate_conf=0.1, max_rois=4):
+        """
+        Detecção em dois passes para objetos pequenos/distantes:
+          1. passe barato no frame inteiro em coarse_imgsz, com limiar baixo
+             (candidate_conf) para achar candidatos;
+          2. re-inferência em tile_imgsz só nos recortes: em volta dos candidatos
+             (mode="roi") ou em todos os tiles de uma grade rows x cols (mode="grid").
+        Os recortes vão por detect_batch (um batch no PyTorch, um a um nos exports);
+        as caixas voltam ao espaço do frame e tudo (inclusive as detecções
+        confiáveis do passe grosso) é fundido com NMS entre tiles.
+        """
+        h, w = frame.shape[:2]
+        coarse = self.detect(frame, coarse_imgsz, conf=min(candidate_conf, self.conf))
+        if mode == "grid":
+            windows = tile_grid(w, h, grid[0], grid[1], overlap)
+        else:
+            windows = roi_windows(coarse, w, h, tile_imgsz, max_rois=max_rois)
+        if not windows:
+            return coarse.filter(min_conf=self.conf)
+        crops = [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in windows]
+        fine = self.detect_batch(crops, tile_imgsz)
+        dets = [d.shifted(x1, y1) for d, (x1, y1, _, _) in zip(fine, windows)]
+        dets.append(coarse.filter(min_conf=self.conf))
+        return merge_detections(dets, self.iou)
+
+    def warmup(self, shape=(360, 640, 3), imgszs=(640,), runs=1):
+        """
+        Inferência em frames falsos antes do primeiro frame real: carrega/exporta
+        o modelo de cada imgsz e paga a inicialização do grafo fora do loop.
+        Devolve o tempo gasto.
+        """
+        t0 = time.perf_counter()
+        dummy = np.zeros(shape, np.uint8)
+        for imgsz in dict.fromkeys(imgszs):
+            for _ in range(max(0, int(runs))):
+                self.detect(dummy, imgsz=imgsz)
+        return time.perf_counter() - t0
 
     def infer(self, frame, imgsz=640):
-        results = self.model(frame, imgsz=imgsz, conf=self.conf, iou=self.iou, device=self.device)
-        r = results[0]
-        try:
-            annotated = r.plot()
-        except Exception:
-            annotated = frame.copy()
-        classes = []
-        if hasattr(r, "boxes") and r.boxes is not None and len(r.boxes) > 0:
-            try:
-                cls = r.boxes.cls
-                classes = [int(x) for x in cls.tolist()]
-            except Exception:
-                for box in r.boxes:
-                    try:
-                        classes.append(int(box.cls))
-                    except Exception:
-                        pass
-        return annotated, classes
+        det = self.detect(frame, imgsz=imgsz)
+        return draw_detections(frame.copy(), det, self.names), det.classes.tolist()
 
-def draw_boxes(img, results):
-    return results
+def draw_boxes(img, detections, names=None):
+    return draw_detections(img, detections, names)
@@ -0,0 +1,191 @@
+# src/policy.py
+"""
+Política detecção -> comando, compartilhada por main.py e server_pc.py.
+
+Em vez de mapear "classe presente" para um de quatro comandos, decide com a
+geometria das caixas (vetorizado sobre todas as detecções):
+  - erro de centralização: posição horizontal do alvo em [-1, 1];
+  - distância estimada pela área da caixa: sqrt(target_area / área), 1.0 = na
+    distância desejada, > 1 = longe;
+  - prioridade por classe: só as detecções da classe de maior prioridade
+    presente contam, e a ação dela decide (follow, avoid, stop);
+  - peso por confiança: o erro é a média ponderada por conf * área e a
+    velocidade cai com confiança baixa.
+Saída: velocidade por roda (-100..100 %), mandada ao robot_server com DRIVE,
+e um rótulo discreto (FORWARD/LEFT/RIGHT/BACK/STOP) para clientes antigos.
+
+No modo "discrete" não há geometria: a classe de maior prioridade presente
+decide um comando fixo pela ação (DISCRETE_COMMANDS), como o mapeamento antigo
+do main.py/server_pc.py (pessoa -> FORWARD, carro -> LEFT, nada -> STOP);
+min_conf continua valendo nos dois modos.
+
+Config em JSON (--policy arquivo.json), chaves omitidas ficam com DEFAULT_CONFIG:
+{
+  "mode": "proportional",            # ou "discrete" (comando fixo por ação, com histerese)
+  "classes": {"0": {"action": "follow", "priority": 2},
+              "2": {"action": "avoid", "priority": 1, "avoid_area": 0.05}},
+  "min_conf": 0.3, "full_conf": 0.6,
+  "base_speed": 60, "max_speed": 80, "turn_speed": 40,
+  "steer_gain": 1.5, "deadband": 0.05,
+  "target_area": 0.15,
+  "smoothing": 0.3
+}
+"""
+import json
+import copy
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+log = logging.getLogger("policy")
+
+ACTIONS = ("follow", "avoid", "stop")
+# modo discrete: ação -> comando, igual ao mapeamento antigo classe -> comando
+DISCRETE_COMMANDS = {"follow": "FORWARD", "avoid": "LEFT", "stop": "STOP"}
+
+DEFAULT_CONFIG = {
+    "mode": "proportional",
+    # mesmas classes e precedência do mapeamento antigo (pessoa antes de carro); em
+    # "proportional" o follow para perto do alvo e o avoid desvia para o lado livre,
+    # só o modo "discrete" reproduz os comandos antigos exatamente
+    "classes": {
+        "0": {"action": "follow", "priority": 2},
+        "2": {"action": "avoid", "priority": 1},
+    },
+    "min_conf": 0.3,          # abaixo disso a detecção é ignorada
+    "full_conf": 0.6,         # a partir disso a velocidade não é mais reduzida
+    "base_speed": 60.0,       # % com o alvo longe e centralizado
+    "max_speed": 80.0,        # limite por roda
+    "turn_speed": 40.0,       # % diferencial com erro de centralização máximo
+    "steer_gain": 1.5,
+    "deadband": 0.05,         # erro de centralização ignorado
+    "target_area": 0.15,      # fração do frame em que o follow para (distância desejada)
+    "avoid_area": 0.05,       # área a partir da qual o avoid desvia com força total
+    "smoothing": 0.3,         # EMA das velocidades entre frames (0 = sem suavização)
+}
+
+DriveCommand = namedtuple("DriveCommand", ["name", "left", "right", "target_class", "error", "distance"])
+STOP_COMMAND = DriveCommand("STOP", 0.0, 0.0, None, 0.0, float("inf"))
+
+def load_config(path=None):
+    """DEFAULT_CONFIG com as chaves do JSON em `path` por cima (classes substituem a tabela inteira)."""
+    cfg = copy.deepcopy(DEFAULT_CONFIG)
+    if path:
+        with open(path) as f:
+            user = json.load(f)
+        unknown = set(user) - set(DEFAULT_CONFIG)
+        if unknown:
+            raise ValueError(f"chaves desconhecidas na política: {sorted(unknown)}")
+        cfg.update(user)
+    if cfg["mode"] not in ("proportional", "discrete"):
+        raise ValueError(f"modo inválido: {cfg['mode']}")
+    for cls, rule in cfg["classes"].items():
+        if rule.get("action") not in ACTIONS:
+            raise ValueError(f"ação inválida para a classe {cls}: {rule.get('action')}")
+    return cfg
+
+class Policy:
+    """Decide o comando a partir de Detections (ou tracks.as_detections()); guarda só o estado da suavização."""
+    def __init__(self, config=None):
+        cfg = load_config() if config is None else config
+        self.cfg = cfg
+        self.proportional = cfg["mode"] == "proportional"
+        ids = sorted(int(c) for c in cfg["classes"])
+        self.classes = tuple(ids)
+        # tabelas indexadas por classe: prioridade (0 = ignorada) e ação
+        n = (max(ids) + 1) if ids else 1
+        self.priority = np.zeros(n, np.float32)
+        self.action = np.full(n, -1, np.int8)
+        self.avoid_area = np.full(n, cfg["avoid_area"], np.float32)
+        for c in ids:
+            rule = cfg["classes"][str(c)]
+            self.priority[c] = float(rule.get("priority", 1))
+            self.action[c] = ACTIONS.index(rule["action"])
+            self.avoid_area[c] = float(rule.get("avoid_area", cfg["avoid_area"]))
+        self.left = 0.0
+        self.right = 0.0
+
+    @classmethod
+    def from_file(cls, path=None):
+        policy = cls(load_config(path))
+        if path:
+            log.info("Política carregada de %s: modo %s, classes %s", path, policy.cfg["mode"], policy.classes)
+        return policy
+
+    def decide(self, det, width, height):
+        cfg = self.cfg
+        if not len(det):
+            return self._output(STOP_COMMAND)
+        classes = det.classes.astype(np.int64)
+        known = classes < len(self.priority)
+        prio = np.where(known, self.priority[np.minimum(classes, len(self.priority) - 1)], 0.0)
+        valid = (prio > 0) & (det.confs >= cfg["min_conf"])
+        if not valid.any():
+            return self._output(STOP_COMMAND)
+        # só a classe de maior prioridade presente decide
+        top = prio[valid].max()
+        sel = valid & (prio == top)
+        boxes, confs = det.boxes[sel], det.confs[sel]
+        target_class = int(classes[sel][np.argmax(confs)])
+        action = ACTIONS[self.action[target_class]]
+        if not self.proportional:
+            return self._discrete(action, target_class)
+
+        cx = (boxes[:, 0] + boxes[:, 2]) * (0.5 / width) * 2.0 - 1.0
+        area = ((boxes[:, 2] - boxes[:, 0]).clip(0) * (boxes[:, 3] - boxes[:, 1]).clip(0)) / float(width * height)
+        weights = confs * area + 1e-9
+        error = float(np.dot(weights, cx) / weights.sum())
+        # o maior (mais próximo) define a distância; a confiança ponderada define o quanto confiar
+        nearest = float(area.max())
+        distance = float(np.sqrt(cfg["target_area"] / max(nearest, 1e-6)))
+        conf = float(np.dot(weights, confs) / weights.sum())
+        trust = min(1.0, max(0.0, (conf - cfg["min_conf"]) / max(cfg["full_conf"] - cfg["min_conf"], 1e-6)))
+        trust = 0.5 + 0.5 * trust
+
+        steer = 0.0 if abs(error) < cfg["deadband"] else float(np.clip(cfg["steer_gain"] * error, -1.0, 1.0))
+        if action == "follow":
+            # para na distância desejada e acelera até base_speed ao dobro dela
+            speed = cfg["base_speed"] * min(1.0, max(0.0, distance - 1.0)) * trust
+            turn = steer * cfg["turn_speed"]
+        elif action == "avoid":
+            # quanto mais perto, mais lento e mais forte a curva para o lado oposto
+            near = min(1.0, nearest / max(float(self.avoid_area[target_class]), 1e-6))
+            speed = cfg["base_speed"] * (1.0 - near) * trust
+            away = -1.0 if error >= 0 else 1.0
+            turn = away * cfg["turn_speed"] * max(near, abs(steer))
+        else:
+            speed, turn = 0.0, 0.0
+        cmd = DriveCommand("", speed + turn, speed - turn, target_class, error, distance)
+        return self._output(cmd)
+
+    def _discrete(self, action, target_class):
+        """Comando fixo da ação, com as velocidades que o robot_server usaria para ele."""
+        name = DISCRETE_COMMANDS[action]
+        speed, turn = self.cfg["base_speed"], self.cfg["turn_speed"]
+        left, right = {"FORWARD": (speed, speed), "LEFT": (-turn, turn)}.get(name, (0.0, 0.0))
+        self.left, self.right = left, right
+        return DriveCommand(name, round(left), round(right), target_class, 0.0, float("inf"))
+
+    def _output(self, cmd):
+        cfg = self.cfg
+        limit = cfg["max_speed"]
+        left = float(np.clip(cmd.left, -limit, limit))
+        right = float(np.clip(cmd.right, -limit, limit))
+        a = cfg["smoothing"]
+        if a and cmd is not STOP_COMMAND:
+            left = a * self.left + (1.0 - a) * left
+            right = a * self.right + (1.0 - a) * right
+        self.left, self.right = left, right
+        return cmd._replace(name=label(left, right), left=round(left), right=round(right))
+
+def label(left, right, eps=1.0):
+    """Comando discreto mais próximo das velocidades por roda."""
+    if abs(left) < eps and abs(right) < eps:
+        return "STOP"
+    if abs(left - right) > abs(left + right):
+        return "RIGHT" if left > right else "LEFT"
+    return "FORWARD" if left + right > 0 else "BACK"
+
+def add_arguments(p):
+    p.add_argument("--policy", default=None, help="arquivo JSON da política detecção -> comando (ver policy.py)")
@@ -0,0 +1,126 @@
+import threading
+import time
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote
+
+import cv2
+
+log = logging.getLogger("preview")
+
+class PreviewSink(threading.Thread):
+    """
+    Preview fora do loop principal, com taxa limitada. O produtor só entrega uma
+    função render() quando wants() diz que o próximo frame será exibido; a
+    anotação (plot/putText) roda nesta thread e só para os frames mostrados.
+
+    mode="window" usa cv2.imshow; mode="mjpeg" serve http://host:port/ em MJPEG.
+    """
+    def __init__(self, max_fps=10.0, mode="window", host="127.0.0.1", port=8080, jpeg_quality=70):
+        super().__init__(daemon=True)
+        self.period = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.mode = mode
+        self.jpeg_quality = int(jpeg_quality)
+        self.running = False
+        self.quit_requested = threading.Event()
+        self.cond = threading.Condition()
+        self.pending = {}    # nome -> render()
+        self.last_shown = {}  # nome -> instante
+        self.jpegs = {}      # nome -> (contador, bytes) para o MJPEG
+        self.server = None
+        if mode == "mjpeg":
+            self.server = ThreadingHTTPServer((host, port), _make_mjpeg_handler(self))
+            self.server.daemon_threads = True
+            log.info("Preview MJPEG em http://%s:%d/", host, port)
+
+    def wants(self, name):
+        """True se um frame enviado agora para `name` seria exibido."""
+        return time.perf_counter() - self.last_shown.get(name, 0.0) >= self.period
+
+    def submit(self, name, render):
+        with self.cond:
+            self.pending[name] = render
+            self.cond.notify()
+
+    def run(self):
+        self.running = True
+        if self.server is not None:
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        while self.running:
+            with self.cond:
+                if not self.pending:
+                    self.cond.wait(0.05)
+                pending, self.pending = self.pending, {}
+            for name, render in pending.items():
+                self.last_shown[name] = time.perf_counter()
+                try:
+                    img = render()
+                except Exception as e:
+                    log.exception("Erro renderizando preview: %s", e)
+                    continue
+                if self.mode == "mjpeg":
+                    ok, buf = cv2.imencode(".jpg", img, [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality])
+                    if ok:
+                        with self.cond:
+                            count = self.jpegs.get(name, (0, None))[0] + 1
+                            self.jpegs[name] = (count, buf.tobytes())
+                            self.cond.notify_all()
+                else:
+                    cv2.imshow(name, img)
+            if self.mode == "window" and cv2.waitKey(1) & 0xFF == ord('q'):
+                log.info("Quit requested from display")
+                self.quit_requested.set()
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.mode == "window":
+            self.join(timeout=1.0)
+            cv2.destroyAllWindows()
+
+def _make_mjpeg_handler(sink):
+    class MjpegHandler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            log.debug("mjpeg: " + fmt, *args)
+
+        def do_GET(self):
+            if self.path == "/":
+                names = sorted(sink.jpegs)
+                body = "".join(f'<p>{n}</p><img src="/stream/{quote(n, safe="")}"/>' for n in names)
+                body = f"<html><body>{body or 'sem streams'}</body></html>".encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            if not self.path.startswith("/stream/"):
+                self.send_error(404)
+                return
+            name = unquote(self.path[len("/stream/"):])
+            self.send_response(200)
+            self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+            self.end_headers()
+            seen = 0
+            try:
+                while sink.running:
+                    with sink.cond:
+                        sink.cond.wait_for(lambda: sink.jpegs.get(name, (0, None))[0] != seen or not sink.running, 1.0)
+                        seen, jpg = sink.jpegs.get(name, (0, None))
+                    if jpg is None:
+                        continue
+                    self.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\n")
+                    self.wfile.write(f"Content-Length: {len(jpg)}\r\n\r\n".encode("ascii"))
+                    self.wfile.write(jpg + b"\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+    return MjpegHandler
+
+def draw_overlay(img, cmd, fps, scale=0.9):
+    cv2.putText(img, f"CMD: {cmd}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, scale, (0, 255, 0), 2)
+    cv2.putText(img, f"FPS: {fps:.1f}", (10, 60), cv2.FONT_HERSHEY_SIMPLEX, scale * 0.9, (0, 255, 255), 2)
+    return img
@@ -0,0 +1,301 @@
+# src/recording.py
+"""
+Gravação e replay de sessões (frames + comandos) para reproduzir problemas de
+campo e medir o pipeline de forma determinística.
+
+Arquivo de dados (append-only): registros [REC_HDR][payload] em sequência.
+REC_HDR = [sync "RVRC"][size:u32][kind:u8][fmt:u8][h:u16][w:u16][c:u8][-][frame_id:u32][ts:f64]
+kind: KIND_FRAME (payload = JPEG ou pixels crus, fmt) ou KIND_COMMAND (texto).
+Índice (<arquivo>.idx): uma entrada INDEX_DTYPE por registro, com o offset do
+payload. Se o índice faltar ou estiver curto (gravação interrompida), é
+reconstruído varrendo o arquivo de dados.
+
+O replay mapeia o arquivo com mmap: frames crus viram views sem cópia e JPEGs
+gravados são servidos como estão (read_jpeg) sem recodificar.
+"""
+import os
+import mmap
+import queue
+import struct
+import threading
+import time
+import logging
+
+import cv2
+import numpy as np
+
+log = logging.getLogger("recording")
+
+SYNC = b"RVRC"
+REC_HDR = struct.Struct("<4sIBBHHBBId")
+KIND_FRAME, KIND_COMMAND = 1, 2
+FMT_RAW, FMT_JPEG, FMT_TEXT = 0, 1, 2
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("size", "<u4"), ("kind", "u1"), ("fmt", "u1"), ("h", "<u2"),
+                        ("w", "<u2"), ("c", "u1"), ("pad", "u1"), ("frame_id", "<u4"), ("ts", "<f8")])
+
+def index_path(path):
+    return path + ".idx"
+
+class Recorder(threading.Thread):
+    """
+    Grava em segundo plano para não travar o loop de controle: write_frame()
+    copia (ou recebe o JPEG já pronto) e enfileira; se o disco não acompanhar,
+    frames são descartados e contados em `dropped` (comandos nunca).
+    fmt="jpeg" codifica na thread de gravação; fmt="raw" grava os pixels.
+    """
+    def __init__(self, path, fmt="jpeg", quality=85, max_queue=64):
+        super().__init__(daemon=True)
+        if fmt not in ("jpeg", "raw"):
+            raise ValueError(f"formato inválido: {fmt}")
+        self.path = path
+        self.fmt = fmt
+        self.quality = int(quality)
+        self.q = queue.Queue(max_queue)
+        self.data = open(path, "ab")
+        self.index = open(index_path(path), "ab")
+        self.frames = 0
+        self.dropped = 0
+        self.frame_id = 0
+        self.start()
+        log.info("Gravando em %s (%s)", path, fmt)
+
+    def write_frame(self, frame=None, ts=None, frame_id=None, jpeg=None):
+        """Grava um frame BGR (copiado aqui) ou um JPEG já codificado (jpeg=bytes)."""
+        self.frame_id = self.frame_id + 1 if frame_id is None else frame_id
+        item = (KIND_FRAME, time.time() if ts is None else ts, self.frame_id,
+                frame.copy() if jpeg is None else None, jpeg)
+        try:
+            self.q.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def write_command(self, cmd, ts=None, frame_id=None):
+        self.q.put((KIND_COMMAND, time.time() if ts is None else ts,
+                    self.frame_id if frame_id is None else frame_id, None, str(cmd).encode("utf-8")))
+
+    def _append(self, kind, fmt, ts, frame_id, payload, shape=(0, 0, 0)):
+        h, w, c = shape
+        offset = self.data.tell() + REC_HDR.size
+        self.data.write(REC_HDR.pack(SYNC, len(payload), kind, fmt, h, w, c, 0, frame_id & 0xFFFFFFFF, ts))
+        self.data.write(payload)
+        entry = np.array([(offset, len(payload), kind, fmt, h, w, c, 0, frame_id & 0xFFFFFFFF, ts)], INDEX_DTYPE)
+        self.index.write(entry.tobytes())
+
+    def run(self):
+        while True:
+            item = self.q.get()
+            if item is None:
+                break
+            kind, ts, frame_id, frame, payload = item
+            try:
+                if kind == KIND_COMMAND:
+                    self._append(kind, FMT_TEXT, ts, frame_id, payload)
+                    continue
+                if payload is not None:
+                    self._append(kind, FMT_JPEG, ts, frame_id, payload)
+                    self.frames += 1
+                    continue
+                shape = frame.shape if frame.ndim == 3 else frame.shape + (1,)
+                if self.fmt == "jpeg":
+                    ok, buf = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), self.quality])
+                    if ok:
+                        self._append(kind, FMT_JPEG, ts, frame_id, buf.tobytes(), shape)
+                else:
+                    self._append(kind, FMT_RAW, ts, frame_id, np.ascontiguousarray(frame).reshape(-1).data, shape)
+                self.frames += 1
+            except Exception as e:
+                log.exception("Erro gravando: %s", e)
+
+    def close(self):
+        self.q.put(None)
+        self.join(timeout=5.0)
+        self.data.close()
+        self.index.close()
+        log.info("Gravação encerrada: %d frames (%d descartados) em %s", self.frames, self.dropped, self.path)
+
+class Recording:
+    """Sessão gravada, mapeada em memória; `index` é o array INDEX_DTYPE de todos os registros."""
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.index = self._load_index(size)
+        self.frames = self.index[self.index["kind"] == KIND_FRAME]
+        self.commands = self.index[self.index["kind"] == KIND_COMMAND]
+
+    def _load_index(self, size):
+        idx = np.empty(0, INDEX_DTYPE)
+        if os.path.exists(index_path(self.path)):
+            idx = np.fromfile(index_path(self.path), INDEX_DTYPE)
+            idx = idx[idx["offset"] + idx["size"] <= size]
+        end = int(idx["offset"][-1] + idx["size"][-1]) if len(idx) else 0
+        if end < size:
+            # índice curto: completa varrendo os registros restantes do arquivo de dados
+            idx = np.concatenate([idx, self._scan(end, size)])
+        return idx
+
+    def _scan(self, pos, size):
+        entries = []
+        while pos + REC_HDR.size <= size:
+            sync, n, kind, fmt, h, w, c, _, frame_id, ts = REC_HDR.unpack_from(self.mm, pos)
+            if sync != SYNC or pos + REC_HDR.size + n > size:
+                break
+            entries.append((pos + REC_HDR.size, n, kind, fmt, h, w, c, 0, frame_id, ts))
+            pos += REC_HDR.size + n
+        if entries:
+            log.info("Índice reconstruído: %d registros", len(entries))
+        return np.array(entries, INDEX_DTYPE)
+
+    def payload(self, entry):
+        off = int(entry["offset"])
+        return memoryview(self.mm)[off:off + int(entry["size"])]
+
+    def frame(self, i):
+        """Frame i como array BGR: view somente-leitura do mmap (raw) ou JPEG decodificado."""
+        entry = self.frames[i]
+        buf = self.payload(entry)
+        if entry["fmt"] == FMT_RAW:
+            h, w, c = int(entry["h"]), int(entry["w"]), int(entry["c"])
+            return np.frombuffer(buf, np.uint8).reshape((h, w, c) if c > 1 else (h, w))
+        return cv2.imdecode(np.frombuffer(buf, np.uint8), cv2.IMREAD_COLOR)
+
+    def jpeg(self, i, quality=85):
+        """Frame i como JPEG; gravações JPEG saem sem recodificar."""
+        entry = self.frames[i]
+        if entry["fmt"] == FMT_JPEG:
+            return bytes(self.payload(entry))
+        ok, buf = cv2.imencode(".jpg", self.frame(i), [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+        return buf.tobytes() if ok else None
+
+    def command_list(self):
+        return [(float(e["ts"]), int(e["frame_id"]), bytes(self.payload(e)).decode("utf-8"))
+                for e in self.commands]
+
+    def close(self):
+        if self.mm is not None:
+            try:
+                self.mm.close()
+            except BufferError:
+                # ainda há frames (views) vivos apontando para o mmap; o GC fecha depois
+                pass
+        self.file.close()
+
+class ReplaySource:
+    """
+    Serve os frames de uma gravação no ritmo original (speed=1.0, 2.0 = dobro)
+    ou o mais rápido possível (speed=0). Interface de leitura:
+      read()            -> frame (como Camera.read / CameraThread.read)
+      read_packet()     -> FramePacket (como CameraThread; sem thread, então
+                           nenhum frame é pulado mesmo na velocidade máxima)
+      read_jpeg(q, size)-> JPEG (como Camera.read_jpeg; sem recodificar se possível)
+Para CameraThread(capture=...), envolver em ReplayCapture.
+    """
+    def __init__(self, path, speed=1.0, loop=False):
+        self.rec = Recording(path)
+        if not len(self.rec.frames):
+            raise RuntimeError(f"Gravação sem frames: {path}")
+        self.speed = speed
+        self.loop = loop
+        self.pos = 0
+        self.t0 = None
+        self.ts0 = float(self.rec.frames["ts"][0])
+        self.height, self.width = (int(self.rec.frames["h"][0]), int(self.rec.frames["w"][0]))
+        if not self.width:
+            # JPEG gravado já codificado: tamanho só decodificando
+            self.height, self.width = self.rec.frame(0).shape[:2]
+        self.opened = True
+        self.served = 0
+        log.info("Replay de %s: %d frames, %d comandos", path, len(self.rec.frames), len(self.rec.commands))
+
+    def __len__(self):
+        return len(self.rec.frames)
+
+    @property
+    def exhausted(self):
+        return not self.opened or (not self.loop and self.pos >= len(self.rec.frames))
+
+    def _next(self):
+        """Índice do próximo frame respeitando o ritmo; None no fim."""
+        if not self.opened:
+            return None
+        if self.pos >= len(self.rec.frames):
+            if not self.loop:
+                return None
+            self.pos, self.t0 = 0, None
+        i = self.pos
+        self.pos += 1
+        if self.speed:
+            now = time.perf_counter()
+            if self.t0 is None:
+                self.t0 = now
+            due = self.t0 + (float(self.rec.frames["ts"][i]) - self.ts0) / self.speed
+            if due > now:
+                time.sleep(due - now)
+        return i
+
+    def read(self):
+        i = self._next()
+        return None if i is None else self.rec.frame(i)
+
+    # interface CameraThread (main.py)
+    def start(self):
+        pass
+
+    def read_packet(self, after_id=0, timeout=1.0):
+        # import tardio: o robot_client usa este módulo sem carregar o detector
+        from perception import FramePacket
+        i = self._next()
+        if i is None:
+            return None
+        self.served += 1
+        # timestamp do replay, não o gravado: as métricas de latência continuam válidas
+        return FramePacket(self.rec.frame(i), self.served, time.time())
+
+    def stop(self):
+        self.release()
+
+    def read_jpeg(self, quality=85, size=None):
+        i = self._next()
+        if i is None:
+            return None
+        if size is None or tuple(size) == (self.width, self.height):
+            return self.rec.jpeg(i, quality)
+        frame = cv2.resize(self.rec.frame(i), tuple(size), interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+        return buf.tobytes() if ok else None
+
+    def isOpened(self):
+        return self.opened
+
+    def release(self):
+        if self.opened:
+            self.opened = False
+            self.rec.close()
+
+class ReplayCapture:
+    """
+    Adaptador VideoCapture (read(image) -> (ret, frame)) para CameraThread(capture=...)
+    de qualquer fonte com read() -> frame ou None, isOpened() e release():
+    ReplaySource ou os frames em memória do bench.
+    """
+    def __init__(self, source):
+        self.source = source
+
+    def isOpened(self):
+        return self.source.isOpened()
+
+    def set(self, prop, value):
+        return False
+
+    def read(self, image=None):
+        frame = self.source.read()
+        if frame is None:
+            return False, None
+        if image is not None and image.shape == frame.shape:
+            np.copyto(image, frame)
+            return True, image
+        return True, np.array(frame)
+
+    def release(self):
+        self.source.release()
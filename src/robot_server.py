@@ -1,59 +1,257 @@
 import socket
+import selectors
 import logging
-from motion_control import MotorController
 import threading
+import time
+import argparse
+from motion_control import ACCEL, DECEL, RATE_HZ, MotorController
+from command_link import HELLO_BIN, ACK_BIN, unpack_commands
+import metrics
+from metrics import REGISTRY
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("robot_server")
 
-HOST = "" 
+HOST = ""
 PORT = 8000
+DEADMAN_S = 1.0
+MAX_CMD_AGE_S = 0.5
 
-def client_thread(conn, addr, motor):
-    log.info("Conexão recebida de %s", addr)
-    try:
-        with conn:
-            buf = b""
-            while True:
-                data = conn.recv(1024)
-                if not data:
-                    break
-                buf += data
-                # suporta comandos terminados em newline
-                while b"\n" in buf:
-                    line, buf = buf.split(b"\n", 1)
-                    cmd = line.decode().strip().upper()
-                    log.info("Comando: %s", cmd)
-                    if cmd == "FORWARD":
-                        motor.forward()
-                    elif cmd == "BACK":
-                        motor.backward()
-                    elif cmd == "LEFT":
-                        motor.left()
-                    elif cmd == "RIGHT":
-                        motor.right()
-                    elif cmd == "STOP":
-                        motor.stop()
-                    elif cmd == "CLEANUP":
-                        motor.cleanup()
-                    else:
-                        log.warning("Comando desconhecido: %s", cmd)
-    except Exception as e:
-        log.exception("Erro na thread do cliente: %s", e)
-
-def run_server(host=HOST, port=PORT):
-    motor = MotorController()
+# comando -> método do MotorController
+COMMANDS = {
+    "FORWARD": "forward",
+    "BACK": "backward",
+    "LEFT": "left",
+    "RIGHT": "right",
+    "STOP": "stop",
+    "CLEANUP": "cleanup",
+    "DRIVE": "set_velocity",
+}
+# comandos de segurança vencem os de movimento dentro do mesmo lote
+PRIORITY = {"CLEANUP": 2, "STOP": 1}
+
+def coalesce(cmds):
+    """Reduz um lote de (cmd, speed) ao mais novo, com CLEANUP/STOP tendo prioridade (DRIVE: speed = (left, right))."""
+    best = None
+    for item in cmds:
+        if best is None or PRIORITY.get(item[0], 0) >= PRIORITY.get(best[0], 0):
+            best = item
+    return best
+
+class Actuator(threading.Thread):
+    """
+    Única thread que fala com o MotorController. Guarda só o comando mais recente
+    (latest-wins), então um acúmulo de FORWARDs velhos nunca roda depois de um
+    STOP mais novo, e não reescreve o GPIO se o estado não mudou.
+    Deadman: sem nenhum comando por `deadman` segundos, para os motores.
+    O MotorController rampa as velocidades na própria thread, então aplicar um
+    comando aqui só troca o alvo e não espera o GPIO.
+    """
+    def __init__(self, motor, deadman=DEADMAN_S):
+        super().__init__(daemon=True)
+        self.motor = motor
+        self.deadman = deadman
+        self.cond = threading.Condition()
+        self.pending = None
+        self.state = None
+        self.last_cmd = time.monotonic()
+        self.running = False
+
+    def submit(self, cmd, speed=None):
+        with self.cond:
+            self.last_cmd = time.monotonic()
+            if self.pending is None or PRIORITY.get(cmd, 0) >= PRIORITY.get(self.pending[0], 0):
+                self.pending = (cmd, speed)
+            self.cond.notify()
+
+    def _apply(self, cmd, speed):
+        if (cmd, speed) == self.state and cmd != "CLEANUP":
+            return
+        # DRIVE muda de velocidade quase a cada frame: INFO só quando o comando troca
+        level = logging.INFO if self.state is None or cmd != self.state[0] else logging.DEBUG
+        log.log(level, "Comando: %s%s", cmd, "" if speed is None else f" ({speed}%)")
+        try:
+            method = getattr(self.motor, COMMANDS[cmd])
+            with REGISTRY.timer("motor_apply"):
+                if cmd == "DRIVE":
+                    method(*speed)
+                elif speed is not None and cmd not in PRIORITY:
+                    method(speed)
+                else:
+                    method()
+            self.state = (cmd, speed)
+        except Exception as e:
+            log.exception("Erro aplicando comando %s: %s", cmd, e)
+
+    def run(self):
+        self.running = True
+        while self.running:
+            with self.cond:
+                timeout = None
+                if self.deadman and self.state is not None and self.state[0] not in PRIORITY:
+                    timeout = max(0.0, self.last_cmd + self.deadman - time.monotonic())
+                self.cond.wait_for(lambda: self.pending is not None or not self.running, timeout)
+                item, self.pending = self.pending, None
+            if item is not None:
+                self._apply(*item)
+            elif timeout is not None and time.monotonic() - self.last_cmd >= self.deadman:
+                log.warning("Deadman: nenhum comando em %.2f s, parando motores", self.deadman)
+                REGISTRY.inc("deadman_stops")
+                self._apply("STOP", None)
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+class Connection:
+    """
+    Estado por conexão: buffer, protocolo negociado e controle de sequência/latência.
+
+    A idade de um comando não compara direto os relógios do PC e do robô (sem
+    NTP a diferença pode ser de segundos): offset é o menor recebimento - send_ts
+    visto na conexão (atraso mínimo + diferença entre os relógios), e a idade é
+    o quanto o comando chegou atrasado além disso.
+    """
+    def __init__(self, addr):
+        self.addr = addr
+        self.buf = bytearray()
+        self.binary = False
+        self.offset = None
+        self.last_seq = -1
+        self.latency_ema = 0.0
+        self.dropped = 0
+
+    def commands(self, max_age=MAX_CMD_AGE_S):
+        """Consome o buffer e devolve a lista de (cmd, speed) válidos."""
+        if not self.binary:
+            if self.buf.startswith(HELLO_BIN):
+                del self.buf[:len(HELLO_BIN)]
+                self.binary = True
+                return None
+            return parse_lines(self.buf)
+        out = []
+        now = time.time()
+        for cmd, left, right, seq, ts in unpack_commands(self.buf):
+            delay = now - ts
+            if self.offset is None or delay < self.offset:
+                self.offset = delay
+            age = delay - self.offset
+            if seq <= self.last_seq or (max_age and age > max_age):
+                # fora de ordem ou velho demais: descarta
+                self.dropped += 1
+                REGISTRY.inc("commands_dropped")
+                continue
+            self.last_seq = seq
+            self.latency_ema = age if self.latency_ema == 0.0 else 0.9 * self.latency_ema + 0.1 * age
+            REGISTRY.observe("command_age", age)
+            if cmd == "DRIVE":
+                out.append((cmd, (left, right)))
+                continue
+            speed = max(abs(left), abs(right)) or None
+            out.append((cmd, speed))
+        return out
+
+def parse_lines(buf):
+    """Extrai todas as linhas completas de buf (bytearray, consumido in-place) como (cmd, speed)."""
+    end = buf.rfind(b"\n")
+    if end < 0:
+        return []
+    lines = bytes(buf[:end]).split(b"\n")
+    del buf[:end + 1]
+    cmds = []
+    for line in lines:
+        cmd = line.decode(errors="ignore").strip().upper()
+        if not cmd:
+            continue
+        name, *args = cmd.split()
+        if name == "DRIVE" and len(args) == 2:
+            try:
+                cmds.append((name, (int(args[0]), int(args[1]))))
+            except ValueError:
+                log.warning("Comando inválido: %s", cmd)
+        elif cmd in COMMANDS and cmd != "DRIVE":
+            cmds.append((cmd, None))
+        else:
+            log.warning("Comando desconhecido: %s", cmd)
+    return cmds
+
+def run_server(host=HOST, port=PORT, deadman=DEADMAN_S, max_age=MAX_CMD_AGE_S, metrics_port=None, metrics_log=None,
+               metrics_file=None, rate_hz=RATE_HZ, accel=ACCEL, decel=DECEL, gpio=None):
+    stop_metrics = metrics.start_exporters(metrics_port, metrics_log, metrics_file)
+    motor = MotorController(gpio=gpio, rate_hz=rate_hz, accel=accel, decel=decel)
+    actuator = Actuator(motor, deadman=deadman)
+    actuator.start()
+    sel = selectors.DefaultSelector()
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     s.bind((host, port))
-    s.listen(1)
+    s.listen(4)
+    s.setblocking(False)
+    sel.register(s, selectors.EVENT_READ, None)
     log.info("Server listening on %s:%d", host, port)
     try:
         while True:
-            conn, addr = s.accept()
-            threading.Thread(target=client_thread, args=(conn, addr, motor), daemon=True).start()
+            for key, _ in sel.select():
+                if key.data is None:
+                    conn, addr = s.accept()
+                    conn.setblocking(False)
+                    sel.register(conn, selectors.EVENT_READ, Connection(addr))
+                    log.info("Conexão recebida de %s", addr)
+                    continue
+                conn = key.fileobj
+                state = key.data
+                try:
+                    data = conn.recv(4096)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                except OSError as e:
+                    log.warning("Erro lendo de %s: %s", state.addr, e)
+                    data = b""
+                if not data:
+                    if state.binary:
+                        log.info("Atraso médio de comando %s (além do mínimo): %.1f ms, descartados: %d",
+                                 state.addr, state.latency_ema * 1000.0, state.dropped)
+                    log.info("Conexão encerrada: %s", state.addr)
+                    sel.unregister(conn)
+                    conn.close()
+                    continue
+                state.buf += data
+                cmds = state.commands(max_age)
+                if cmds is None:
+                    # handshake do protocolo binário
+                    conn.sendall(ACK_BIN)
+                    log.info("Cliente %s usa protocolo binário", state.addr)
+                    cmds = state.commands(max_age)
+                # todos os comandos já recebidos viram um único
+                item = coalesce(cmds)
+                if item is not None:
+                    actuator.submit(*item)
     finally:
+        actuator.stop()
+        actuator.join(timeout=1.0)
         motor.cleanup()
+        stop_metrics()
+        sel.close()
         s.close()
 
 if __name__ == "__main__":
-    run_server()
+    p = argparse.ArgumentParser()
+    p.add_argument("--port", type=int, default=PORT)
+    p.add_argument("--deadman-ms", type=float, default=DEADMAN_S * 1000.0,
+                   help="para os motores se nenhum comando chegar nesse intervalo (0 desliga)")
+    p.add_argument("--max-cmd-age-ms", type=float, default=MAX_CMD_AGE_S * 1000.0,
+                   help="descarta comandos binários atrasados mais que isso em relação ao mais rápido da conexão (0 desliga)")
+    p.add_argument("--actuator-hz", type=float, default=RATE_HZ, help="frequência do laço de atuação dos motores")
+    p.add_argument("--accel", type=float, default=ACCEL, help="aceleração máxima das rodas em %%/s")
+    p.add_argument("--decel", type=float, default=DECEL, help="desaceleração máxima das rodas em %%/s")
+    p.add_argument("--gpio-stub", action="store_true", help="não mexer no hardware (gpio_stub), para testes")
+    metrics.add_arguments(p)
+    args = p.parse_args()
+    gpio = None
+    if args.gpio_stub:
+        import gpio_stub
+        gpio = gpio_stub
+    run_server(port=args.port, deadman=args.deadman_ms / 1000.0, max_age=args.max_cmd_age_ms / 1000.0,
+               metrics_port=args.metrics_port, metrics_log=args.metrics_log, metrics_file=args.metrics_file,
+               rate_hz=args.actuator_hz, accel=args.accel, decel=args.decel, gpio=gpio)
@@ -0,0 +1,69 @@
+# src/startup.py
+"""
+Partida concorrente: câmera, modelo (com warm-up) e conexão sobem em threads
+paralelas em vez de em sequência, e o tempo de cada etapa vai para o log.
+
+    parts = parallel_start(camera=start_cam, detector=load_detector, link=connect)
+    cam, detector, link = parts["camera"], parts["detector"], parts["link"]
+"""
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import REGISTRY
+
+log = logging.getLogger("startup")
+
+T0 = time.perf_counter()  # aproximadamente o início do processo (import deste módulo)
+
+class StartupTimer:
+    """Acumula durações nomeadas da partida; steps extras (ex.: warm-up) podem ser anotados de dentro das tarefas."""
+    def __init__(self):
+        self.steps = {}
+
+    def record(self, name, seconds):
+        self.steps[name] = seconds
+        REGISTRY.observe("startup", seconds, step=name)
+
+    def report(self, ready_at=None):
+        total = (time.perf_counter() if ready_at is None else ready_at) - T0
+        parts = ", ".join(f"{k} {v:.2f} s" for k, v in self.steps.items())
+        log.info("Partida em %.2f s (%s)", total, parts)
+        REGISTRY.observe("startup", total, step="total")
+        return total
+
+def parallel_start(timer=None, cleanup=None, **tasks):
+    """
+    Roda cada tarefa (callable sem argumentos) numa thread e devolve {nome: resultado}.
+    Se alguma falhar, espera as outras, desfaz as que subiram com cleanup
+    ({nome: fn(resultado)}, ex.: parar a câmera) e relança a primeira exceção.
+    """
+    timer = timer or StartupTimer()
+
+    def timed(name, fn):
+        t0 = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            timer.record(name, time.perf_counter() - t0)
+
+    with ThreadPoolExecutor(max_workers=len(tasks), thread_name_prefix="startup") as pool:
+        futures = {name: pool.submit(timed, name, fn) for name, fn in tasks.items()}
+        results, error = {}, None
+        for name, fut in futures.items():
+            try:
+                results[name] = fut.result()
+            except Exception as e:
+                log.error("Falha na partida (%s): %s", name, e)
+                error = error or e
+    if error is not None:
+        for name, result in results.items():
+            undo = (cleanup or {}).get(name)
+            if undo is None:
+                continue
+            try:
+                undo(result)
+            except Exception as e:
+                log.warning("Falha desfazendo %s: %s", name, e)
+        raise error
+    return results
@@ -0,0 +1,159 @@
+# src/tracking.py
+import time
+
+import numpy as np
+
+from detections import Detections, box_iou
+
+class Tracks:
+    """Estado dos tracks em arrays alinhados: ids, caixas xyxy, confiança suavizada, classes, velocidade (px/s)."""
+    __slots__ = ("ids", "boxes", "confs", "classes", "velocities", "hits", "misses")
+
+    def __init__(self, ids, boxes, confs, classes, velocities, hits, misses):
+        self.ids = ids
+        self.boxes = boxes
+        self.confs = confs
+        self.classes = classes
+        self.velocities = velocities
+        self.hits = hits
+        self.misses = misses
+
+    def __len__(self):
+        return len(self.ids)
+
+    def as_detections(self):
+        return Detections(self.boxes, self.confs, self.classes)
+
+    def class_set(self):
+        return frozenset(self.classes.tolist())
+
+class IouTracker:
+    """
+    Tracker leve por IoU, vetorizado sobre as caixas. Entre execuções do detector
+    os tracks seguem por velocidade constante (predict); um track só é confirmado
+    após min_hits associações e sobrevive a até max_misses detecções perdidas,
+    então um frame sem detecção não derruba o comando.
+    """
+    def __init__(self, iou_thresh=0.3, min_hits=2, max_misses=5, conf_alpha=0.6, vel_alpha=0.5, miss_decay=0.8):
+        self.iou_thresh = iou_thresh
+        self.min_hits = min_hits
+        self.max_misses = max_misses
+        self.conf_alpha = conf_alpha
+        self.vel_alpha = vel_alpha
+        self.miss_decay = miss_decay
+        self.next_id = 1
+        self.last_time = None
+        self.ids = np.empty(0, np.int64)
+        self.boxes = np.empty((0, 4), np.float32)
+        self.confs = np.empty(0, np.float32)
+        self.classes = np.empty(0, np.int32)
+        self.velocities = np.empty((0, 2), np.float32)
+        self.hits = np.empty(0, np.int32)
+        self.misses = np.empty(0, np.int32)
+
+    def _advance(self, now):
+        dt = 0.0 if self.last_time is None else max(0.0, now - self.last_time)
+        self.last_time = now
+        if dt > 0 and len(self.ids):
+            shift = self.velocities * dt
+            self.boxes = self.boxes + np.concatenate([shift, shift], axis=1)
+        return dt
+
+    def _keep(self, mask):
+        self.ids, self.boxes, self.confs = self.ids[mask], self.boxes[mask], self.confs[mask]
+        self.classes, self.velocities = self.classes[mask], self.velocities[mask]
+        self.hits, self.misses = self.hits[mask], self.misses[mask]
+
+    def predict(self, now=None):
+        """Avança os tracks sem nova detecção (frames em que o detector não rodou)."""
+        self._advance(time.perf_counter() if now is None else now)
+        return self.confirmed()
+
+    def update(self, det, now=None):
+        now = time.perf_counter() if now is None else now
+        dt = self._advance(now)
+        n_tracks, n_dets = len(self.ids), len(det)
+
+        matched_t = np.empty(0, np.int64)
+        matched_d = np.empty(0, np.int64)
+        if n_tracks and n_dets:
+            iou = box_iou(self.boxes, det.boxes)
+            iou[self.classes[:, None] != det.classes[None, :]] = 0.0
+            # associação gulosa pelos maiores IoU
+            order = np.argsort(-iou, axis=None)
+            ti, di = np.unravel_index(order, iou.shape)
+            valid = iou[ti, di] >= self.iou_thresh
+            ti, di = ti[valid], di[valid]
+            used_t = np.zeros(n_tracks, bool)
+            used_d = np.zeros(n_dets, bool)
+            pairs = []
+            for t, d in zip(ti, di):
+                if not used_t[t] and not used_d[d]:
+                    used_t[t] = used_d[d] = True
+                    pairs.append((t, d))
+            if pairs:
+                matched_t, matched_d = (np.asarray(x, np.int64) for x in zip(*pairs))
+
+        if len(matched_t):
+            old_c = (self.boxes[matched_t, :2] + self.boxes[matched_t, 2:]) / 2.0
+            new_c = (det.boxes[matched_d, :2] + det.boxes[matched_d, 2:]) / 2.0
+            if dt > 0:
+                # old_c já está predito, então a diferença corrige a velocidade estimada
+                vel = self.velocities[matched_t] + (new_c - old_c) / dt
+                a = self.vel_alpha
+                self.velocities[matched_t] = a * vel + (1.0 - a) * self.velocities[matched_t]
+            self.boxes[matched_t] = det.boxes[matched_d]
+            a = self.conf_alpha
+            self.confs[matched_t] = a * det.confs[matched_d] + (1.0 - a) * self.confs[matched_t]
+            self.hits[matched_t] += 1
+            self.misses[matched_t] = 0
+
+        unmatched_t = np.ones(n_tracks, bool)
+        unmatched_t[matched_t] = False
+        self.misses[unmatched_t] += 1
+        self.confs[unmatched_t] *= self.miss_decay
+
+        new_d = np.ones(n_dets, bool)
+        new_d[matched_d] = False
+        n_new = int(new_d.sum())
+        if n_new:
+            self.ids = np.concatenate([self.ids, np.arange(self.next_id, self.next_id + n_new)])
+            self.next_id += n_new
+            self.boxes = np.concatenate([self.boxes, det.boxes[new_d]])
+            self.confs = np.concatenate([self.confs, det.confs[new_d]])
+            self.classes = np.concatenate([self.classes, det.classes[new_d]])
+            self.velocities = np.concatenate([self.velocities, np.zeros((n_new, 2), np.float32)])
+            self.hits = np.concatenate([self.hits, np.ones(n_new, np.int32)])
+            self.misses = np.concatenate([self.misses, np.zeros(n_new, np.int32)])
+
+        self._keep(self.misses <= self.max_misses)
+        return self.confirmed()
+
+    def confirmed(self):
+        mask = self.hits >= self.min_hits
+        return Tracks(self.ids[mask], self.boxes[mask], self.confs[mask], self.classes[mask],
+                      self.velocities[mask], self.hits[mask], self.misses[mask])
+
+class CommandHysteresis:
+    """
+    Só troca de comando quando o novo candidato se repete por `switch_frames`
+    frames seguidos (stop_frames para STOP), evitando FORWARD->STOP->FORWARD.
+    """
+    def __init__(self, switch_frames=2, stop_frames=None, initial="STOP"):
+        self.switch_frames = max(1, int(switch_frames))
+        self.stop_frames = self.switch_frames if stop_frames is None else max(1, int(stop_frames))
+        self.current = initial
+        self.candidate = None
+        self.count = 0
+
+    def update(self, cmd):
+        if cmd == self.current:
+            self.candidate, self.count = None, 0
+            return self.current
+        if cmd != self.candidate:
+            self.candidate, self.count = cmd, 0
+        self.count += 1
+        needed = self.stop_frames if cmd == "STOP" else self.switch_frames
+        if self.count >= needed:
+            self.current, self.candidate, self.count = cmd, None, 0
+        return self.current
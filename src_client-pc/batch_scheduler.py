@@ -0,0 +1,230 @@
+import threading
+import time
+import logging
+
+from detections import Detections
+from backends import predict
+
+log = logging.getLogger("batch_scheduler")
+
+class InferenceTimeout(TimeoutError):
+    """O frame já foi entregue ao modelo e o resultado não chegou a tempo (o frame ainda pode estar em uso)."""
+
+def weighted_share(capacity, cap, weights, key):
+    """
+    Fatia de `key` em capacity (frames/s) dividida pelos pesos, com teto cap por
+    cliente (um frame em voo por vez): o que um cliente no teto não consegue
+    usar vai para os outros.
+    """
+    left = dict(weights)
+    while left:
+        total = sum(left.values())
+        capped = [k for k, w in left.items() if capacity * w / total >= cap]
+        if not capped:
+            return capacity * left[key] / total
+        if key in capped:
+            return cap
+        for k in capped:
+            del left[k]
+        capacity -= cap * len(capped)
+    return cap
+
+class _Request:
+    __slots__ = ("client_id", "frame", "event", "result", "error", "submitted")
+
+    def __init__(self, client_id, frame):
+        self.client_id = client_id
+        self.frame = frame
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.submitted = time.perf_counter()
+
+class _Client:
+    __slots__ = ("weight", "vtime", "served", "stale")
+
+    def __init__(self, weight, vtime):
+        self.weight = weight
+        self.vtime = vtime  # frames atendidos / peso (fila justa ponderada)
+        self.served = 0
+        self.stale = 0
+
+class BatchInferenceScheduler(threading.Thread):
+    """
+    Junta o frame mais recente de cada cliente e roda uma única chamada
+    batched no modelo compartilhado, devolvendo a cada handler suas Detections.
+
+    Cada cliente tem um frame pendente por vez, então entra no máximo uma vez
+    por batch. Com mais clientes que max_batch, cada batch pega os de menor
+    tempo virtual (frames atendidos / peso): um cliente rápido não tira a vez
+    dos outros e os de peso maior entram em mais batches. Frames que esperaram
+    mais que max_age são descartados em vez de inferidos, e rate_hint() diz a
+    cada cliente quantos frames/s ele consegue ser atendido.
+
+    backend: o devolvido por load_model; NCNN e exports de batch fixo rodam o
+    batch um frame por chamada (backends.predict).
+    """
+    def __init__(self, model, imgsz=640, max_batch=8, max_wait=0.01, device="cpu", classes=None, max_age=None,
+                 backend="pytorch"):
+        super().__init__(daemon=True)
+        self.model = model
+        self.backend = backend
+        self.names = dict(getattr(model, "names", {}) or {})
+        self.classes = list(classes) if classes is not None else None
+        self.imgsz = imgsz
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait))
+        self.max_age = max_age
+        self.device = device
+        self.running = False
+        self.cond = threading.Condition()
+        self.pending = {}  # client_id -> _Request (latest-wins)
+        self.clients = {}  # client_id -> _Client
+        self.vclock = 0.0  # tempo virtual do último frame atendido
+        self.batches = 0
+        self.batch_ema = 0.0
+
+    def register(self, client_id, weight=1.0):
+        with self.cond:
+            if client_id not in self.clients:
+                self.clients[client_id] = _Client(max(float(weight), 1e-3), self.vclock)
+
+    def unregister(self, client_id):
+        with self.cond:
+            self.clients.pop(client_id, None)
+            req = self.pending.pop(client_id, None)
+            self.cond.notify_all()
+        if req is not None:
+            req.event.set()
+
+    def dropped(self, client_id):
+        """Frames deste cliente descartados por idade."""
+        client = self.clients.get(client_id)
+        return client.stale if client is not None else 0
+
+    def rate_hint(self, client_id):
+        """Frames/s que este cliente consegue ser atendido (None antes do primeiro batch)."""
+        with self.cond:
+            client = self.clients.get(client_id)
+            if client is None or self.batch_ema <= 0.0:
+                return None
+            # min(max_batch, clientes) vagas por batch, no máximo uma por cliente
+            slots = min(self.max_batch, len(self.clients))
+            weights = {k: c.weight for k, c in self.clients.items()}
+            return weighted_share(slots / self.batch_ema, 1.0 / self.batch_ema, weights, client_id)
+
+    def submit(self, client_id, frame):
+        req = _Request(client_id, frame)
+        with self.cond:
+            if client_id not in self.clients:
+                self.register(client_id)
+            client = self.clients[client_id]
+            # quem ficou parado não acumula crédito: volta no tempo virtual atual
+            client.vtime = max(client.vtime, self.vclock)
+            old = self.pending.get(client_id)
+            self.pending[client_id] = req
+            self.cond.notify_all()
+        if old is not None:
+            # frame antigo foi substituído antes de entrar num batch
+            old.event.set()
+        return req
+
+    def infer(self, client_id, frame, timeout=5.0):
+        """
+        Bloqueia até o resultado deste frame sair do batch. None se ele foi
+        descartado sem chegar ao modelo (substituído, velho ou cliente removido);
+        InferenceTimeout se o batch dele ainda está rodando.
+        """
+        req = self.submit(client_id, frame)
+        if not req.event.wait(timeout):
+            with self.cond:
+                dispatched = self.pending.get(client_id) is not req
+                if not dispatched:
+                    del self.pending[client_id]
+            log.warning("Timeout aguardando inferência do cliente %s", client_id)
+            if dispatched:
+                raise InferenceTimeout(f"inferência do cliente {client_id} passou de {timeout:.1f} s")
+            return None
+        if req.error is not None:
+            raise req.error
+        return req.result
+
+    def _expire(self):
+        """Tira de pending os frames mais velhos que max_age (com self.cond travado)."""
+        if self.max_age is None:
+            return []
+        limit = time.perf_counter() - self.max_age
+        stale = [req for req in self.pending.values() if req.submitted < limit]
+        for req in stale:
+            del self.pending[req.client_id]
+            client = self.clients.get(req.client_id)
+            if client is not None:
+                client.stale += 1
+        return stale
+
+    def _collect(self):
+        with self.cond:
+            while self.running and not self.pending:
+                self.cond.wait(0.5)
+            if not self.running:
+                return [], []
+            # espera até max_wait pelos outros clientes: com mais clientes que
+            # max_batch, o tempo virtual só escolhe entre quem já está pendente
+            deadline = time.perf_counter() + self.max_wait
+            target = max(1, len(self.clients))
+            while len(self.pending) < target:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or not self.running:
+                    break
+                self.cond.wait(remaining)
+            stale = self._expire()
+            # menor tempo virtual primeiro; no empate, o que espera há mais tempo
+            batch = sorted(self.pending.values(),
+                           key=lambda r: (self.clients[r.client_id].vtime, r.submitted))[:self.max_batch]
+            if batch:
+                # relógio virtual = menor tempo atendido, para não empurrar quem tem peso maior
+                self.vclock = max(self.vclock, self.clients[batch[0].client_id].vtime)
+            for req in batch:
+                del self.pending[req.client_id]
+                client = self.clients[req.client_id]
+                client.vtime += 1.0 / client.weight
+                client.served += 1
+            return batch, stale
+
+    def run(self):
+        self.running = True
+        log.info("Scheduler de inferência iniciado (max_batch=%d, max_wait=%.1f ms)",
+                 self.max_batch, self.max_wait * 1000.0)
+        while self.running:
+            batch, stale = self._collect()
+            for req in stale:
+                req.event.set()
+            if not batch:
+                continue
+            t0 = time.perf_counter()
+            try:
+                results = predict(self.model, self.backend, [req.frame for req in batch], batch=self.max_batch,
+                                  imgsz=self.imgsz, device=self.device, classes=self.classes, verbose=False)
+                for req, r in zip(batch, results):
+                    req.result = Detections.from_ultralytics(r)
+            except Exception as e:
+                log.exception("Erro na inferência batched: %s", e)
+                for req in batch:
+                    req.error = e
+            finally:
+                for req in batch:
+                    req.event.set()
+            dt = time.perf_counter() - t0
+            self.batches += 1
+            with self.cond:
+                self.batch_ema = dt if self.batch_ema == 0.0 else 0.9 * self.batch_ema + 0.1 * dt
+            log.debug("Batch de %d frames em %.1f ms", len(batch), dt * 1000.0)
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            pending = list(self.pending.values())
+            self.pending.clear()
+            self.cond.notify_all()
+        for req in pending:
+            req.event.set()
@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import deque
+
+class LatestQueue:
+    """
+    Fila limitada com semântica latest-wins: put() nunca bloqueia, descarta o item
+    mais antigo quando cheia. get() devolve None em timeout ou após close().
+    on_drop(item) é chamado com cada item descartado (ex.: devolver buffers ao pool).
+    """
+    def __init__(self, maxsize=1, on_drop=None):
+        self.items = deque(maxlen=max(1, int(maxsize)))
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+        self.on_drop = on_drop
+
+    def put(self, item):
+        old = None
+        with self.cond:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+                old = self.items.popleft()
+            self.items.append(item)
+            self.cond.notify()
+        if old is not None and self.on_drop is not None:
+            self.on_drop(old)
+
+    def get(self, timeout=None):
+        with self.cond:
+            if not self.items and not self.closed:
+                self.cond.wait_for(lambda: self.items or self.closed, timeout)
+            if not self.items:
+                return None
+            return self.items.popleft()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            items = list(self.items)
+            self.items.clear()
+            self.cond.notify_all()
+        if self.on_drop is not None:
+            for item in items:
+                self.on_drop(item)
+
+    def __len__(self):
+        return len(self.items)
+
+class BufferPool:
+    """
+    Pool de bytearrays reaproveitáveis. acquire(size) devolve um buffer com pelo
+    menos size bytes (tamanhos arredondados para `granularity`, então frames de
+    tamanho parecido caem no mesmo buffer); release() o devolve. Guarda no
+    máximo max_free buffers livres, o resto fica para o GC.
+    """
+    def __init__(self, max_free=8, granularity=64 * 1024):
+        self.max_free = max_free
+        self.granularity = granularity
+        self.lock = threading.Lock()
+        self.free = []
+        self.allocated = 0
+        self.reused = 0
+
+    def acquire(self, size):
+        cap = -(-max(1, size) // self.granularity) * self.granularity
+        with self.lock:
+            for i, buf in enumerate(self.free):
+                if cap <= len(buf) <= 2 * cap:
+                    self.reused += 1
+                    return self.free.pop(i)
+            self.allocated += 1
+        return bytearray(cap)
+
+    def release(self, buf):
+        if not isinstance(buf, bytearray):
+            return
+        with self.lock:
+            if len(self.free) < self.max_free:
+                self.free.append(buf)
+
+class StageStats:
+    """
+    Tempo por estágio (EMA, máximo e contagem), seguro entre threads. Com registry
+    (metrics.Registry) cada medida também entra no histograma do estágio.
+    """
+    def __init__(self, stages, alpha=0.9, registry=None, labels=None):
+        self.alpha = alpha
+        self.registry = registry
+        self.labels = labels or {}
+        self.lock = threading.Lock()
+        self.data = {name: {"count": 0, "ema_ms": 0.0, "max_ms": 0.0} for name in stages}
+
+    def record(self, stage, seconds):
+        ms = seconds * 1000.0
+        with self.lock:
+            d = self.data[stage]
+            d["ema_ms"] = ms if d["count"] == 0 else self.alpha * d["ema_ms"] + (1.0 - self.alpha) * ms
+            d["max_ms"] = max(d["max_ms"], ms)
+            d["count"] += 1
+        if self.registry is not None:
+            self.registry.observe(stage, seconds, **self.labels)
+
+    def ema_ms(self, stage):
+        with self.lock:
+            return self.data[stage]["ema_ms"]
+
+    def snapshot(self):
+        with self.lock:
+            return {name: dict(d) for name, d in self.data.items()}
+
+    def summary(self):
+        snap = self.snapshot()
+        return " | ".join(f"{name}: {d['ema_ms']:.1f} ms (n={d['count']})" for name, d in snap.items())
+
+class StageTimer:
+    """Context manager para medir um estágio: with StageTimer(stats, 'decode'): ..."""
+    __slots__ = ("stats", "stage", "t0")
+
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.record(self.stage, time.perf_counter() - self.t0)
+        return False
@@ -0,0 +1,125 @@
+import logging
+
+log = logging.getLogger("rate_control")
+
+def even(x):
+    return max(16, int(x) // 2 * 2)
+
+class RateController:
+    """
+    Ajusta qualidade JPEG, resolução e FPS do stream a partir do feedback:
+    rtt por frame, tempo de inferência informado pelo servidor (infer_ms),
+    tempo gasto no envio, tempo bloqueado esperando a janela de frames em voo e
+    frames descartados pelo servidor (drops).
+
+    Congestionado (rtt acima de target_ms ou envio lento): reduz qualidade,
+    depois resolução, depois FPS. Folgado por `patience` atualizações seguidas:
+    sobe na ordem inversa (FPS, resolução, qualidade). Cada botão fica entre o
+    piso e o teto dados.
+    Se o servidor informar imgsz, a largura máxima passa a ser imgsz: mandar mais
+    que isso só para o servidor reduzir de novo é banda perdida. Da mesma forma,
+    o FPS nunca passa da taxa rate= que o servidor reservou para este cliente.
+    """
+    def __init__(self, width=640, height=360, quality=80, fps=30.0, min_quality=35, max_quality=90,
+                 min_scale=0.4, min_fps=5.0, max_fps=30.0, target_ms=120.0, patience=10):
+        self.base = (width, height)
+        self.quality = float(min(max(quality, min_quality), max_quality))
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.scale = 1.0
+        self.min_scale = min_scale
+        self.max_scale = 1.0
+        self.fps = min(max(fps, min_fps), max_fps)
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self.target_ms = target_ms
+        self.patience = patience
+        self.rtt_ms = 0.0
+        self.infer_ms = 0.0
+        self.send_ms = 0.0
+        self.wait_ms = 0.0
+        self.good = 0
+        self.imgsz = None
+        self.drops = 0
+        self.server_drops = False
+        self.server_rate = None
+
+    def size(self):
+        w, h = self.base
+        return even(w * self.scale), even(h * self.scale)
+
+    def set_imgsz(self, imgsz):
+        if imgsz == self.imgsz or imgsz <= 0:
+            return
+        self.imgsz = imgsz
+        w, h = self.base
+        self.max_scale = min(1.0, imgsz / float(max(w, h)))
+        self.min_scale = min(self.min_scale, self.max_scale)
+        self.scale = min(self.scale, self.max_scale)
+        log.info("Servidor usa imgsz=%d: resolução máxima do stream %dx%d", imgsz,
+                 even(w * self.max_scale), even(h * self.max_scale))
+
+    def on_send(self, send_s, wait_s):
+        """Tempo de envio do frame e tempo bloqueado esperando a janela."""
+        self.send_ms = 0.8 * self.send_ms + 0.2 * send_s * 1000.0
+        self.wait_ms = 0.8 * self.wait_ms + 0.2 * wait_s * 1000.0
+
+    def on_reply(self, rtt_s, fields):
+        self.rtt_ms = rtt_s * 1000.0 if self.rtt_ms == 0.0 else 0.8 * self.rtt_ms + 0.2 * rtt_s * 1000.0
+        try:
+            if "infer_ms" in fields:
+                self.infer_ms = float(fields["infer_ms"])
+            if "imgsz" in fields:
+                self.set_imgsz(int(fields["imgsz"]))
+            if "rate" in fields:
+                self.server_rate = float(fields["rate"])
+            if "drops" in fields:
+                drops = int(fields["drops"])
+                self.server_drops = drops > self.drops
+                self.drops = drops
+        except ValueError:
+            pass
+        self._adjust()
+
+    def _adjust(self):
+        period_ms = 1000.0 / self.fps
+        # o que sobra do rtt além da inferência é rede + filas
+        congested = self.rtt_ms > self.target_ms or self.send_ms > 0.5 * period_ms
+        if congested:
+            self.good = 0
+            if self.quality > self.min_quality:
+                self.quality = max(self.min_quality, self.quality - 5)
+            elif self.scale > self.min_scale:
+                self.scale = max(self.min_scale, self.scale * 0.85)
+            elif self.fps > self.min_fps:
+                self.fps = max(self.min_fps, self.fps * 0.8)
+            return
+        # servidor mais lento que o stream: mandar mais rápido só enche as filas
+        if self.infer_ms > 0 and self.fps > 1000.0 / self.infer_ms and self.fps > self.min_fps:
+            self.fps = max(self.min_fps, 1000.0 / self.infer_ms)
+        # fatia do servidor dividido com outros robôs: o excedente seria descartado lá
+        if self.server_rate and self.fps > self.server_rate and self.fps > self.min_fps:
+            self.fps = max(self.min_fps, self.server_rate)
+        if self.server_drops:
+            self.good = 0
+            self.fps = max(self.min_fps, self.fps * 0.95)
+            return
+        if self.rtt_ms > 0.7 * self.target_ms or self.wait_ms > 0.5 * period_ms:
+            self.good = 0
+            return
+        self.good += 1
+        if self.good < self.patience:
+            return
+        self.good = 0
+        ceiling = min(self.max_fps, self.server_rate or self.max_fps)
+        if self.fps < ceiling and (not self.infer_ms or self.fps < 1000.0 / self.infer_ms):
+            self.fps = min(ceiling, self.fps * 1.1)
+        elif self.scale < self.max_scale:
+            self.scale = min(self.max_scale, self.scale / 0.85)
+        elif self.quality < self.max_quality:
+            self.quality = min(self.max_quality, self.quality + 5)
+
+    def summary(self):
+        w, h = self.size()
+        return (f"{w}x{h} q={self.quality:.0f} fps={self.fps:.1f} rtt={self.rtt_ms:.0f} ms "
+                f"infer={self.infer_ms:.0f} ms send={self.send_ms:.1f} ms")
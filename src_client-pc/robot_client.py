@@ -1,9 +1,10 @@
+import os
 import socket
-import struct
 import time
 import argparse
 import logging
 import sys
+import threading
 
 import cv2
 import numpy as np
@@ -15,6 +16,23 @@ try:
 except Exception:
     USE_PICAMERA2 = False
 
+# simplejpeg vem junto com o Picamera2 e codifica planos YUV sem conversão para BGR
+SIMPLEJPEG_AVAILABLE = False
+try:
+    import simplejpeg
+    SIMPLEJPEG_AVAILABLE = True
+except Exception:
+    SIMPLEJPEG_AVAILABLE = False
+
+# módulos compartilhados (src/)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import metrics
+from metrics import REGISTRY
+from recording import Recorder, ReplaySource
+
+from rate_control import RateController
+from stream_protocol import MAGIC_V2, pack_frame_v2, pack_datagrams, parse_reply
+
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("robot_client")
 
@@ -28,16 +46,22 @@ def recvall(sock, n):
     return bytes(data)
 
 class Camera:
-    def __init__(self, width=640, height=360, use_picamera=True, src=0):
+    """
+    capture_format="bgr": 'RGB888' da libcamera já é B,G,R em memória, sem cvtColor.
+    capture_format="yuv420": o sensor entrega YUV420 e read_jpeg() codifica os
+    planos direto (simplejpeg), sem passar por BGR.
+    """
+    def __init__(self, width=640, height=360, use_picamera=True, src=0, capture_format="bgr"):
         self.width = width
         self.height = height
         self.use_picamera = use_picamera and USE_PICAMERA2
         self.src = src
+        self.capture_format = capture_format if self.use_picamera else "bgr"
         if self.use_picamera:
-            log.info("Iniciando Picamera2 (libcamera)")
+            log.info("Iniciando Picamera2 (libcamera, %s)", self.capture_format)
             self.picam2 = Picamera2()
             config = self.picam2.create_preview_configuration({"size": (self.width, self.height)})
-            config['main']['format'] = 'RGB888'
+            config['main']['format'] = 'YUV420' if self.capture_format == "yuv420" else 'RGB888'
             self.picam2.configure(config)
             self.picam2.start()
             time.sleep(0.2)
@@ -54,12 +78,42 @@ class Camera:
             arr = self.picam2.capture_array()
             if arr is None:
                 return None
-            frame = cv2.cvtColor(arr, cv2.COLOR_RGB2BGR)
-            return frame
+            if self.capture_format == "yuv420":
+                return cv2.cvtColor(arr, cv2.COLOR_YUV2BGR_I420)
+            return arr
         else:
             ret, frame = self.cap.read()
             return frame if ret else None
 
+    def read_jpeg(self, quality=80, size=None):
+        """
+        Captura e codifica um frame; no modo yuv420 os planos vão direto ao encoder.
+        size=(w, h) reduz o frame antes de codificar (resolução adaptativa).
+        """
+        if size is not None and tuple(size) == (self.width, self.height):
+            size = None
+        if self.capture_format == "yuv420" and SIMPLEJPEG_AVAILABLE:
+            arr = self.picam2.capture_array()
+            if arr is None:
+                return None
+            h, w = self.height, self.width
+            y = arr[:h, :w]
+            u = arr[h:h + h // 4].reshape(h // 2, -1)[:, :w // 2]
+            v = arr[h + h // 4:h * 3 // 2].reshape(h // 2, -1)[:, :w // 2]
+            if size is not None:
+                sw, sh = size
+                y = cv2.resize(y, (sw, sh), interpolation=cv2.INTER_AREA)
+                u = cv2.resize(u, (sw // 2, sh // 2), interpolation=cv2.INTER_AREA)
+                v = cv2.resize(v, (sw // 2, sh // 2), interpolation=cv2.INTER_AREA)
+            return simplejpeg.encode_jpeg_yuv_planes(y, u, v, quality=int(quality))
+        frame = self.read()
+        if frame is None:
+            return None
+        if size is not None:
+            frame = cv2.resize(frame, tuple(size), interpolation=cv2.INTER_AREA)
+        ret, buf = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+        return buf.tobytes() if ret else None
+
     def release(self):
         if self.use_picamera:
             try:
@@ -72,66 +126,262 @@ class Camera:
             except Exception:
                 pass
 
-def run_stream(server_ip, server_port=8000, width=640, height=360, quality=80, use_picamera=True):
-    cam = Camera(width=width, height=height, use_picamera=use_picamera)
+class StreamClient:
+    """
+    Cliente pipelined (protocolo v2): o envio de frames e a leitura de comandos
+    rodam em threads separadas. Até `window` frames ficam em voo; cada comando
+    volta com o seq do frame que o originou. server_rate guarda a última taxa
+    (frames/s) que o servidor disse caber a este cliente; busy indica que o
+    servidor recusou a conexão por estar lotado.
+    """
+    def __init__(self, sock, window=2, reply_timeout=2.5, on_command=None):
+        self.sock = sock
+        self.window = max(1, int(window))
+        self.reply_timeout = reply_timeout
+        self.on_command = on_command
+        self.inflight = {}  # seq -> instante de envio
+        self.cond = threading.Condition()
+        self.seq = 0
+        self.running = False
+        self.last_command = None
+        self.rtt = 0.0
+        self.rtt_samples = 0  # respostas que trouxeram rtt novo (atrasadas/reordenadas não trazem)
+        self.last_wait = 0.0
+        self.last_send = 0.0
+        self.server_rate = None
+        self.busy = False
+        self.reader = threading.Thread(target=self._recv_loop, daemon=True)
+
+    def start(self):
+        self.running = True
+        self._hello()
+        self.reader.start()
+
+    def _hello(self):
+        self.sock.sendall(MAGIC_V2)
+
+    def _transmit(self, seq, jpg, capture_ts):
+        self.sock.sendall(pack_frame_v2(seq, jpg, capture_ts) + jpg)
+
+    def _expire(self, now):
+        for seq, sent in list(self.inflight.items()):
+            if now - sent > self.reply_timeout:
+                del self.inflight[seq]
+                REGISTRY.inc("replies_lost")
+                log.debug("Sem resposta para frame %d", seq)
+
+    def pending(self):
+        """(frames em voo, idade em s do mais antigo); usado para detectar um servidor travado sem bloquear."""
+        with self.cond:
+            self._expire(time.perf_counter())
+            if not self.inflight:
+                return 0, 0.0
+            return len(self.inflight), time.perf_counter() - min(self.inflight.values())
+
+    def send_frame(self, jpg, capture_ts=None):
+        """Envia um JPEG, bloqueando enquanto a janela de frames em voo estiver cheia."""
+        t0 = time.perf_counter()
+        with self.cond:
+            while self.running and len(self.inflight) >= self.window:
+                self._expire(time.perf_counter())
+                if len(self.inflight) < self.window:
+                    break
+                self.cond.wait(0.05)
+            if not self.running:
+                raise ConnectionError("Conexão encerrada")
+            self.seq += 1
+            seq = self.seq
+            self.inflight[seq] = time.perf_counter()
+        if capture_ts is None:
+            capture_ts = time.time()
+        t1 = time.perf_counter()
+        self._transmit(seq, jpg, capture_ts)
+        self.last_wait = t1 - t0
+        self.last_send = time.perf_counter() - t1
+        REGISTRY.observe("send_wait", self.last_wait)
+        REGISTRY.observe("send", self.last_send)
+        REGISTRY.inc("frames_sent")
+        return seq
+
+    def _recv_loop(self):
+        buf = bytearray()
+        try:
+            while self.running:
+                try:
+                    data = self.sock.recv(4096)
+                except socket.timeout:
+                    continue
+                except ConnectionRefusedError:
+                    # UDP: ICMP de porta fechada; o servidor pode ainda não estar de pé
+                    continue
+                if not data:
+                    log.info("Conexão fechada pelo servidor")
+                    break
+                buf += data
+                if b"\n" not in data:
+                    continue
+                # processa todas as linhas completas de uma vez
+                *lines, rest = buf.split(b"\n")
+                buf = bytearray(rest)
+                for line in lines:
+                    self._handle_reply(line)
+        except Exception as e:
+            if self.running:
+                log.exception("Erro lendo comando: %s", e)
+        finally:
+            with self.cond:
+                self.running = False
+                self.cond.notify_all()
+
+    def _handle_reply(self, line):
+        seq, cmd, fields = parse_reply(line)
+        if seq is None:
+            if cmd == "BUSY":
+                log.warning("Servidor lotado: conexão recusada")
+                with self.cond:
+                    self.busy = True
+                    self.running = False
+                    self.cond.notify_all()
+            return
+        if "rate" in fields:
+            try:
+                self.server_rate = float(fields["rate"])
+            except ValueError:
+                pass
+        now = time.perf_counter()
+        with self.cond:
+            sent = self.inflight.get(seq)
+            # frames anteriores sem resposta foram descartados pelo servidor
+            for s in [s for s in self.inflight if s <= seq]:
+                del self.inflight[s]
+            self.cond.notify_all()
+        if sent is not None:
+            self.rtt = now - sent
+            self.rtt_samples += 1
+            REGISTRY.observe("rtt", self.rtt)
+        self.last_command = (seq, cmd)
+        if self.on_command is not None:
+            self.on_command(seq, cmd, fields)
+        else:
+            log.info("Comando recebido (frame %d, rtt %.1f ms): %s", seq, self.rtt * 1000.0, cmd)
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+class UdpStreamClient(StreamClient):
+    """
+    Mesmo pipeline do StreamClient, mas cada frame vai em datagramas UDP
+    (stream_protocol.pack_datagrams). Sem retransmissão nem controle de fluxo do
+    TCP: um fragmento perdido descarta só aquele frame, e o próximo não espera
+    por ele. A janela de frames em voo continua limitando o envio.
+    """
+    def _hello(self):
+        pass
+
+    def _transmit(self, seq, jpg, capture_ts):
+        for dgram in pack_datagrams(seq, jpg, capture_ts):
+            self.sock.send(dgram)
+
+def connect(server_ip, server_port, transport="tcp"):
+    if transport == "udp":
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024 * 1024)
+        sock.connect((server_ip, server_port))
+        sock.settimeout(3.0)
+        return sock
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.settimeout(10.0)
-    log.info("Conectando ao servidor %s:%d ...", server_ip, server_port)
     sock.connect((server_ip, server_port))
-    sock.settimeout(3.0)  
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.settimeout(3.0)
+    return sock
+
+def run_stream(server_ip, server_port=8000, width=640, height=360, quality=80, use_picamera=True, window=2,
+               capture_format="bgr", transport="tcp", adaptive=False, min_quality=35, max_quality=90,
+               min_scale=0.4, min_fps=5.0, max_fps=30.0, target_ms=120.0, metrics_port=None, metrics_log=None,
+               metrics_file=None, record=None, replay=None, replay_speed=1.0, replay_loop=False):
+    stop_metrics = metrics.start_exporters(metrics_port, metrics_log, metrics_file)
+    if replay:
+        # a gravação entra no lugar da câmera; JPEGs gravados saem sem recodificar
+        cam = ReplaySource(replay, speed=replay_speed, loop=replay_loop)
+        width, height = cam.width or width, cam.height or height
+    else:
+        cam = Camera(width=width, height=height, use_picamera=use_picamera, capture_format=capture_format)
+    recorder = Recorder(record) if record else None
+    log.info("Conectando ao servidor %s:%d (%s) ...", server_ip, server_port, transport)
+    sock = connect(server_ip, server_port, transport)
+    rate = None
+    if adaptive:
+        rate = RateController(width, height, quality, fps=max_fps, min_quality=min_quality, max_quality=max_quality,
+                              min_scale=min_scale, min_fps=min_fps, max_fps=max_fps, target_ms=target_ms)
+    on_command = None
+    if rate is not None or recorder is not None:
+        def on_command(seq, cmd, fields):
+            if rate is not None:
+                rate.on_reply(client.rtt, fields)
+            if recorder is not None:
+                recorder.write_command(cmd, frame_id=seq)
+            log.debug("Comando recebido (frame %d, rtt %.1f ms): %s", seq, client.rtt * 1000.0, cmd)
+    client_cls = UdpStreamClient if transport == "udp" else StreamClient
+    client = client_cls(sock, window=window, on_command=on_command)
+    client.start()
     log.info("Conectado. Iniciando streaming de frames... (pressione CTRL+C para sair)")
 
+    last_log = time.perf_counter()
     try:
-        while True:
-            frame = cam.read()
-            if frame is None:
+        while client.running:
+            t0 = time.perf_counter()
+            capture_ts = time.time()
+            with REGISTRY.timer("capture_encode"):
+                if rate is not None:
+                    jpg = cam.read_jpeg(rate.quality, rate.size())
+                else:
+                    jpg = cam.read_jpeg(quality)
+            if jpg is None:
+                if replay and cam.exhausted:
+                    log.info("Fim da gravação.")
+                    break
                 log.debug("Frame None - pulando")
                 time.sleep(0.01)
                 continue
-
-            encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)]
-            ret, buf = cv2.imencode(".jpg", frame, encode_param)
-            if not ret:
-                log.warning("Falha ao codificar frame JPEG")
-                continue
-            data = buf.tobytes()
-            size = len(data)
-            sock.sendall(struct.pack(">I", size) + data)
-
-            cmd = b""
-            start = time.time()
-            try:
-                while True:
-                    ch = sock.recv(1)
-                    if not ch:
-                        raise ConnectionError("Conexão fechada pelo servidor")
-                    if ch == b"\n":
-                        break
-                    cmd += ch
-                    if time.time() - start > 2.5:  # 2.5s timeout para comando
-                        break
-            except socket.timeout:
-                log.debug("Timeout aguardando comando")
-                cmd = b""
-            except Exception as e:
-                log.exception("Erro lendo comando: %s", e)
-                raise
-
-            cmd_str = cmd.decode('utf-8', errors='ignore').strip()
-            if cmd_str:
-                log.info("Comando recebido: %s", cmd_str)
-            else:
-                log.debug("Nenhum comando recebido (vazio)")
-
-            time.sleep(0.01)
+            seq = client.send_frame(jpg, capture_ts)
+            if recorder is not None:
+                recorder.write_frame(ts=capture_ts, frame_id=seq, jpeg=jpg)
+            if rate is not None:
+                rate.on_send(client.last_send, client.last_wait)
+                now = time.perf_counter()
+                if now - last_log >= 5.0:
+                    last_log = now
+                    log.info("Stream: %s", rate.summary())
+                # limita o FPS ao que o controlador decidiu
+                delay = 1.0 / rate.fps - (now - t0)
+                if delay > 0:
+                    time.sleep(delay)
+            elif client.server_rate:
+                # sem controle adaptativo ainda respeita a parte do servidor
+                delay = 1.0 / client.server_rate - (time.perf_counter() - t0)
+                if delay > 0:
+                    time.sleep(delay)
     except KeyboardInterrupt:
         log.info("Encerrando por KeyboardInterrupt")
+    except ConnectionError as e:
+        log.info("Conexão encerrada: %s", e)
     finally:
-        try:
-            sock.close()
-        except:
-            pass
+        client.close()
         cam.release()
+        if recorder is not None:
+            recorder.close()
+        stop_metrics()
 
 if __name__ == "__main__":
     p = argparse.ArgumentParser()
@@ -141,5 +391,28 @@ if __name__ == "__main__":
     p.add_argument("--height", type=int, default=360)
     p.add_argument("--quality", type=int, default=80, help="JPEG quality 1-100")
     p.add_argument("--no-picam", dest="use_picamera", action="store_false", help="Forçar uso OpenCV/V4L2")
+    p.add_argument("--window", type=int, default=2, help="máximo de frames em voo aguardando comando")
+    p.add_argument("--capture-format", choices=("bgr", "yuv420"), default="bgr",
+                   help="yuv420: JPEG codificado direto dos planos YUV (requer simplejpeg)")
+    p.add_argument("--transport", choices=("tcp", "udp"), default="tcp",
+                   help="udp: frames em datagramas, sem retransmissão (use a --udp-port do servidor em --port)")
+    p.add_argument("--adaptive", action="store_true",
+                   help="ajusta qualidade/resolução/FPS pelo rtt e pela inferência informada pelo servidor")
+    p.add_argument("--min-quality", type=int, default=35)
+    p.add_argument("--max-quality", type=int, default=90)
+    p.add_argument("--min-scale", type=float, default=0.4, help="menor fração de --width/--height")
+    p.add_argument("--min-fps", type=float, default=5.0)
+    p.add_argument("--max-fps", type=float, default=30.0)
+    p.add_argument("--target-ms", type=float, default=120.0, help="rtt alvo por frame")
+    p.add_argument("--record", default=None, help="gravar os JPEGs enviados e os comandos recebidos")
+    p.add_argument("--replay", default=None, help="usar uma gravação no lugar da câmera")
+    p.add_argument("--replay-speed", type=float, default=1.0, help="velocidade do replay (0 = máxima)")
+    p.add_argument("--replay-loop", action="store_true", help="repetir a gravação")
+    metrics.add_arguments(p)
     args = p.parse_args()
-    run_stream(args.server, args.port, args.width, args.height, args.quality, use_picamera=args.use_picamera)
+    run_stream(args.server, args.port, args.width, args.height, args.quality, use_picamera=args.use_picamera,
+               window=args.window, capture_format=args.capture_format, transport=args.transport,
+               adaptive=args.adaptive, min_quality=args.min_quality, max_quality=args.max_quality,
+               min_scale=args.min_scale, min_fps=args.min_fps, max_fps=args.max_fps, target_ms=args.target_ms,
+               metrics_port=args.metrics_port, metrics_log=args.metrics_log, metrics_file=args.metrics_file,
+               record=args.record, replay=args.replay, replay_speed=args.replay_speed, replay_loop=args.replay_loop)
@@ -1,5 +1,7 @@
+import os
+import sys
+import abc
 import socket
-import struct
 import threading
 import logging
 import time
@@ -7,142 +9,548 @@ import argparse
 
 import cv2
 import numpy as np
-from ultralytics import YOLO
+
+# decodifica direto num buffer nosso (buffer=); sem ele cai no cv2.imdecode
+SIMPLEJPEG_AVAILABLE = False
+try:
+    import simplejpeg
+    SIMPLEJPEG_AVAILABLE = True
+except Exception:
+    SIMPLEJPEG_AVAILABLE = False
+
+# módulos compartilhados com o lado do robô (src/)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from preview import PreviewSink, draw_overlay
+from detections import draw_detections
+from tracking import IouTracker, CommandHysteresis
+from policy import Policy, add_arguments as add_policy_arguments
+from backends import BACKENDS, load_model
+import metrics
+from metrics import REGISTRY
+
+from batch_scheduler import BatchInferenceScheduler, InferenceTimeout
+from pipeline import BufferPool, LatestQueue, StageStats, StageTimer
+from worker_pool import ProcessWorkerPool
+from stream_protocol import (MAGIC_V2, FRAME_HDR_V1, FRAME_HDR_V2, MAX_FRAME_SIZE, BUSY_REPLY, FrameAssembler,
+                             format_reply)
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("server_pc")
 
-def recvall(sock, n):
-    data = bytearray()
-    while len(data) < n:
-        packet = sock.recv(n - len(data))
-        if not packet:
-            return None
-        data.extend(packet)
-    return bytes(data)
-
-def map_classes_to_command(detected_classes):
-    if not detected_classes:
-        return "STOP"
-    if 0 in detected_classes:
-        return "FORWARD"
-    if 2 in detected_classes:
-        return "LEFT"
-    return "STOP"
-
-class ClientHandler(threading.Thread):
-    def __init__(self, conn, addr, model, imgsz=640):
-        super().__init__(daemon=True)
-        self.conn = conn
+def recv_into(sock, view):
+    """Preenche view inteira com recv_into; False se a conexão fechar antes."""
+    got = 0
+    n = len(view)
+    while got < n:
+        k = sock.recv_into(view[got:])
+        if not k:
+            return False
+        got += k
+    return True
+
+class Admission:
+    """Limite de clientes simultâneos (TCP + UDP); max_clients=0 não limita."""
+    def __init__(self, max_clients=0):
+        self.max_clients = max(0, int(max_clients))
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.max_clients and self.active >= self.max_clients:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.active = max(0, self.active - 1)
+
+def parse_weight(text):
+    """"192.168.0.10=2" -> ("192.168.0.10", 2.0)"""
+    host, _, w = text.partition("=")
+    try:
+        weight = float(w)
+    except ValueError:
+        weight = 0.0
+    if not host or weight <= 0:
+        raise argparse.ArgumentTypeError(f"peso inválido: {text} (use IP=PESO, PESO > 0)")
+    return host, weight
+
+class ClientPipeline(abc.ABC):
+    """
+    Pipeline por cliente: um pool de threads decodifica, um estágio envia ao
+    scheduler de inferência e outro responde/exibe. Os estágios são ligados por
+    filas latest-wins, então o throughput é limitado pelo estágio mais lento e
+    não pela soma de todos. As subclasses alimentam feed() e implementam send_reply().
+
+    Frames que passaram de max_frame_age desde a recepção são descartados antes
+    da inferência, e as respostas v2 levam rate=, a taxa que o scheduler
+    consegue atender para este cliente (o robô não deve mandar mais que isso).
+    """
+    STAGES = ("recv", "decode", "infer", "reply")
+
+    def __init__(self, addr, scheduler, decode_workers=2, stats_interval=10.0, preview=None, track=True,
+                 switch_frames=2, policy_config=None, admission=None, weights=None, max_frame_age=None):
         self.addr = addr
-        self.model = model
-        self.imgsz = imgsz
+        self.scheduler = scheduler
+        self.admission = admission
+        self.weight = (weights or {}).get(addr[0], 1.0)
+        self.max_frame_age = max_frame_age
+        self.stale = 0
+        self.preview = preview
+        self.preview_name = f"Client {addr}"
+        self.tracker = IouTracker() if track else None
+        # política por cliente (a suavização tem estado); histerese só no modo discreto
+        self.policy = Policy(policy_config)
+        self.hysteresis = CommandHysteresis(switch_frames=switch_frames) if track and not self.policy.proportional else None
+        self.decode_workers = max(1, int(decode_workers))
+        self.stats_interval = stats_interval
         self.running = True
         self.prev_time = time.perf_counter()
         self.fps = 0.0
         self.alpha = 0.9
 
+        # mesmos estágios também vão para os histogramas globais (p50/p95/p99), por cliente
+        self.labels = {"client": f"{addr[0]}:{addr[1]}"}
+        self.stats = StageStats(self.STAGES, registry=REGISTRY, labels=self.labels)
+        # buffers de recepção (JPEG) e de frames decodificados reaproveitados entre frames
+        self.rx_pool = BufferPool(max_free=self.decode_workers + 2)
+        self.frame_pool = BufferPool(max_free=self.decode_workers + 4)
+        self.raw_q = LatestQueue(self.decode_workers, on_drop=lambda item: self.rx_pool.release(item[1]))
+        self.frame_q = LatestQueue(1, on_drop=lambda item: self.frame_pool.release(item[-1]))
+        self.result_q = LatestQueue(1, on_drop=lambda item: self.frame_pool.release(item[-1]))
+        self.proto = 1
+        self.seq = 0
+        self.last_decoded = -1
+        self.seq_lock = threading.Lock()
+        self.workers = []
+
+    def stage_stats(self):
+        snap = self.stats.snapshot()
+        snap["dropped"] = {"decode": self.raw_q.dropped, "infer": self.frame_q.dropped,
+                           "reply": self.result_q.dropped}
+        snap["fps"] = self.fps
+        return snap
+
+    def _decode(self, jpg, size):
+        """Devolve (frame, fbuf); fbuf é o buffer do pool que guarda o frame (ou None)."""
+        view = memoryview(jpg)[:size]
+        if SIMPLEJPEG_AVAILABLE:
+            try:
+                h, w, _, _ = simplejpeg.decode_jpeg_header(view)
+                fbuf = self.frame_pool.acquire(h * w * 3)
+                out = np.frombuffer(fbuf, np.uint8, h * w * 3).reshape(h, w, 3)
+                return simplejpeg.decode_jpeg(view, colorspace="BGR", buffer=out), fbuf
+            except Exception:
+                pass
+        return cv2.imdecode(np.frombuffer(view, dtype=np.uint8), cv2.IMREAD_COLOR), None
+
+    def _decode_loop(self):
+        while self.running:
+            item = self.raw_q.get(timeout=0.5)
+            if item is None:
+                if self.raw_q.closed:
+                    break
+                continue
+            seq, jpg, size, capture_ts, t_recv = item
+            with StageTimer(self.stats, "decode"):
+                frame, fbuf = self._decode(jpg, size)
+            self.rx_pool.release(jpg)
+            if frame is None:
+                log.warning("Falha ao decodificar JPEG")
+                self.frame_pool.release(fbuf)
+                continue
+            with self.seq_lock:
+                # com vários decoders um frame pode terminar depois de um mais novo
+                if seq < self.last_decoded:
+                    self.frame_pool.release(fbuf)
+                    continue
+                self.last_decoded = seq
+            self.frame_q.put((seq, frame, capture_ts, t_recv, fbuf))
+
+    def _infer_loop(self):
+        while self.running:
+            item = self.frame_q.get(timeout=0.5)
+            if item is None:
+                if self.frame_q.closed:
+                    break
+                continue
+            seq, frame, capture_ts, t_recv, fbuf = item
+            if self.max_frame_age and time.perf_counter() - t_recv > self.max_frame_age:
+                # velho demais para virar comando: descarta em vez de ocupar o modelo
+                self.stale += 1
+                REGISTRY.inc("frames_stale", **self.labels)
+                self.frame_pool.release(fbuf)
+                continue
+            try:
+                with StageTimer(self.stats, "infer"):
+                    det = self.scheduler.infer(self.addr, frame)
+            except InferenceTimeout:
+                # o batch/worker ainda pode estar lendo o frame: o buffer não volta ao pool
+                continue
+            if det is None:
+                # nunca chegou ao modelo: o buffer pode ser reaproveitado
+                self.frame_pool.release(fbuf)
+                continue
+            self.result_q.put((seq, frame, det, capture_ts, fbuf))
+
+    def _reply_loop(self):
+        last_log = time.perf_counter()
+        while self.running:
+            item = self.result_q.get(timeout=0.5)
+            if item is None:
+                if self.result_q.closed:
+                    break
+                continue
+            seq, frame, det, capture_ts, fbuf = item
+            t0 = time.perf_counter()
+
+            if self.tracker is not None:
+                det = self.tracker.update(det, t0).as_detections()
+            drive = self.policy.decide(det, frame.shape[1], frame.shape[0])
+            cmd = drive.name if self.hysteresis is None else self.hysteresis.update(drive.name)
+            wheels = {"left": drive.left, "right": drive.right} if self.policy.proportional else {}
+            REGISTRY.observe("postprocess", time.perf_counter() - t0, **self.labels)
+
+            if self.proto == 2:
+                # velocidades por roda (modo proporcional) e feedback para o controle de taxa do cliente
+                hint = self.scheduler.rate_hint(self.addr)
+                if hint is not None:
+                    wheels["rate"] = f"{hint:.1f}"
+                reply = format_reply(seq, cmd, **wheels, infer_ms=f"{self.stats.ema_ms('infer'):.1f}",
+                                     imgsz=self.scheduler.imgsz, drops=self.dropped())
+            else:
+                reply = (cmd + "\n").encode("utf-8")
+            try:
+                self.send_reply(reply)
+            except Exception as e:
+                log.exception("Erro enviando comando: %s", e)
+                self.stop()
+                break
+            if capture_ts:
+                # captura no robô -> comando enviado (relógios sincronizados por NTP)
+                REGISTRY.observe("end_to_end", max(0.0, time.time() - capture_ts), **self.labels)
+
+            now = time.perf_counter()
+            dt = now - self.prev_time
+            self.prev_time = now
+            if dt > 0:
+                inst_fps = 1.0 / dt
+                self.fps = inst_fps if self.fps == 0.0 else self.alpha * self.fps + (1 - self.alpha) * inst_fps
+
+            if self.preview is not None and self.preview.wants(self.preview_name):
+                # o preview renderiza depois, em outra thread: o buffer fica com ele (GC)
+                self.preview.submit(self.preview_name, lambda det=det, frame=frame, cmd=cmd, fps=self.fps:
+                                    draw_overlay(draw_detections(frame, det, self.scheduler.names), cmd, fps,
+                                                 scale=1.0))
+            else:
+                self.frame_pool.release(fbuf)
+            self.stats.record("reply", time.perf_counter() - t0)
+
+            if self.stats_interval and now - last_log >= self.stats_interval:
+                last_log = now
+                log.info("Estágios %s: %s (fps %.1f)", self.addr, self.stats.summary(), self.fps)
+
+    def dropped(self):
+        """Frames deste cliente que não viraram comando (filas, idade e scheduler)."""
+        return (self.raw_q.dropped + self.frame_q.dropped + self.result_q.dropped + self.stale
+                + self.scheduler.dropped(self.addr))
+
+    def start_stages(self):
+        self.scheduler.register(self.addr, self.weight)
+        for stage, q in (("decode", self.raw_q), ("infer", self.frame_q), ("reply", self.result_q)):
+            REGISTRY.gauge("frames_dropped", lambda q=q: q.dropped, stage=stage, **self.labels)
+        self.workers = [threading.Thread(target=self._decode_loop, daemon=True) for _ in range(self.decode_workers)]
+        self.workers.append(threading.Thread(target=self._infer_loop, daemon=True))
+        self.workers.append(threading.Thread(target=self._reply_loop, daemon=True))
+        for t in self.workers:
+            t.start()
+
+    def feed(self, seq, jpg, size=None, capture_ts=None):
+        if capture_ts:
+            REGISTRY.observe("uplink", max(0.0, time.time() - capture_ts), **self.labels)
+        REGISTRY.inc("frames_received", **self.labels)
+        self.raw_q.put((seq, jpg, len(jpg) if size is None else size, capture_ts, time.perf_counter()))
+
+    @abc.abstractmethod
+    def send_reply(self, data):
+        """Manda uma resposta já formatada (bytes) ao cliente."""
+
+    def stop(self):
+        self.running = False
+        for q in (self.raw_q, self.frame_q, self.result_q):
+            q.close()
+
+    def finish(self):
+        self.stop()
+        for t in self.workers:
+            t.join(timeout=2.0)
+        stale = self.stale + self.scheduler.dropped(self.addr)
+        self.scheduler.unregister(self.addr)
+        if self.admission is not None:
+            self.admission.release()
+        REGISTRY.remove(**self.labels)
+        log.info("Estágios %s: %s (buffers: rx %d alocados/%d reusados, frames %d/%d, velhos %d)", self.addr,
+                 self.stats.summary(), self.rx_pool.allocated, self.rx_pool.reused,
+                 self.frame_pool.allocated, self.frame_pool.reused, stale)
+
+class ClientHandler(ClientPipeline, threading.Thread):
+    """Cliente TCP: esta thread é o estágio de recepção (protocolos v1 e v2)."""
+    def __init__(self, conn, addr, scheduler, **kwargs):
+        threading.Thread.__init__(self, daemon=True)
+        ClientPipeline.__init__(self, addr, scheduler, **kwargs)
+        self.conn = conn
+
+    def send_reply(self, data):
+        self.conn.sendall(data)
+
+    def stop(self):
+        ClientPipeline.stop(self)
+        try:
+            # desbloqueia o recv da thread receptora
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+
     def run(self):
         log.info("Cliente conectado: %s", self.addr)
+        self.start_stages()
+        hdr = bytearray(FRAME_HDR_V2.size)
         try:
+            if not recv_into(self.conn, memoryview(hdr)[:4]):
+                return
+            if hdr[:4] == MAGIC_V2:
+                self.proto = 2
+                log.info("Cliente %s usa protocolo v2 (pipelined)", self.addr)
+            have_hdr = self.proto == 1
+            hdr_size = FRAME_HDR_V2.size if self.proto == 2 else FRAME_HDR_V1.size
             while self.running:
-                hdr = recvall(self.conn, 4)
-                if not hdr:
+                if not have_hdr and not recv_into(self.conn, memoryview(hdr)[:hdr_size]):
                     log.info("Conexão fechada pelo cliente %s", self.addr)
                     break
-                size = struct.unpack(">I", hdr)[0]
-                if size <= 0 or size > 20_000_000:
+                have_hdr = False
+                t0 = time.perf_counter()
+                if self.proto == 2:
+                    seq, size, capture_ts = FRAME_HDR_V2.unpack_from(hdr)
+                else:
+                    capture_ts = None
+                    size = FRAME_HDR_V1.unpack_from(hdr)[0]
+                    self.seq += 1
+                    seq = self.seq
+                if size <= 0 or size > MAX_FRAME_SIZE:
                     log.warning("Tamanho inválido recebido: %d", size)
                     break
-                jpg = recvall(self.conn, size)
-                if not jpg:
+                # recebe direto num buffer do pool, sem bytes intermediários
+                buf = self.rx_pool.acquire(size)
+                if not recv_into(self.conn, memoryview(buf)[:size]):
                     log.info("Erro recebendo dados JPG")
                     break
+                self.stats.record("recv", time.perf_counter() - t0)
+                self.feed(seq, buf, size, capture_ts)
 
-                arr = np.frombuffer(jpg, dtype=np.uint8)
-                frame = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-                if frame is None:
-                    log.warning("Falha ao decodificar JPEG")
-                    continue
+        except Exception as e:
+            if self.running:
+                log.exception("Erro no handler do cliente: %s", e)
+        finally:
+            self.finish()
+            try:
+                self.conn.close()
+            except:
+                pass
+            log.info("Handler finalizado para %s", self.addr)
 
-                now = time.perf_counter()
-                dt = now - self.prev_time
-                self.prev_time = now
-                if dt > 0:
-                    inst_fps = 1.0 / dt
-                    self.fps = inst_fps if self.fps == 0.0 else self.alpha * self.fps + (1 - self.alpha) * inst_fps
+class UdpClientSession(ClientPipeline):
+    """Cliente UDP: os frames chegam já remontados pelo UdpFrameServer; comandos voltam por datagrama."""
+    def __init__(self, sock, addr, scheduler, **kwargs):
+        super().__init__(addr, scheduler, **kwargs)
+        self.sock = sock
+        self.proto = 2
+        self.assembler = FrameAssembler()
+        self.last_seen = time.monotonic()
 
-                results = self.model(frame, imgsz=self.imgsz)
-                r = results[0]
-                try:
-                    annotated = r.plot()
-                except Exception:
-                    annotated = frame.copy()
-
-                classes = []
-                if hasattr(r, "boxes") and r.boxes is not None and len(r.boxes) > 0:
-                    try:
-                        cls = r.boxes.cls
-                        classes = [int(x) for x in cls.tolist()]
-                    except Exception:
-                        for box in r.boxes:
-                            try:
-                                classes.append(int(box.cls))
-                            except Exception:
-                                pass
-
-                cmd = map_classes_to_command(classes)
+    def send_reply(self, data):
+        self.sock.sendto(data, self.addr)
 
-                try:
-                    self.conn.sendall((cmd + "\n").encode("utf-8"))
-                except Exception as e:
-                    log.exception("Erro enviando comando: %s", e)
-                    break
+class UdpFrameServer(threading.Thread):
+    """
+    Recebe frames fragmentados em datagramas (stream_protocol.DGRAM_HDR) de
+    vários robôs num único socket UDP, remonta por endereço e descarta frames
+    incompletos ou superados em vez de esperar por eles.
+    """
+    def __init__(self, host, port, scheduler, session_timeout=5.0, admission=None, **session_kwargs):
+        super().__init__(daemon=True)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self.sock.bind((host, port))
+        self.sock.settimeout(1.0)
+        self.scheduler = scheduler
+        self.session_timeout = session_timeout
+        self.admission = admission
+        self.session_kwargs = dict(session_kwargs, admission=admission)
+        self.sessions = {}
+        self.rejected = {}  # addr -> último BUSY enviado
+        self.closing = {}  # addr -> thread encerrando a sessão antiga
+        self.running = False
+        log.info("Servidor UDP escutando em %s:%d", host, port)
 
-                cv2.putText(annotated, f"CMD: {cmd}", (10,30), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0,255,0), 2)
-                cv2.putText(annotated, f"FPS: {self.fps:.1f}", (10,70), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0,255,255), 2)
+    def _expire(self, now):
+        for addr, sess in list(self.sessions.items()):
+            if now - sess.last_seen > self.session_timeout:
+                log.info("Cliente UDP %s inativo; encerrando (frames descartados: %d)",
+                         addr, sess.assembler.dropped)
+                del self.sessions[addr]
+                # finish() junta as threads dos estágios: fora do laço de recepção dos outros robôs
+                closer = threading.Thread(target=sess.finish, daemon=True)
+                closer.start()
+                self.closing[addr] = closer
+        for addr, closer in list(self.closing.items()):
+            if not closer.is_alive():
+                del self.closing[addr]
+        for addr, t in list(self.rejected.items()):
+            if now - t > self.session_timeout:
+                del self.rejected[addr]
 
-                cv2.imshow(f"Client {self.addr}", annotated)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    log.info("Quit requested from display")
-                    self.running = False
+    def run(self):
+        self.running = True
+        buf = bytearray(65536)
+        last_expire = time.monotonic()
+        while self.running:
+            try:
+                n, addr = self.sock.recvfrom_into(buf)
+            except socket.timeout:
+                n = 0
+            except OSError:
+                if not self.running:
                     break
+                continue
+            now = time.monotonic()
+            if now - last_expire > 1.0:
+                last_expire = now
+                self._expire(now)
+            if n == 0:
+                continue
+            sess = self.sessions.get(addr)
+            if sess is None and addr in self.closing:
+                # a sessão anterior deste endereço ainda não liberou o registro no scheduler
+                if self.closing[addr].is_alive():
+                    continue
+                del self.closing[addr]
+            if sess is None and self.admission is not None and not self.admission.acquire():
+                # sem vaga: avisa no máximo uma vez por segundo e ignora os datagramas
+                if now - self.rejected.get(addr, 0.0) > 1.0:
+                    if addr not in self.rejected:
+                        log.warning("Cliente UDP %s recusado: limite de %d clientes", addr,
+                                    self.admission.max_clients)
+                        REGISTRY.inc("clients_rejected", transport="udp")
+                    self.rejected[addr] = now
+                    self.sock.sendto(BUSY_REPLY, addr)
+                continue
+            if sess is None:
+                self.rejected.pop(addr, None)
+                log.info("Cliente UDP conectado: %s", addr)
+                sess = UdpClientSession(self.sock, addr, self.scheduler, **self.session_kwargs)
+                sess.start_stages()
+                self.sessions[addr] = sess
+            sess.last_seen = now
+            frame = sess.assembler.add(memoryview(buf)[:n])
+            if frame is not None:
+                seq, jpg, capture_ts = frame
+                sess.feed(seq, jpg, capture_ts=capture_ts)
 
-        except Exception as e:
-            log.exception("Erro no handler do cliente: %s", e)
-        finally:
+    def stop(self):
+        self.running = False
+        for sess in self.sessions.values():
+            sess.finish()
+        self.sessions.clear()
+        self.sock.close()
+
+def run_server(host="0.0.0.0", port=8000, imgsz=640, model_name="yolov8n.pt", device="cpu",
+               max_batch=8, max_wait_ms=10.0, decode_workers=2, headless=False, preview_fps=10.0,
+               mjpeg_port=None, backend="pytorch", int8=False, track=True, switch_frames=2, udp_port=None,
+               workers=0, worker_threads=None, metrics_port=None, metrics_log=None, metrics_file=None,
+               policy_file=None, max_clients=0, max_frame_age_ms=None, client_weights=None, stop_event=None):
+    # stop_event: quem roda o servidor numa thread (ex.: bench) o encerra por ele
+    stop_event = stop_event or threading.Event()
+    stop_metrics = metrics.start_exporters(metrics_port, metrics_log, metrics_file, host=host)
+    # classes que geram comando vêm da política; as demais são descartadas já na inferência
+    policy = Policy.from_file(policy_file)
+    policy_config, action_classes = policy.cfg, policy.classes
+    max_age = max_frame_age_ms / 1000.0 if max_frame_age_ms else None
+    if workers > 0:
+        log.info("Iniciando %d workers de inferência: %s (device=%s, backend=%s)...", workers, model_name,
+                 device, backend)
+        scheduler = ProcessWorkerPool(model_name, backend, imgsz=imgsz, int8=int8, device=device,
+                                      classes=action_classes, workers=workers, threads=worker_threads,
+                                      max_batch=max_batch, max_age=max_age, max_wait=max_wait_ms / 1000.0)
+    else:
+        log.info("Carregando modelo YOLO: %s (device=%s, backend=%s)...", model_name, device, backend)
+        # ONNX/OpenVINO saem com batch dinâmico até max_batch; NCNN com batch 1 (um frame por chamada)
+        model, backend = load_model(model_name, backend, imgsz=imgsz, int8=int8, batch=max_batch)
+        if device != "cpu" and backend == "pytorch":
             try:
-                self.conn.close()
-            except:
-                pass
-            log.info("Handler finalizado para %s", self.addr)
+                model.to(device)
+            except Exception:
+                log.warning("Falha ao mover modelo para device %s. Usando CPU.", device)
+                device = "cpu"
 
-def run_server(host="0.0.0.0", port=8000, imgsz=640, model_name="yolov8n.pt", device="cpu"):
-    log.info("Carregando modelo YOLO: %s (device=%s)...", model_name, device)
-    model = YOLO(model_name)
-    if device != "cpu":
-        try:
-            model.to(device)
-        except Exception:
-            log.warning("Falha ao mover modelo para device %s. Usando CPU.", device)
-            device = "cpu"
+        scheduler = BatchInferenceScheduler(model, imgsz=imgsz, max_batch=max_batch,
+                                            max_wait=max_wait_ms / 1000.0, device=device, classes=action_classes,
+                                            max_age=max_age, backend=backend)
+    scheduler.start()
+
+    preview = None
+    if mjpeg_port:
+        preview = PreviewSink(max_fps=preview_fps, mode="mjpeg", host=host, port=mjpeg_port)
+    elif not headless:
+        preview = PreviewSink(max_fps=preview_fps, mode="window")
+    if preview is not None:
+        preview.start()
+
+    admission = Admission(max_clients)
+    REGISTRY.gauge("clients_active", lambda: admission.active)
+    session_kwargs = dict(decode_workers=decode_workers, preview=preview, track=track, switch_frames=switch_frames,
+                          policy_config=policy_config, weights=client_weights, max_frame_age=max_age)
+    udp_server = None
+    if udp_port:
+        udp_server = UdpFrameServer(host, udp_port, scheduler, admission=admission, **session_kwargs)
+        udp_server.start()
 
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     s.bind((host, port))
-    s.listen(1)
+    # backlog folgado: vários robôs reconectando juntos não devem levar RST; quem passa do limite recebe BUSY
+    s.listen(16)
+    s.settimeout(1.0)
     log.info("Servidor escutando em %s:%d", host, port)
 
     try:
-        while True:
-            conn, addr = s.accept()
-            handler = ClientHandler(conn, addr, model, imgsz=imgsz)
+        while not stop_event.is_set() and not (preview is not None and preview.quit_requested.is_set()):
+            try:
+                conn, addr = s.accept()
+            except socket.timeout:
+                continue
+            if not admission.acquire():
+                log.warning("Cliente %s recusado: limite de %d clientes", addr, admission.max_clients)
+                REGISTRY.inc("clients_rejected", transport="tcp")
+                try:
+                    conn.sendall(BUSY_REPLY)
+                finally:
+                    conn.close()
+                continue
+            conn.settimeout(None)
+            handler = ClientHandler(conn, addr, scheduler, admission=admission, **session_kwargs)
             handler.start()
     except KeyboardInterrupt:
         log.info("Servidor encerrando por KeyboardInterrupt")
     finally:
+        if udp_server is not None:
+            udp_server.stop()
+        scheduler.stop()
+        stop_metrics()
         s.close()
-        cv2.destroyAllWindows()
+        if preview is not None:
+            preview.stop()
 
 if __name__ == "__main__":
     p = argparse.ArgumentParser()
@@ -151,5 +559,37 @@ if __name__ == "__main__":
     p.add_argument("--imgsz", type=int, default=640, help="tamanho imgsz para inferência (yolov8 imgsz)")
     p.add_argument("--model", default="yolov8n.pt", help="caminho ou nome do modelo YOLO")
     p.add_argument("--device", default="cpu", help="device para rodar (cpu ou cuda)")
+    p.add_argument("--batch-size", type=int, default=8, help="máximo de frames por batch de inferência")
+    p.add_argument("--batch-wait-ms", type=float, default=10.0, help="espera máxima para completar um batch (ms); com --workers, quanto um slot livre "
+                        "espera por um robô de peso maior")
+    p.add_argument("--decode-workers", type=int, default=2, help="threads de decodificação JPEG por cliente")
+    p.add_argument("--headless", action="store_true", help="sem janelas e sem anotação de frames")
+    p.add_argument("--preview-fps", type=float, default=10.0, help="taxa máxima do preview por cliente")
+    p.add_argument("--mjpeg-port", type=int, default=None, help="servir preview MJPEG nesta porta HTTP")
+    p.add_argument("--backend", choices=("auto",) + BACKENDS, default="pytorch",
+                   help="runtime de inferência (modelos não-PyTorch são exportados uma vez e cacheados)")
+    p.add_argument("--int8", action="store_true", help="exportar o modelo quantizado INT8 (só backend OpenVINO)")
+    p.add_argument("--no-track", dest="track", action="store_false", help="decidir só pelo frame atual, sem tracker")
+    p.add_argument("--switch-frames", type=int, default=2, help="frames seguidos para trocar de comando")
+    p.add_argument("--udp-port", type=int, default=None, help="aceitar também frames por UDP nesta porta")
+    p.add_argument("--workers", type=int, default=0,
+                   help="processos de inferência, cada um com seu modelo (0 = scheduler no próprio processo)")
+    p.add_argument("--worker-threads", type=int, default=None,
+                   help="threads por worker (padrão: núcleos / workers)")
+    p.add_argument("--max-clients", type=int, default=0,
+                   help="máximo de robôs simultâneos (TCP + UDP); os demais recebem BUSY (0 = sem limite)")
+    p.add_argument("--max-frame-age-ms", type=float, default=None,
+                   help="descarta frames que esperam mais que isso pela inferência")
+    p.add_argument("--weight", action="append", default=[], type=parse_weight, metavar="IP=PESO",
+                   help="peso do robô na divisão do modelo (padrão 1; pode repetir)")
+    add_policy_arguments(p)
+    metrics.add_arguments(p)
     args = p.parse_args()
-    run_server(args.host, args.port, imgsz=args.imgsz, model_name=args.model, device=args.device)
+    run_server(args.host, args.port, imgsz=args.imgsz, model_name=args.model, device=args.device,
+               max_batch=args.batch_size, max_wait_ms=args.batch_wait_ms, decode_workers=args.decode_workers,
+               headless=args.headless, preview_fps=args.preview_fps, mjpeg_port=args.mjpeg_port,
+               backend=args.backend, int8=args.int8, track=args.track, switch_frames=args.switch_frames,
+               udp_port=args.udp_port, workers=args.workers, worker_threads=args.worker_threads,
+               metrics_port=args.metrics_port, metrics_log=args.metrics_log, metrics_file=args.metrics_file,
+               policy_file=args.policy, max_clients=args.max_clients, max_frame_age_ms=args.max_frame_age_ms,
+               client_weights=dict(args.weight))
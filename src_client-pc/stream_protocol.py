@@ -0,0 +1,117 @@
+"""
+Protocolo de streaming robot_client -> server_pc.
+
+v1 (legado): [size:u32][jpeg], resposta "CMD\\n" por frame (lock-step).
+v2 (pipelined): o cliente envia MAGIC_V2 logo após conectar e cada frame leva
+[seq:u32][size:u32][capture_ts:f64][jpeg]. A resposta é uma linha
+"<seq> <CMD> [chave=valor ...]\\n", então o cliente pode ter vários frames em
+voo e casar cada comando com o frame que o originou.
+
+UDP (opcional): cada frame é quebrado em datagramas de até DGRAM_PAYLOAD bytes
+com o cabeçalho DGRAM_HDR [magic][seq:u32][frag:u16][count:u16][size:u32][capture_ts:f64].
+Não há retransmissão: um frame com fragmento perdido é descartado e o próximo
+segue. A resposta é a mesma linha do v2, num datagrama por frame.
+
+Servidor lotado (--max-clients): a única resposta é BUSY_REPLY e a conexão é
+fechada (no UDP, os datagramas são ignorados). Com o servidor dividindo o
+modelo entre vários robôs, o campo rate= da resposta v2 é a taxa (frames/s)
+que cabe a este cliente.
+"""
+import struct
+
+MAGIC_V2 = b"RVP2"
+FRAME_HDR_V1 = struct.Struct(">I")
+FRAME_HDR_V2 = struct.Struct(">IId")
+MAX_FRAME_SIZE = 20_000_000
+
+DGRAM_MAGIC = b"RVU1"
+DGRAM_HDR = struct.Struct(">4sIHHId")
+# cabe num MTU Ethernet/Wi-Fi típico (1500) sem fragmentação IP
+DGRAM_PAYLOAD = 1400 - DGRAM_HDR.size
+
+def pack_frame_v2(seq, jpg, capture_ts):
+    return FRAME_HDR_V2.pack(seq & 0xFFFFFFFF, len(jpg), capture_ts)
+
+def pack_datagrams(seq, jpg, capture_ts, payload=DGRAM_PAYLOAD):
+    """Quebra um frame em datagramas prontos para sendto()."""
+    view = memoryview(jpg)
+    count = max(1, -(-len(view) // payload))
+    if count > 0xFFFF:
+        raise ValueError(f"frame grande demais para UDP: {len(view)} bytes")
+    seq &= 0xFFFFFFFF
+    return [DGRAM_HDR.pack(DGRAM_MAGIC, seq, i, count, len(view), capture_ts) + view[i * payload:(i + 1) * payload]
+            for i in range(count)]
+
+class FrameAssembler:
+    """
+    Remonta frames de um único remetente. Guarda só o frame em montagem mais
+    novo: fragmentos de frames mais velhos que o último entregue são ignorados e
+    um frame incompleto é abandonado quando chega fragmento de um mais novo.
+    """
+    def __init__(self):
+        self.seq = None
+        self.buf = None
+        self.received = None
+        self.missing = 0
+        self.capture_ts = 0.0
+        self.last_done = -1
+        self.dropped = 0
+
+    def add(self, datagram):
+        """Devolve (seq, jpg, capture_ts) quando o frame completa, senão None."""
+        if len(datagram) < DGRAM_HDR.size:
+            return None
+        magic, seq, idx, count, size, capture_ts = DGRAM_HDR.unpack_from(datagram)
+        if magic != DGRAM_MAGIC or idx >= count or size > MAX_FRAME_SIZE:
+            return None
+        if seq + 1024 < self.last_done:
+            # seq voltou bem para trás: o cliente reiniciou
+            self.last_done, self.seq = -1, None
+        if seq <= self.last_done:
+            return None
+        if seq != self.seq:
+            if self.seq is not None and seq < self.seq:
+                return None
+            if self.seq is not None:
+                self.dropped += 1
+            self.seq, self.capture_ts = seq, capture_ts
+            self.buf = bytearray(size)
+            self.received = bytearray(count)
+            self.missing = count
+        if len(self.received) != count or self.received[idx]:
+            return None
+        payload = datagram[DGRAM_HDR.size:]
+        start = idx * DGRAM_PAYLOAD
+        if start + len(payload) > len(self.buf):
+            return None
+        self.buf[start:start + len(payload)] = payload
+        self.received[idx] = 1
+        self.missing -= 1
+        if self.missing:
+            return None
+        jpg, self.buf, self.seq = bytes(self.buf), None, None
+        self.last_done = seq
+        return seq, jpg, self.capture_ts
+
+# resposta a um cliente recusado por falta de vaga (antes de qualquer frame)
+BUSY_REPLY = b"BUSY\n"
+
+def format_reply(seq, cmd, **fields):
+    parts = [str(seq), cmd]
+    parts.extend(f"{k}={v}" for k, v in fields.items())
+    return (" ".join(parts) + "\n").encode("utf-8")
+
+def parse_reply(line):
+    """Devolve (seq, cmd, fields); seq é None para respostas v1."""
+    parts = line.decode("utf-8", errors="ignore").split()
+    if not parts:
+        return None, "", {}
+    if not parts[0].isdigit():
+        return None, parts[0], {}
+    seq = int(parts[0])
+    cmd = parts[1] if len(parts) > 1 else ""
+    fields = {}
+    for p in parts[2:]:
+        k, _, v = p.partition("=")
+        fields[k] = v
+    return seq, cmd, fields
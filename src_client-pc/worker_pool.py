@@ -0,0 +1,329 @@
+import os
+import queue
+import threading
+import time
+import logging
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from batch_scheduler import InferenceTimeout, weighted_share
+
+log = logging.getLogger("worker_pool")
+
+# maior frame aceito por slot (1080p BGR)
+DEFAULT_SLOT_SIZE = 1920 * 1080 * 3
+
+def _worker_main(idx, shm_name, slot_size, req_q, resp_q, cfg):
+    """Processo worker: carrega seu próprio modelo e roda os frames lidos da memória compartilhada."""
+    threads = cfg["threads"]
+    if threads:
+        os.environ["OMP_NUM_THREADS"] = str(threads)
+    import cv2
+    cv2.setNumThreads(threads or 1)
+    try:
+        import torch
+        if threads:
+            torch.set_num_threads(threads)
+    except Exception:
+        pass
+    from backends import load_model, predict
+    from detections import Detections
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    model, backend = load_model(cfg["model_name"], cfg["backend"], imgsz=cfg["imgsz"], int8=cfg["int8"],
+                                batch=cfg["max_batch"])
+    if cfg["device"] != "cpu" and backend == "pytorch":
+        model.to(cfg["device"])
+    resp_q.put(("ready", idx, dict(getattr(model, "names", {}) or {}), backend))
+
+    running = True
+    while running:
+        msg = req_q.get()
+        if msg is None:
+            break
+        # junta o que já estiver na fila num único batch
+        batch = [msg]
+        while len(batch) < cfg["max_batch"]:
+            try:
+                msg = req_q.get_nowait()
+            except queue.Empty:
+                break
+            if msg is None:
+                running = False
+                break
+            batch.append(msg)
+        frames = [np.ndarray(shape, np.uint8, buffer=shm.buf, offset=slot * slot_size) for _, slot, shape in batch]
+        try:
+            results = predict(model, backend, frames, batch=cfg["max_batch"], imgsz=cfg["imgsz"], device=cfg["device"],
+                              classes=cfg["classes"], verbose=False)
+            for (req_id, _, _), r in zip(batch, results):
+                resp_q.put((req_id, Detections.from_ultralytics(r), None))
+        except Exception as e:
+            for req_id, _, _ in batch:
+                resp_q.put((req_id, None, repr(e)))
+        del frames
+    shm.close()
+
+class _Request:
+    __slots__ = ("worker", "slot", "client_id", "event", "result", "error", "sent")
+
+    def __init__(self, worker, slot, client_id):
+        self.worker = worker
+        self.slot = slot
+        self.client_id = client_id
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.sent = time.perf_counter()
+
+class _Worker:
+    def __init__(self, idx, n_slots, slot_size):
+        self.idx = idx
+        self.shm = shared_memory.SharedMemory(create=True, size=n_slots * slot_size)
+        self.n_slots = n_slots
+        self.free = list(range(n_slots))
+        self.clients = {}  # client_id -> peso
+        self.vtime = {}  # client_id -> frames atendidos / peso (fila justa ponderada)
+        self.vclock = 0.0
+        self.waiting = {}  # client_id -> instante em que pediu slot
+        self.freed = 0.0  # instante da última liberação de slot
+        self.inflight = 0
+        self.latency_ema = 0.0
+        self.proc = None
+        self.req_q = None
+        self.ready = threading.Event()
+        self.restarts = 0
+
+class ProcessWorkerPool:
+    """
+    Alternativa ao BatchInferenceScheduler com K processos, cada um com sua cópia
+    do modelo e número de threads fixo, fora do GIL do servidor. Os frames passam
+    por slots de memória compartilhada (só o índice do slot e o shape vão pela
+    fila), cada cliente fica preso ao worker menos carregado no registro e um
+    worker que morrer é reiniciado. Os slots de um worker vão para o cliente de
+    menor tempo virtual (frames atendidos / peso), como no scheduler; um slot
+    liberado espera até max_wait por um cliente à frente que está entre dois
+    frames. Mesma interface do scheduler: register, unregister, infer, dropped,
+    rate_hint, names, imgsz, stop.
+    """
+    def __init__(self, model_name, backend="pytorch", imgsz=640, int8=False, device="cpu", classes=None,
+                 workers=2, threads=None, max_batch=8, slot_size=DEFAULT_SLOT_SIZE, max_age=None, max_wait=0.01):
+        self.ctx = mp.get_context("spawn")
+        self.imgsz = imgsz
+        self.names = {}
+        self.slot_size = slot_size
+        self.max_age = max_age
+        self.max_wait = max(0.0, float(max_wait))
+        self.stale = {}  # client_id -> frames descartados por idade
+        n = max(1, int(workers))
+        self.cfg = dict(model_name=model_name, backend=backend, imgsz=imgsz, int8=int8, device=device,
+                        classes=list(classes) if classes is not None else None, max_batch=max(1, int(max_batch)),
+                        threads=threads if threads is not None else max(1, (os.cpu_count() or 1) // n))
+        self.workers = [_Worker(i, self.cfg["max_batch"], slot_size) for i in range(n)]
+        self.resp_q = self.ctx.Queue()
+        self.cond = threading.Condition()
+        self.assign = {}  # client_id -> _Worker
+        self.pending = {}  # req_id -> _Request
+        self.next_id = 0
+        self.running = False
+        self.collector = threading.Thread(target=self._collect_loop, daemon=True)
+        self.monitor = threading.Thread(target=self._monitor_loop, daemon=True)
+
+    def _spawn(self, w):
+        w.ready.clear()
+        w.req_q = self.ctx.Queue()
+        w.proc = self.ctx.Process(target=_worker_main, args=(w.idx, w.shm.name, self.slot_size, w.req_q,
+                                                             self.resp_q, self.cfg), daemon=True)
+        w.proc.start()
+
+    def start(self, ready_timeout=600.0):
+        self.running = True
+        self.collector.start()
+        # o primeiro worker exporta/cacheia o modelo; os outros só carregam do cache
+        self._spawn(self.workers[0])
+        if not self.workers[0].ready.wait(ready_timeout):
+            raise RuntimeError("Worker 0 não ficou pronto")
+        for w in self.workers[1:]:
+            self._spawn(w)
+        for w in self.workers[1:]:
+            w.ready.wait(ready_timeout)
+        self.monitor.start()
+        log.info("Pool de inferência com %d processos (%d threads cada)", len(self.workers), self.cfg["threads"])
+
+    def _collect_loop(self):
+        while self.running:
+            try:
+                msg = self.resp_q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            if msg[0] == "ready":
+                _, idx, names, backend = msg
+                self.names = self.names or names
+                log.info("Worker %d pronto (backend %s)", idx, backend)
+                self.workers[idx].ready.set()
+                continue
+            req_id, det, error = msg
+            with self.cond:
+                req = self.pending.pop(req_id, None)
+                if req is None:
+                    continue
+                self._release(req)
+                w, dt = req.worker, time.perf_counter() - req.sent
+                w.latency_ema = dt if w.latency_ema == 0.0 else 0.9 * w.latency_ema + 0.1 * dt
+            req.result = det
+            if error is not None:
+                req.error = RuntimeError(f"worker {req.worker.idx}: {error}")
+            req.event.set()
+
+    def _release(self, req):
+        req.worker.free.append(req.slot)
+        req.worker.inflight -= 1
+        req.worker.freed = time.perf_counter()
+        self.cond.notify_all()
+
+    def _busy(self, w):
+        return {r.client_id for r in self.pending.values() if r.worker is w}
+
+    def _may_take(self, w, client_id):
+        """Com self.cond travado: client_id pode pegar um slot livre de w agora?"""
+        if not w.free:
+            return False
+        vt = lambda c: w.vtime.get(c, w.vclock)
+        if min(w.waiting, key=lambda c: (vt(c), w.waiting[c])) != client_id:
+            return False
+        if time.perf_counter() - w.freed >= self.max_wait:
+            return True
+        # quem acabou de ser atendido ainda não voltou a pedir: se ele está à frente, o slot o espera
+        busy = self._busy(w)
+        return not any(max(vt(c), w.vclock) < vt(client_id)
+                       for c in w.clients if c not in w.waiting and c not in busy)
+
+    def _monitor_loop(self):
+        while self.running:
+            time.sleep(0.5)
+            for w in self.workers:
+                if not self.running or w.proc.is_alive():
+                    continue
+                log.warning("Worker %d morreu (exitcode %s); reiniciando", w.idx, w.proc.exitcode)
+                # a fila nova entra junto com os slots liberados: um infer() nessa
+                # janela não pode mandar o frame para a fila do processo morto
+                with self.cond:
+                    lost = [(rid, req) for rid, req in self.pending.items() if req.worker is w]
+                    for rid, req in lost:
+                        del self.pending[rid]
+                    w.free = list(range(w.n_slots))
+                    w.inflight = 0
+                    w.restarts += 1
+                    self._spawn(w)
+                    self.cond.notify_all()
+                for _, req in lost:
+                    req.event.set()
+
+    def register(self, client_id, weight=1.0):
+        with self.cond:
+            if client_id in self.assign:
+                return self.assign[client_id]
+            w = min(self.workers, key=lambda w: (sum(w.clients.values()), w.inflight))
+            w.clients[client_id] = max(float(weight), 1e-3)
+            self.assign[client_id] = w
+            self.stale[client_id] = 0
+        log.info("Cliente %s -> worker %d", client_id, w.idx)
+        return w
+
+    def unregister(self, client_id):
+        with self.cond:
+            w = self.assign.pop(client_id, None)
+            if w is not None:
+                w.clients.pop(client_id, None)
+                w.vtime.pop(client_id, None)
+            self.stale.pop(client_id, None)
+
+    def dropped(self, client_id):
+        """Frames deste cliente descartados por idade."""
+        return self.stale.get(client_id, 0)
+
+    def rate_hint(self, client_id):
+        """Frames/s que este cliente consegue ser atendido pelo seu worker (None sem medida ainda)."""
+        with self.cond:
+            w = self.assign.get(client_id)
+            if w is None or w.latency_ema <= 0.0:
+                return None
+            # até n_slots frames em voo por worker, no máximo um por cliente, repartidos pelos pesos
+            slots = min(len(w.clients), w.n_slots)
+            return weighted_share(slots / w.latency_ema, 1.0 / w.latency_ema, w.clients, client_id)
+
+    def infer(self, client_id, frame, timeout=5.0):
+        """
+        Bloqueia até as Detections deste frame. None se ele não chegou ao worker
+        (sem slot a tempo, velho ou grande demais) ou se o worker reiniciou;
+        InferenceTimeout se o worker não respondeu a tempo.
+        """
+        w = self.assign.get(client_id) or self.register(client_id)
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        if frame.nbytes > self.slot_size:
+            log.warning("Frame de %d bytes maior que o slot (%d); descartado", frame.nbytes, self.slot_size)
+            return None
+        t0 = time.perf_counter()
+        with self.cond:
+            # quem ficou parado não acumula crédito: volta no tempo virtual atual
+            w.vtime[client_id] = max(w.vtime.get(client_id, 0.0), w.vclock)
+            w.waiting[client_id] = t0
+            try:
+                while self.running and not self._may_take(w, client_id):
+                    remaining = t0 + timeout - time.perf_counter()
+                    if remaining <= 0:
+                        return None
+                    self.cond.wait(min(remaining, self.max_wait or remaining))
+            finally:
+                del w.waiting[client_id]
+                self.cond.notify_all()
+            if not self.running:
+                return None
+            if self.max_age is not None and time.perf_counter() - t0 > self.max_age:
+                # esperou demais por um slot: o frame já não representa a cena
+                self.stale[client_id] = self.stale.get(client_id, 0) + 1
+                return None
+            slot = w.free.pop()
+            if client_id in w.clients:
+                # relógio virtual = menor tempo entre quem pede ou está em voo, para não empurrar quem tem peso maior
+                active = self._busy(w) | set(w.waiting) | {client_id}
+                w.vclock = max(w.vclock, min(w.vtime.get(c, w.vclock) for c in active))
+                w.vtime[client_id] += 1.0 / w.clients[client_id]
+            w.inflight += 1
+            self.next_id += 1
+            req_id = self.next_id
+            req = _Request(w, slot, client_id)
+            self.pending[req_id] = req
+            req_q = w.req_q
+        np.ndarray(frame.shape, np.uint8, buffer=w.shm.buf, offset=slot * self.slot_size)[...] = frame
+        req_q.put((req_id, slot, frame.shape))
+        if not req.event.wait(timeout):
+            # o slot só volta com a resposta ou com o reinício do worker (ele ainda pode estar lendo)
+            log.warning("Timeout aguardando inferência do cliente %s", client_id)
+            raise InferenceTimeout(f"inferência do cliente {client_id} passou de {timeout:.1f} s")
+        if req.error is not None:
+            raise req.error
+        return req.result
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            pending = list(self.pending.values())
+            self.pending.clear()
+            self.cond.notify_all()
+        for req in pending:
+            req.event.set()
+        for w in self.workers:
+            if w.proc is not None and w.proc.is_alive():
+                w.req_q.put(None)
+        for w in self.workers:
+            if w.proc is not None:
+                w.proc.join(timeout=2.0)
+                if w.proc.is_alive():
+                    w.proc.terminate()
+            w.shm.close()
+            w.shm.unlink()